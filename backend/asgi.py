@@ -0,0 +1,333 @@
+"""
+ASGI entry point - /api/chat served on asyncio, every other route by the Flask app
+
+The Flask chat view holds a server thread for the whole Groq round-trip, so the number of
+concurrent chats a sync deployment can carry is its thread count. Here /api/chat and
+/api/expert-advice run as coroutines on one event loop (AsyncGroqAgriBot over aiohttp) and the
+rest of the API is served by the unchanged Flask app through asgiref's WsgiToAsgi adapter.
+
+Run:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Compare concurrent chat capacity at fixed memory against the sync path (uses a local Groq stand-in):
+    python asgi.py benchmark --requests 2000 --delay 2 --threads 32
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import threading
+import subprocess
+from datetime import datetime
+from typing import Dict, Any
+from urllib.parse import parse_qs
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+import groq_service
+
+CHAT_PATHS = ('/api/chat', '/api/expert-advice')
+
+# Groq calls that outlived their latency budget; referenced until done so they are not garbage collected
+background_tasks = set()
+
+
+async def _iterate_in_thread(iterator):
+    """Drive a blocking iterator (local model generation) from the event loop, one executor hop per item"""
+    loop = asyncio.get_running_loop()
+    finished = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, finished)
+        if item is finished:
+            return
+        yield item
+
+
+async def astream_chat_events(message: str, context: Dict, priority: int, user_id: str = None):
+    """Async stream_chat_events: relay Groq deltas, falling back to the knowledge base if Groq fails or misses the budget before any text"""
+    events = async_agribot.stream_farming_advice(message, context, priority=priority, user_id=user_id)
+    if uses_latency_budget(priority):
+        events = groq_service.aiter_within_budget(events, background_tasks)
+    sent_text = False
+    async for event in events:
+        if event['type'] == 'error' and not sent_text:
+            reason, failed_provider = groq_service.fallback_reason(event), event.get('provider')
+            logger.warning(f"⚠️ Groq stream failed ({reason}), using knowledge base fallback...")
+            break
+        if event['type'] == 'delta':
+            sent_text = True
+        if event['type'] == 'done':
+            report_chat_path(event, 'cache' if event.get('cache_hit') else 'groq')
+        yield event
+        if event['type'] in ('done', 'error'):
+            return
+    else:
+        return
+
+    local_answered = False
+    async for event in _iterate_in_thread(local_llm_events(message, user_id, reason)):
+        local_answered = True
+        yield event
+    if local_answered:
+        return
+    response = knowledge_base_answer(message, context, fallback_history_user(user_id, reason))
+    yield {'type': 'delta', 'content': response.get('advice', '')}
+    response.update({'type': 'done', 'provider': 'knowledge_base', 'fallback_used': True})
+    yield report_chat_path(response, 'knowledge_base', reason, failed_provider)
+
+
+async def _read_body(receive) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _send_json(send, payload: Dict[str, Any], status: int = 200):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _with_cors(send, origin: str):
+    """Wrap `send` so the response carries the same origin allowlist Flask-CORS applies to the Flask routes"""
+    if origin not in CORS_ORIGINS:
+        return send
+
+    async def send_with_cors(message):
+        if message['type'] == 'http.response.start':
+            message = dict(message, headers=[*message.get('headers', []),
+                                             (b'access-control-allow-origin', origin.encode('latin-1')),
+                                             (b'vary', b'Origin')])
+        await send(message)
+    return send_with_cors
+
+
+async def chat(scope, receive, send):
+    """Async /api/chat: same request and response shapes as the Flask view"""
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+    query = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+    try:
+        if 'application/json' not in headers.get('content-type', ''):
+            return await _send_json(send, {'success': False, 'error': 'Request must be JSON'}, 400)
+        data = json.loads(await _read_body(receive) or b'null')
+        if not data or 'message' not in data:
+            return await _send_json(send, {'success': False, 'error': 'Message field is required'}, 400)
+        message = data['message'].strip()
+        if not message:
+            return await _send_json(send, {'success': False, 'error': 'Message cannot be empty'}, 400)
+
+        context = data.get('context', {})
+        user_id = groq_service.chat_user_id(data, headers.get('x-user-id'))
+        priority_name = data.get('priority', 'interactive')
+        if priority_name not in groq_service.PRIORITIES:
+            return await _send_json(send, {
+                'success': False,
+                'error': f'Invalid priority. Options: {", ".join(groq_service.PRIORITIES)}'
+            }, 400)
+        priority = groq_service.PRIORITIES[priority_name]
+
+        stream_requested = data.get('stream') or query.get('stream') == 'true' \
+            or 'text/event-stream' in headers.get('accept', '')
+        if stream_requested:
+            stream_format = data.get('stream_format') or query.get('format') or 'sse'
+            if stream_format not in groq_service.STREAM_FORMATS:
+                return await _send_json(send, {
+                    'success': False,
+                    'error': f'Invalid stream_format. Options: {", ".join(groq_service.STREAM_FORMATS)}'
+                }, 400)
+            logger.info(f"🌊 Async streaming AgriBot chat request ({stream_format}): {message[:100]}...")
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', groq_service.STREAM_MIMETYPES[stream_format].encode()),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no')
+            ]})
+            async for event in astream_chat_events(message, context, priority, user_id):
+                frame = groq_service.format_stream_event(event, stream_format).encode('utf-8')
+                await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        logger.info(f"🌐 Async multilingual AgriBot chat request: {message[:100]}...")
+        advice = async_agribot.get_farming_advice(message, context, priority=priority, user_id=user_id)
+        if uses_latency_budget(priority):
+            response = await groq_service.acall_within_budget(advice, background_tasks)
+        else:
+            response = await advice
+        if response.get('success'):
+            response = finish_chat_response(response, message, context, user_id)
+        else:
+            # The fallback may run the local model on the CPU; keep it off the event loop
+            response = await asyncio.get_running_loop().run_in_executor(
+                None, finish_chat_response, response, message, context, user_id, priority)
+        await _send_json(send, response)
+
+    except Exception as e:
+        logger.error(f"❌ Async chat endpoint error: {e}")
+        await _send_json(send, {
+            'success': False,
+            'error': f'Server error: {str(e)}',
+            'advice': 'I am experiencing technical difficulties. Please try again later.',
+            'multilingual_support': False,
+            'timestamp': datetime.now().isoformat()
+        }, 500)
+
+
+async def lifespan(scope, receive, send):
+    """Close the aiohttp pool when the server shuts down"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if groq_service.async_groq_session is not None:
+                await groq_service.async_groq_session.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI app: native async chat when Groq and aiohttp are available, Flask for everything else"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in CHAT_PATHS \
+            and async_agribot is not None:
+        origin = dict(scope['headers']).get(b'origin', b'').decode('latin-1')
+        return await chat(scope, receive, _with_cors(send, origin))
+    return await flask_application(scope, receive, send)
+
+
+def _create_async_agribot():
+    if not groq_enabled or groq_service.async_groq_session is None:
+        logger.warning("⚠️ Async chat disabled (Groq or aiohttp unavailable); /api/chat served by Flask")
+        return None
+    return AsyncGroqAgriBot(api_key=agribot.api_key)
+
+
+def _rss_peak_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _bench_worker(mode: str, requests_count: int, threads: int) -> Dict[str, Any]:
+    """Issue `requests_count` distinct chats through one path and report time, memory and threads"""
+    import logging
+    import contextlib
+    logging.disable(logging.WARNING)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        from farming_expert_app_ai import GroqAgriBot, AsyncGroqAgriBot
+    questions = [f"How much urea per acre for wheat plot {i}?" for i in range(requests_count)]
+    baseline_mb = _rss_peak_mb()
+    peak_threads = [threading.active_count()]
+    started = time.perf_counter()
+
+    if mode == 'async':
+        bot = AsyncGroqAgriBot()
+
+        async def run_all():
+            results = await asyncio.gather(*(bot.get_farming_advice(q) for q in questions))
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            await bot.async_session.close()
+            return results
+
+        results = asyncio.run(run_all())
+        peak_in_flight = bot.async_session.stats['peak_in_flight']
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        bot = GroqAgriBot()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [pool.submit(bot.get_farming_advice, q) for q in questions]
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            results = [future.result() for future in futures]
+        peak_in_flight = bot.session.stats['peak_in_flight']
+
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': mode if mode == 'async' else f'sync x{threads} threads',
+        'requests': requests_count,
+        'succeeded': sum(1 for result in results if result.get('success')),
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(requests_count / elapsed, 1),
+        'peak_in_flight': peak_in_flight,
+        'peak_threads': peak_threads[0],
+        'rss_growth_mb': round(max(0.0, _rss_peak_mb() - baseline_mb), 1)
+    }
+
+
+def run_benchmark(requests_count: int = 2000, delay: float = 2.0, threads: int = 32) -> list:
+    """Run the sync path (fixed pool, then one thread per call) and the async path against a Groq stand-in"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    here = os.path.dirname(os.path.abspath(__file__))
+    stub = subprocess.Popen([sys.executable, os.path.join(here, 'groq_service.py'), 'stub-server',
+                             '--port', str(port), '--delay', str(delay)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    env = dict(os.environ, GROQ_API_KEY='gsk_benchmark', GROQ_BASE_URL=f'http://127.0.0.1:{port}',
+               GROQ_CACHE_ENABLED='false', GROQ_SEMANTIC_CACHE_ENABLED='false',
+               GROQ_RATE_LIMIT_ENABLED='false', GROQ_COALESCE_ENABLED='false',
+               CROP_MODEL_PRELOAD='false', GROQ_READ_TIMEOUT=str(delay * 10 + 30))
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        results = []
+        for mode, worker_threads in (('sync', threads), ('sync', requests_count), ('async', 0)):
+            pool_env = dict(env, GROQ_POOL_MAXSIZE=str(max(worker_threads, 1)))
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), 'bench-worker', '--mode', mode,
+                                     '--requests', str(requests_count), '--threads', str(worker_threads)],
+                                    env=pool_env, capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        return results
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ != '__main__':
+    if WsgiToAsgi is None:
+        raise ImportError("asgiref is required for the ASGI entry point: pip install asgiref uvicorn aiohttp")
+    from farming_expert_app_ai import (app as flask_app, agribot, groq_enabled, AsyncGroqAgriBot, CORS_ORIGINS,
+                                       fallback_history_user, finish_chat_response, knowledge_base_answer, local_llm_events,
+                                       report_chat_path, uses_latency_budget, logger)
+    flask_application = WsgiToAsgi(flask_app)
+    async_agribot = _create_async_agribot()
+
+elif len(sys.argv) > 1 and sys.argv[1] in ('benchmark', 'bench-worker'):
+    parser = argparse.ArgumentParser(description='Async chat entry point tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark', help='Compare sync and async chat concurrency')
+    bench_parser.add_argument('--requests', type=int, default=2000)
+    bench_parser.add_argument('--delay', type=float, default=2.0, help='Stand-in Groq latency in seconds')
+    bench_parser.add_argument('--threads', type=int, default=32, help='Sync worker threads (gunicorn --threads)')
+    worker_parser = subparsers.add_parser('bench-worker')
+    worker_parser.add_argument('--mode', choices=('sync', 'async'), required=True)
+    worker_parser.add_argument('--requests', type=int, required=True)
+    worker_parser.add_argument('--threads', type=int, default=32)
+    args = parser.parse_args()
+
+    if args.command == 'bench-worker':
+        print(json.dumps(_bench_worker(args.mode, args.requests, args.threads)))
+        sys.exit(0)
+
+    print(f"⏱️ {args.requests} distinct chats, stand-in Groq latency {args.delay}s")
+    for row in run_benchmark(args.requests, args.delay, args.threads):
+        print(f"  {row['mode']:<22} {row['seconds']:>7.2f}s  {row['requests_per_second']:>7.1f} req/s  "
+              f"in flight {row['peak_in_flight']:>5}  threads {row['peak_threads']:>5}  "
+              f"RSS +{row['rss_growth_mb']:.1f} MB  ok {row['succeeded']}/{row['requests']}")
+
+else:
+    import uvicorn
+    uvicorn.run('asgi:application', host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
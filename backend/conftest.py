@@ -0,0 +1,17 @@
+"""
+Shared pytest setup for the backend unit tests.
+Services read their configuration at import time, so keep model preloading, state files and snapshots off
+before any test module imports them.
+"""
+import os
+import sys
+
+os.environ.setdefault('CROP_MODEL_PRELOAD', 'false')
+os.environ.setdefault('GROQ_RATE_STATE_FILE', '')
+os.environ.setdefault('GROQ_SEMANTIC_CACHE_ENABLED', 'false')
+os.environ.setdefault('LOCAL_LLM_ENABLED', 'false')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Manual scripts that call the live Groq API (python test_groq_api.py)
+collect_ignore = ['test_groq_api.py', 'test_multilingual_ai.py']
@@ -0,0 +1,1323 @@
+"""
+Crop Image Analysis Service - shared, warm model registry for crop/leaf image inference
+
+Compare inference backends:
+    python crop_image_service.py compare --images ./sample_leaves --tolerance 0.02
+
+Export the classifier for ONNX Runtime:
+    python crop_image_service.py export-onnx --output models/efficientnet_b0.onnx
+"""
+import io
+import os
+import sys
+import copy
+import json
+import tempfile
+import time
+import argparse
+import logging
+import queue
+import hashlib
+import threading
+import multiprocessing
+import uuid
+import socket
+import ipaddress
+from urllib.parse import urlparse
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    from PIL import Image, UnidentifiedImageError
+except ImportError:
+    np = None
+    Image = None
+    UnidentifiedImageError = None
+
+# PyTorch is only needed for the torch runtime and for exporting ONNX models
+try:
+    import torch
+    from torchvision import models
+except ImportError:
+    torch = None
+    models = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# Model registry configuration
+CROP_MODEL_NAME = 'efficientnet_b0'
+CROP_MODEL_PRELOAD = os.getenv('CROP_MODEL_PRELOAD', 'true').lower() == 'true'
+CROP_MODEL_WEIGHTS = os.getenv('CROP_MODEL_WEIGHTS')  # optional local state_dict for offline deployments
+
+# Inference backend: eager | torchscript | static_int8 (conv layers quantized, calibrated)
+INFERENCE_BACKENDS = ('eager', 'torchscript', 'static_int8')
+# dynamic_int8 only quantized Linear layers - EfficientNet-B0's single classifier head - and so ran as fp32;
+# existing configs naming it get the static int8 path
+INFERENCE_BACKEND_ALIASES = {'dynamic_int8': 'static_int8'}
+CROP_INFERENCE_BACKEND = os.getenv('CROP_INFERENCE_BACKEND', 'eager').lower()
+CROP_INFERENCE_BACKEND = INFERENCE_BACKEND_ALIASES.get(CROP_INFERENCE_BACKEND, CROP_INFERENCE_BACKEND)
+CROP_CALIBRATION_DIR = os.getenv('CROP_CALIBRATION_DIR')  # sample leaf images for static_int8 calibration
+CROP_BACKEND_TOLERANCE = float(os.getenv('CROP_BACKEND_TOLERANCE', 0.02))  # allowed top-1 disagreement vs eager
+
+# Inference runtime: torch (uses CROP_INFERENCE_BACKEND) | onnxruntime (CPU execution provider)
+INFERENCE_RUNTIMES = ('torch', 'onnxruntime')
+CROP_INFERENCE_RUNTIME = os.getenv('CROP_INFERENCE_RUNTIME', 'torch').lower()
+CROP_ONNX_MODEL_PATH = os.getenv('CROP_ONNX_MODEL_PATH',
+                                 os.path.join(os.path.dirname(__file__), 'models', 'efficientnet_b0.onnx'))
+CROP_ORT_THREADS = int(os.getenv('CROP_ORT_THREADS', 0))  # 0 = let ONNX Runtime decide
+ONNX_INPUT_NAME = 'input'
+
+# Micro-batching configuration
+CROP_BATCHING_ENABLED = os.getenv('CROP_BATCHING_ENABLED', 'true').lower() == 'true'
+CROP_BATCH_MAX_SIZE = int(os.getenv('CROP_BATCH_MAX_SIZE', 8))
+CROP_BATCH_MAX_WAIT_MS = float(os.getenv('CROP_BATCH_MAX_WAIT_MS', 10))
+CROP_BATCH_QUEUE_DEPTH = int(os.getenv('CROP_BATCH_QUEUE_DEPTH', 64))
+CROP_BATCH_RESULT_TIMEOUT = float(os.getenv('CROP_BATCH_RESULT_TIMEOUT', 30))
+
+# Inference worker processes (0 = run inference inside the Flask process).
+# Spawned workers re-import this module, so they never start a pool of their own.
+_IS_WORKER_PROCESS = multiprocessing.current_process().name != 'MainProcess'
+CROP_WORKER_PROCESSES = 0 if _IS_WORKER_PROCESS else int(os.getenv('CROP_WORKER_PROCESSES', 0))
+CROP_WORKER_THREADS = int(os.getenv('CROP_WORKER_THREADS',
+                                    max(1, (os.cpu_count() or 1) // max(1, CROP_WORKER_PROCESSES))))
+
+# Multi-image batch configuration
+CROP_MULTI_IMAGE_MAX = int(os.getenv('CROP_MULTI_IMAGE_MAX', 20))
+CROP_PREPROCESS_WORKERS = int(os.getenv('CROP_PREPROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+
+# In-memory upload decoding configuration
+CROP_UPLOAD_MAX_MB = float(os.getenv('CROP_UPLOAD_MAX_MB', 16))
+CROP_DECODE_SIZE = int(os.getenv('CROP_DECODE_SIZE', 256))  # matches Resize(256)
+
+# Result cache configuration
+CROP_CACHE_ENABLED = os.getenv('CROP_CACHE_ENABLED', 'true').lower() == 'true'
+CROP_CACHE_MAX_ENTRIES = int(os.getenv('CROP_CACHE_MAX_ENTRIES', 2048))
+CROP_CACHE_TTL = float(os.getenv('CROP_CACHE_TTL', 6 * 3600))
+CROP_CACHE_HASH_DISTANCE = int(os.getenv('CROP_CACHE_HASH_DISTANCE', 2))  # max differing bits of 64; 0 = exact only
+CROP_CACHE_COLOUR_DISTANCE = int(os.getenv('CROP_CACHE_COLOUR_DISTANCE', 12))  # max per-channel average colour shift
+
+# Bundled class label sets: name -> (file, expected number of classes or None)
+LABEL_SETS = {
+    'imagenet': (os.path.join(os.path.dirname(__file__), 'imagenet_classes.txt'), 1000),
+}
+CROP_LABEL_SET = os.getenv('CROP_LABEL_SET', 'imagenet')
+
+# ImageNet normalisation used by the pretrained torchvision weights
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+class LabelTable:
+    """Immutable class-index to label table, parsed once from a bundled file"""
+
+    def __init__(self, name: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.labels = tuple(labels)
+
+    @classmethod
+    def from_file(cls, name: str, path: str, expected_count: int = None) -> 'LabelTable':
+        """Parse one label per line and validate the class count"""
+        with open(path, 'r', encoding='utf-8') as f:
+            labels = tuple(line.strip() for line in f if line.strip())
+        if expected_count is not None and len(labels) != expected_count:
+            raise ValueError(f"{os.path.basename(path)} should have {expected_count} classes, found {len(labels)}")
+        return cls(name, labels)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def get(self, pred_idx: int) -> str:
+        """Get the label for a class index"""
+        if 0 <= pred_idx < len(self.labels):
+            return self.labels[pred_idx]
+        return f"Unknown class (index {pred_idx})"
+
+
+def register_label_set(name: str, path: str, expected_count: int = None):
+    """Register an additional bundled label set, e.g. for a fine-tuned crop-disease model"""
+    LABEL_SETS[name] = (path, expected_count)
+
+
+def load_label_set(name: str = CROP_LABEL_SET) -> LabelTable:
+    """Load a registered label set; CROP_LABELS_PATH overrides the file for the active set"""
+    if name not in LABEL_SETS:
+        raise ValueError(f"Unknown label set '{name}'. Available: {', '.join(LABEL_SETS)}")
+    path, expected_count = LABEL_SETS[name]
+    return LabelTable.from_file(name, os.getenv('CROP_LABELS_PATH', path), expected_count)
+
+
+# Parse the active label set once at startup
+try:
+    crop_labels = load_label_set()
+    label_load_error = None
+except Exception as e:
+    crop_labels = None
+    label_load_error = str(e)
+    logger.error(f"❌ Crop label set load error: {e}")
+
+
+def is_available(runtime: str = None) -> bool:
+    """Check whether PIL, NumPy and the selected inference runtime are installed"""
+    runtime = runtime or CROP_INFERENCE_RUNTIME
+    if Image is None or np is None:
+        return False
+    if runtime == 'onnxruntime':
+        return ort is not None
+    return torch is not None
+
+
+def resize_and_crop(img, resize: int = 256, crop: int = 224):
+    """Resize the short side and centre-crop, matching torchvision Resize(256) + CenterCrop(224) on PIL images"""
+    width, height = img.size
+    short, long = (width, height) if width <= height else (height, width)
+    if short != resize:
+        new_short, new_long = resize, int(resize * long / short)
+        new_size = (new_short, new_long) if width <= height else (new_long, new_short)
+        img = img.resize(new_size, Image.BILINEAR)
+        width, height = new_size
+    top = int(round((height - crop) / 2.0))
+    left = int(round((width - crop) / 2.0))
+    return img.crop((left, top, left + crop, top + crop))
+
+
+def to_pixels(img):
+    """PIL image -> compact (224, 224, 3) uint8 model input"""
+    return np.asarray(resize_and_crop(img), dtype=np.uint8)
+
+
+def normalize_pixels(pixels):
+    """(N, 224, 224, 3) uint8 -> normalised (N, 3, 224, 224) float32, same as ToTensor + Normalize"""
+    batch = pixels.astype(np.float32).transpose(0, 3, 1, 2) / np.float32(255.0)
+    mean = np.array(IMAGENET_MEAN, dtype=np.float32).reshape(1, 3, 1, 1)
+    std = np.array(IMAGENET_STD, dtype=np.float32).reshape(1, 3, 1, 1)
+    return np.ascontiguousarray((batch - mean) / std)
+
+
+def postprocess_logits(logits) -> List[Tuple[float, int]]:
+    """Softmax + top-1 on (N, classes) logits, shared by every runtime"""
+    logits = logits - logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=1, keepdims=True)
+    pred_idxs = probs.argmax(axis=1)
+    return [(float(probs[row, idx]), int(idx)) for row, idx in enumerate(pred_idxs)]
+
+
+def load_calibration_batch(images_dir: str = None, limit: int = 32):
+    """Load sample images as (N, 224, 224, 3) uint8 pixels; None when the directory holds no readable images"""
+    pixels = []
+    if images_dir and os.path.isdir(images_dir):
+        for name in sorted(os.listdir(images_dir)):
+            if len(pixels) >= limit:
+                break
+            try:
+                with open(os.path.join(images_dir, name), 'rb') as f:
+                    pixels.append(to_pixels(decode_image(f.read())))
+            except Exception as e:
+                logger.warning(f"⚠️ Skipping calibration image {name}: {e}")
+    return np.stack(pixels) if pixels else None
+
+
+def random_calibration_batch(count: int = 8):
+    """Random (N, 224, 224, 3) uint8 pixels, only for benchmarking backends without sample images"""
+    return np.random.randint(0, 256, size=(count, 224, 224, 3), dtype=np.uint8)
+
+
+def export_onnx(model, path: str) -> str:
+    """Export an fp32 eval-mode torch model to ONNX with a dynamic batch dimension"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, torch.zeros(1, 3, 224, 224), path,
+            input_names=[ONNX_INPUT_NAME], output_names=['logits'],
+            dynamic_axes={ONNX_INPUT_NAME: {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=13
+        )
+    return path
+
+
+def create_onnx_session(path: str, threads: int = None):
+    """Open an ONNX Runtime session on the CPU execution provider (threads default: CROP_ORT_THREADS at call time,
+    which inference worker processes pin to their share of the cores)"""
+    if threads is None:
+        threads = CROP_ORT_THREADS
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+def build_inference_backend(model, backend: str, calibration_batch=None):
+    """Convert an fp32 eval-mode model into the selected CPU inference backend (static_int8 needs a
+    normalised calibration batch of real images)"""
+    backend = INFERENCE_BACKEND_ALIASES.get(backend, backend)
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}'. Options: {', '.join(INFERENCE_BACKENDS)}")
+    example = torch.zeros(1, 3, 224, 224)
+
+    if backend == 'eager':
+        return model
+    if backend == 'torchscript':
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+        return torch.jit.freeze(traced.eval())
+    # static_int8: FX graph mode post-training quantization with calibration
+    if calibration_batch is None:
+        raise ValueError("static_int8 needs a calibration batch (set CROP_CALIBRATION_DIR to sample leaf images)")
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(copy.deepcopy(model), qconfig_mapping, (example,))
+    with torch.no_grad():
+        for start in range(0, len(calibration_batch), 8):
+            prepared(calibration_batch[start:start + 8])
+    return convert_fx(prepared)
+
+
+class CropModelRegistry:
+    """Loads the crop image model once and shares it with every request"""
+
+    def __init__(self, model_name: str = CROP_MODEL_NAME, backend: str = CROP_INFERENCE_BACKEND,
+                 runtime: str = CROP_INFERENCE_RUNTIME):
+        self.model_name = model_name
+        self.backend = backend
+        self.runtime = runtime
+        self.model = None
+        self.status = 'not_loaded'
+        self.error = None
+        self.load_time_ms = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def _build_model(self):
+        """Build the pretrained classifier in eval mode"""
+        if CROP_MODEL_WEIGHTS:
+            model = models.efficientnet_b0(weights=None, num_classes=len(crop_labels) if crop_labels else 1000)
+            model.load_state_dict(torch.load(CROP_MODEL_WEIGHTS, map_location='cpu'))
+        else:
+            model = models.efficientnet_b0(weights=models.EfficientNet_B0_Weights.IMAGENET1K_V1)
+        model.eval()
+        return model
+
+    def _build_torch_model(self):
+        """Build the torch classifier converted to the configured backend"""
+        model = self._build_model()
+        calibration_batch = None
+        if self.backend == 'static_int8':
+            pixels = load_calibration_batch(CROP_CALIBRATION_DIR)
+            if pixels is None:
+                # Scales fitted to random pixels quietly misclassify real leaves, so serve fp32 instead
+                logger.error(f"❌ static_int8 needs sample leaf images in CROP_CALIBRATION_DIR "
+                             f"({CROP_CALIBRATION_DIR or 'unset'}), serving the eager fp32 model instead")
+                self.backend = 'eager'
+            else:
+                calibration_batch = torch.from_numpy(normalize_pixels(pixels))
+        if self.backend != 'eager':
+            logger.info(f"🔧 Converting crop model to {self.backend} backend")
+            model = build_inference_backend(model, self.backend, calibration_batch)
+        return model
+
+    def _build_onnx_session(self):
+        """Open the ONNX model, exporting it from torch first if it does not exist yet"""
+        if not os.path.exists(CROP_ONNX_MODEL_PATH):
+            if torch is None:
+                raise FileNotFoundError(f"ONNX model not found at {CROP_ONNX_MODEL_PATH}")
+            logger.info(f"📦 Exporting crop model to ONNX: {CROP_ONNX_MODEL_PATH}")
+            export_onnx(self._build_model(), CROP_ONNX_MODEL_PATH)
+        return create_onnx_session(CROP_ONNX_MODEL_PATH)
+
+    def run(self, batch, model=None):
+        """Run a normalised (N, 3, 224, 224) float32 batch and return (N, classes) logits"""
+        model = model if model is not None else self.get()
+        if self.runtime == 'onnxruntime':
+            return model.run(None, {ONNX_INPUT_NAME: batch})[0]
+        with torch.no_grad():
+            return model(torch.from_numpy(batch)).numpy()
+
+    def load(self) -> bool:
+        """Load the model once; safe to call from any thread"""
+        if self.status == 'ready':
+            return True
+        if self.runtime not in INFERENCE_RUNTIMES:
+            self.status = 'error'
+            self.error = f"Unknown inference runtime '{self.runtime}'. Options: {', '.join(INFERENCE_RUNTIMES)}"
+            return False
+        if not is_available(self.runtime):
+            self.status = 'unavailable'
+            self.error = f'{self.runtime} or PIL/NumPy not installed on server.'
+            return False
+
+        with self._lock:
+            if self.status == 'ready':
+                return True
+            self.status = 'loading'
+            started = time.perf_counter()
+            try:
+                if self.runtime == 'onnxruntime':
+                    logger.info(f"🔄 Loading crop image model: {self.model_name} (onnxruntime)")
+                    model = self._build_onnx_session()
+                else:
+                    logger.info(f"🔄 Loading crop image model: {self.model_name} ({self.backend})")
+                    model = self._build_torch_model()
+                # Warm-up passes so the first real request does not pay for lazy allocations
+                # (TorchScript also needs a couple of runs to finish profiling and optimizing)
+                warmup = normalize_pixels(np.zeros((1, 224, 224, 3), dtype=np.uint8))
+                for _ in range(2):
+                    self.run(warmup, model)
+                self.model = model
+                self.load_time_ms = round((time.perf_counter() - started) * 1000, 1)
+                self.loaded_at = datetime.now().isoformat()
+                self.error = None
+                self.status = 'ready'
+                logger.info(f"✅ Crop image model ready in {self.load_time_ms} ms")
+                return True
+            except Exception as e:
+                self.status = 'error'
+                self.error = str(e)
+                logger.error(f"❌ Crop image model load error: {e}")
+                return False
+
+    def warm_up(self) -> threading.Thread:
+        """Load the model in a background thread so server startup is not blocked"""
+        thread = threading.Thread(target=self.load, name='crop-model-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def get(self):
+        """Get the shared model (torch module or ONNX session), loading lazily on first use"""
+        if not self.load():
+            raise RuntimeError(self.error or 'Crop image model is not available')
+        return self.model
+
+    def is_ready(self) -> bool:
+        """Check whether the model is loaded and serving"""
+        return self.status == 'ready'
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get registry readiness and load statistics"""
+        return {
+            'model': self.model_name,
+            'runtime': self.runtime,
+            'backend': self.backend if self.runtime == 'torch' else 'onnx_cpu',
+            'status': self.status,
+            'ready': self.is_ready(),
+            'load_time_ms': self.load_time_ms,
+            'loaded_at': self.loaded_at,
+            'error': self.error,
+            'label_set': crop_labels.name if crop_labels is not None else None,
+            'label_count': len(crop_labels) if crop_labels is not None else 0,
+            'label_error': label_load_error
+        }
+
+
+# Shared registry used by every request in this process
+crop_model_registry = CropModelRegistry()
+
+
+def predict_batch(pixels) -> List[Tuple[float, int]]:
+    """Run a (N, 224, 224, 3) uint8 batch and return (confidence, class index) per image"""
+    return postprocess_logits(crop_model_registry.run(normalize_pixels(pixels)))
+
+
+def predict_inputs(inputs: List[Any], chunk_size: int = CROP_BATCH_MAX_SIZE) -> List[Tuple[float, int]]:
+    """Run many prepared inputs through the model in batches of at most chunk_size"""
+    chunk_size = max(1, chunk_size)
+    chunks = [inputs[start:start + chunk_size] for start in range(0, len(inputs), chunk_size)]
+    results = []
+    if crop_worker_pool.enabled:
+        # Chunks run concurrently, one per worker process
+        futures = [crop_worker_pool.submit(chunk) for chunk in chunks]
+        try:
+            for future in futures:
+                results.extend(future.result(timeout=CROP_BATCH_RESULT_TIMEOUT))
+        except FutureTimeoutError:
+            # Chunks a worker has not picked up yet are dropped rather than run for nobody
+            for future in futures:
+                future.cancel()
+            raise
+        return results
+    for chunk in chunks:
+        results.extend(predict_batch(np.stack(chunk)))
+    return results
+
+
+def decode_image(data: bytes):
+    """Decode image bytes in memory, letting JPEGs decode at reduced size close to the model input"""
+    try:
+        img = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        raise ValueError('Unsupported or corrupt image file')
+    if img.format == 'JPEG':
+        # DCT-domain downscaling: never smaller than CROP_DECODE_SIZE on the short side
+        img.draft('RGB', (CROP_DECODE_SIZE, CROP_DECODE_SIZE))
+    return img.convert('RGB')
+
+
+def read_upload(file) -> bytes:
+    """Read an uploaded file's bytes straight from the request stream"""
+    file.stream.seek(0)
+    return file.stream.read()
+
+
+def difference_hash(img, hash_size: int = 8) -> int:
+    """64-bit perceptual dHash: robust to re-encoding, resizing and small brightness changes"""
+    small = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def perceptual_key(img) -> Tuple[int, Tuple[int, ...]]:
+    """dHash plus average colour; the colour guards against flat images that share a dHash"""
+    return difference_hash(img), img.resize((1, 1), Image.BILINEAR).getpixel((0, 0))
+
+
+class ImageResultCache:
+    """Bounded LRU cache of predictions keyed by exact content hash plus perceptual hash"""
+
+    def __init__(self, max_entries: int = CROP_CACHE_MAX_ENTRIES, ttl: float = CROP_CACHE_TTL,
+                 max_distance: int = CROP_CACHE_HASH_DISTANCE,
+                 max_colour_distance: int = CROP_CACHE_COLOUR_DISTANCE):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_colour_distance = max_colour_distance
+        self._entries = OrderedDict()  # content hash -> (perceptual key, result, stored_at)
+        # Hashes within max_distance bits of each other agree exactly on at least one of max_distance + 1
+        # bands (pigeonhole), so near-duplicate lookups only compare entries sharing a band
+        bands = self.max_distance + 1
+        widths = [64 // bands + (1 if i < 64 % bands else 0) for i in range(bands)]
+        self._band_layout = [(sum(widths[:i]), (1 << width) - 1) for i, width in enumerate(widths)]
+        self._index = {}  # (band number, band bits) -> content hashes
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def content_key(data: bytes) -> str:
+        """Exact content hash of the uploaded bytes"""
+        return hashlib.sha256(data).hexdigest()
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - stored_at > self.ttl
+
+    def _bands(self, dhash: int) -> List[Tuple[int, int]]:
+        return [(number, (dhash >> shift) & mask) for number, (shift, mask) in enumerate(self._band_layout)]
+
+    def _remove(self, key: str):
+        """Drop an entry and its band index (called with the lock held)"""
+        (dhash, _), _, _ = self._entries.pop(key)
+        for band in self._bands(dhash):
+            keys = self._index.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[band]
+
+    def get_exact(self, key: str):
+        """Look up a byte-identical upload"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry[2], now):
+                self._remove(key)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry[1]
+
+    def get_similar(self, phash: Tuple[int, Tuple[int, ...]]):
+        """Look up a near-duplicate image within max_distance bits of the perceptual hash"""
+        now = time.monotonic()
+        dhash, colour = phash
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            if self.max_distance > 0:
+                candidates = set()
+                for band in self._bands(dhash):
+                    candidates.update(self._index.get(band, ()))
+                for key in candidates:
+                    (other, other_colour), _, stored_at = self._entries[key]
+                    if self._expired(stored_at, now):
+                        self._remove(key)
+                        self.expirations += 1
+                        continue
+                    distance = bin(dhash ^ other).count('1')
+                    if distance >= best_distance:
+                        continue
+                    if max(abs(a - b) for a, b in zip(colour, other_colour)) > self.max_colour_distance:
+                        continue
+                    best_key, best_distance = key, distance
+                    if distance == 0:
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.near_hits += 1
+            return self._entries[best_key][1]
+
+    def put(self, key: str, phash: Tuple[int, Tuple[int, ...]], result):
+        """Store a prediction, evicting least recently used entries past max_entries"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (phash, result, time.monotonic())
+            for band in self._bands(phash[0]):
+                self._index.setdefault(band, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached predictions"""
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and size limits"""
+        with self._lock:
+            hits = self.exact_hits + self.near_hits
+            lookups = hits + self.misses
+            return {
+                'enabled': True,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'max_hash_distance': self.max_distance,
+                'max_colour_distance': self.max_colour_distance,
+                'exact_hits': self.exact_hits,
+                'near_duplicate_hits': self.near_hits,
+                'misses': self.misses,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'inferences_saved': hits,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+# Shared result cache for repeated uploads
+crop_result_cache = ImageResultCache()
+
+
+def prepare_upload(file) -> Dict[str, Any]:
+    """Read an upload, consult the result cache and preprocess it on a miss"""
+    return prepare_image_data(read_upload(file))
+
+
+def prepare_image_data(data: bytes) -> Dict[str, Any]:
+    """Consult the result cache for raw image bytes and preprocess them on a miss"""
+    prepared = {'result': None, 'cache': 'disabled', 'key': None, 'phash': None, 'input': None}
+    if CROP_CACHE_ENABLED:
+        prepared['key'] = crop_result_cache.content_key(data)
+        prepared['result'] = crop_result_cache.get_exact(prepared['key'])
+        if prepared['result'] is not None:
+            prepared['cache'] = 'exact'
+            return prepared
+
+    img = decode_image(data)
+    if CROP_CACHE_ENABLED:
+        prepared['phash'] = perceptual_key(img)
+        prepared['result'] = crop_result_cache.get_similar(prepared['phash'])
+        if prepared['result'] is not None:
+            prepared['cache'] = 'near_duplicate'
+            return prepared
+        prepared['cache'] = 'miss'
+
+    # Compact uint8 crop; normalisation happens next to the model (in-process or in a worker)
+    prepared['input'] = to_pixels(img)
+    return prepared
+
+
+def store_result(prepared: Dict[str, Any], result: Tuple[float, int]):
+    """Remember a fresh prediction for later repeated uploads"""
+    if CROP_CACHE_ENABLED and prepared.get('key') is not None:
+        crop_result_cache.put(prepared['key'], prepared['phash'], result)
+
+
+def analyze_prepared(prepared: Dict[str, Any]) -> Tuple[float, int]:
+    """Get (confidence, class index) for a prepared upload, running the model on a cache miss"""
+    if prepared['result'] is not None:
+        return prepared['result']
+    if CROP_BATCHING_ENABLED:
+        # Micro-batched with other concurrent uploads
+        result = crop_batch_queue.predict(prepared['input'])
+    else:
+        result = predict_inputs([prepared['input']])[0]
+    store_result(prepared, result)
+    return result
+
+
+# Shared pool for preprocessing multi-image uploads (PIL releases the GIL while decoding)
+_preprocess_executor = ThreadPoolExecutor(max_workers=max(1, CROP_PREPROCESS_WORKERS),
+                                          thread_name_prefix='crop-preprocess')
+
+
+def prepare_uploads(files: List[Any]) -> List[Tuple[Any, Any]]:
+    """Prepare many uploads in parallel; returns (prepared, error) per file in upload order"""
+    futures = [_preprocess_executor.submit(prepare_upload, file) for file in files]
+    results = []
+    for future in futures:
+        try:
+            results.append((future.result(), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+def get_class_name(pred_idx: int) -> str:
+    """Map a predicted class index to its label in the active label set"""
+    if crop_labels is None:
+        return f"Class label error: {label_load_error}"
+    return crop_labels.get(pred_idx)
+
+
+def aggregate_predictions(predictions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine per-image predictions for one plot into a single confidence-weighted diagnosis"""
+    if not predictions:
+        return {'class': None, 'confidence': 0.0, 'image_count': 0, 'agreement': 0.0, 'class_breakdown': []}
+
+    votes = Counter(p['class'] for p in predictions)
+    weights = Counter()
+    for p in predictions:
+        weights[p['class']] += p['confidence']
+
+    breakdown = [
+        {
+            'class': name,
+            'count': votes[name],
+            'mean_confidence': round(weights[name] / votes[name], 4)
+        }
+        for name, _ in weights.most_common()
+    ]
+    top = breakdown[0]
+    return {
+        'class': top['class'],
+        'description': top['class'],
+        'confidence': top['mean_confidence'],
+        'image_count': len(predictions),
+        'agreement': round(top['count'] / len(predictions), 4),
+        'class_breakdown': breakdown
+    }
+
+
+def _set_batch_results(futures: List[Future], results: List[Tuple[float, int]]):
+    for future, result in zip(futures, results):
+        future.set_result(result)
+
+
+def _set_batch_error(futures: List[Future], error: Exception):
+    logger.error(f"❌ Batch inference error ({len(futures)} images): {error}")
+    for future in futures:
+        future.set_exception(error)
+
+
+def _resolve_batch(futures: List[Future], batch_future: Future):
+    """Fan a worker-process batch result back out to each caller"""
+    try:
+        _set_batch_results(futures, batch_future.result())
+    except Exception as e:
+        _set_batch_error(futures, e)
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the batching queue is at its configured depth"""
+
+
+class BatchInferenceQueue:
+    """Collects concurrent single-image requests and runs them through the model as one batch"""
+
+    def __init__(self, max_batch_size: int = CROP_BATCH_MAX_SIZE,
+                 max_wait_ms: float = CROP_BATCH_MAX_WAIT_MS,
+                 queue_depth: int = CROP_BATCH_QUEUE_DEPTH):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self.queue_depth = max(1, queue_depth)
+        self._queue = queue.Queue(maxsize=self.queue_depth)
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.total_requests = 0
+        self.total_batches = 0
+        self.rejected_requests = 0
+        self.max_batch_seen = 0
+        self.recent_batch_sizes = deque(maxlen=100)
+        self.batch_size_histogram = {}
+
+    def start(self):
+        """Start the background batching worker if it is not running"""
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='crop-batch-worker', daemon=True)
+                self._worker.start()
+
+    def submit(self, model_input) -> Future:
+        """Queue one prepared input; the future resolves to (confidence, class index)"""
+        self.start()
+        future = Future()
+        try:
+            self._queue.put_nowait((model_input, future))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected_requests += 1
+            raise InferenceQueueFull(f'Image analysis queue is full ({self.queue_depth} pending). Please try again.')
+        return future
+
+    def predict(self, model_input, timeout: float = CROP_BATCH_RESULT_TIMEOUT) -> Tuple[float, int]:
+        """Submit one prepared input and block until its own result is available"""
+        future = self.submit(model_input)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # The batching worker skips cancelled requests, so a caller that gave up no longer takes a batch slot
+            future.cancel()
+            raise
+
+    def _collect(self) -> List[Tuple[Any, Future]]:
+        """Wait for the first request, then gather more until the batch is full or the wait expires"""
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        """Background worker loop"""
+        while True:
+            items = self._collect()
+            # Skip callers that already gave up waiting
+            items = [(model_input, future) for model_input, future in items if future.set_running_or_notify_cancel()]
+            if not items:
+                continue
+            self._record_batch(len(items))
+            inputs = [model_input for model_input, _ in items]
+            futures = [future for _, future in items]
+            try:
+                if crop_worker_pool.enabled:
+                    # Hand the batch to a worker process and go straight back to collecting the next one
+                    batch_future = crop_worker_pool.submit(inputs)
+                    batch_future.add_done_callback(lambda done, futures=futures: _resolve_batch(futures, done))
+                else:
+                    _set_batch_results(futures, predict_batch(np.stack(inputs)))
+            except Exception as e:
+                _set_batch_error(futures, e)
+
+    def _record_batch(self, size: int):
+        """Update batch size statistics"""
+        with self._stats_lock:
+            self.total_requests += size
+            self.total_batches += 1
+            self.max_batch_seen = max(self.max_batch_seen, size)
+            self.recent_batch_sizes.append(size)
+            self.batch_size_histogram[size] = self.batch_size_histogram.get(size, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue length and batch size statistics"""
+        with self._stats_lock:
+            recent = list(self.recent_batch_sizes)
+            return {
+                'enabled': True,
+                'worker_alive': self._worker is not None and self._worker.is_alive(),
+                'queue_length': self._queue.qsize(),
+                'queue_depth': self.queue_depth,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'total_requests': self.total_requests,
+                'total_batches': self.total_batches,
+                'rejected_requests': self.rejected_requests,
+                'avg_batch_size': round(self.total_requests / self.total_batches, 2) if self.total_batches else 0,
+                'recent_avg_batch_size': round(sum(recent) / len(recent), 2) if recent else 0,
+                'max_batch_seen': self.max_batch_seen,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self.batch_size_histogram.items())}
+            }
+
+
+# Shared batching queue for single-image requests
+crop_batch_queue = BatchInferenceQueue()
+
+
+_warmup_barrier = None
+
+
+def _init_inference_worker(num_threads: int, warmup_barrier):
+    """Worker process initializer: pin torch threads and load this process's model copy"""
+    global _warmup_barrier, CROP_ORT_THREADS
+    _warmup_barrier = warmup_barrier
+    if torch is not None:
+        torch.set_num_threads(num_threads)
+    CROP_ORT_THREADS = num_threads
+    crop_model_registry.load()
+
+
+def _worker_ready() -> Dict[str, Any]:
+    """Report that a worker process is up and its model is loaded"""
+    # Holding every worker at the barrier makes each warm-up task land on a different process
+    try:
+        _warmup_barrier.wait(timeout=120)
+    except Exception:
+        pass
+    return {'pid': os.getpid(), 'ready': crop_model_registry.is_ready(), 'error': crop_model_registry.error}
+
+
+def _worker_predict(shm_name: str, count: int) -> List[Tuple[float, int]]:
+    """Run a batch of uint8 crops read from shared memory"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pixels = np.array(np.ndarray((count, 224, 224, 3), dtype=np.uint8, buffer=shm.buf))  # copy out
+    finally:
+        shm.close()
+    return predict_batch(pixels)
+
+
+class InferenceWorkerPool:
+    """Optional pool of processes, each holding its own model copy, so inference escapes the GIL"""
+
+    def __init__(self, processes: int = CROP_WORKER_PROCESSES, threads: int = CROP_WORKER_THREADS):
+        self.processes = max(0, processes)
+        self.threads = max(1, threads)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.workers = {}
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.images = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.processes > 0
+
+    def start(self):
+        """Spawn the worker processes and warm their models"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._executor is not None:
+                return
+            logger.info(f"🔄 Starting {self.processes} crop inference workers ({self.threads} torch threads each)")
+            context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=context,
+                initializer=_init_inference_worker,
+                initargs=(self.threads, context.Barrier(self.processes))
+            )
+            for _ in range(self.processes):
+                self._executor.submit(_worker_ready).add_done_callback(self._record_worker)
+
+    def _record_worker(self, future: Future):
+        try:
+            info = future.result()
+            self.workers[info['pid']] = info
+        except Exception as e:
+            logger.error(f"❌ Crop inference worker failed to start: {e}")
+
+    def _restart(self):
+        """Replace a broken executor (e.g. a worker was OOM-killed)"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self.workers = {}
+            self.restarts += 1
+        self.start()
+
+    def submit(self, inputs: List[Any]) -> Future:
+        """Copy uint8 crops into shared memory and run them as one batch on a worker"""
+        self.start()
+        pixels = np.stack(inputs)
+        shm = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+        np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)[:] = pixels
+        try:
+            try:
+                future = self._executor.submit(_worker_predict, shm.name, len(inputs))
+            except BrokenProcessPool:
+                self._restart()
+                future = self._executor.submit(_worker_predict, shm.name, len(inputs))
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+        with self._stats_lock:
+            self.submitted += 1
+            self.images += len(inputs)
+        future.add_done_callback(lambda done: self._finish(done, shm))
+        return future
+
+    def _finish(self, future: Future, shm):
+        shm.close()
+        shm.unlink()
+        with self._stats_lock:
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def is_ready(self) -> bool:
+        """Check whether every worker has loaded its model"""
+        return self.enabled and len(self.workers) >= self.processes and all(w['ready'] for w in self.workers.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get worker and task counters"""
+        with self._stats_lock:
+            return {
+                'enabled': self.enabled,
+                'processes': self.processes,
+                'threads_per_worker': self.threads,
+                'ready': self.is_ready(),
+                'workers': list(self.workers.values()),
+                'batches_submitted': self.submitted,
+                'batches_completed': self.completed,
+                'batches_failed': self.failed,
+                'in_flight': self.submitted - self.completed - self.failed,
+                'images': self.images,
+                'restarts': self.restarts
+            }
+
+
+# Shared worker pool; disabled unless CROP_WORKER_PROCESSES > 0
+crop_worker_pool = InferenceWorkerPool()
+
+
+def warm_up():
+    """Start loading models in the background: in the worker processes or in this process"""
+    if crop_worker_pool.enabled:
+        crop_worker_pool.start()
+    else:
+        crop_model_registry.warm_up()
+
+
+def ensure_ready():
+    """Make sure inference can run, raising if the model cannot be loaded"""
+    if crop_worker_pool.enabled:
+        crop_worker_pool.start()
+    else:
+        crop_model_registry.get()
+
+
+def is_ready() -> bool:
+    """Check whether image inference is warm and serving"""
+    return crop_worker_pool.is_ready() if crop_worker_pool.enabled else crop_model_registry.is_ready()
+
+
+# Asynchronous job configuration
+CROP_JOB_WORKERS = int(os.getenv('CROP_JOB_WORKERS', 2))
+CROP_JOB_QUEUE_DEPTH = int(os.getenv('CROP_JOB_QUEUE_DEPTH', 32))  # queued jobs beyond the running ones
+CROP_JOB_TTL = float(os.getenv('CROP_JOB_TTL', 3600))  # seconds finished jobs stay fetchable
+CROP_JOB_CALLBACK_TIMEOUT = float(os.getenv('CROP_JOB_CALLBACK_TIMEOUT', 10))
+CROP_JOB_CALLBACK_RETRIES = int(os.getenv('CROP_JOB_CALLBACK_RETRIES', 2))
+CROP_JOB_CALLBACK_WORKERS = int(os.getenv('CROP_JOB_CALLBACK_WORKERS', 4))  # kept apart from the inference workers
+# Callbacks to loopback, private, link-local (cloud metadata) or reserved addresses are refused unless enabled
+CROP_JOB_CALLBACK_ALLOW_PRIVATE = os.getenv('CROP_JOB_CALLBACK_ALLOW_PRIVATE', 'false').lower() == 'true'
+
+
+class JobQueueFull(Exception):
+    """Raised when the analysis job queue is at capacity"""
+
+
+class PinnedHostAdapter(HTTPAdapter):
+    """HTTPS adapter for URLs rewritten to an IP: SNI and the certificate check still use the original hostname"""
+
+    def __init__(self, hostname: str, **kwargs):
+        self.hostname = hostname
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.update(server_hostname=self.hostname, assert_hostname=self.hostname)
+        super().init_poolmanager(*args, **kwargs)
+
+
+def post_to_address(url: str, address: Optional[str], **kwargs):
+    """POST to `url` over a connection to `address` instead of resolving its host again, so the host cannot
+    be re-pointed (DNS rebinding) between validation and the request; Host header, SNI and certificate check
+    keep the original host. Without an address this is a plain requests.post"""
+    if address is None:
+        return requests.post(url, **kwargs)
+    parsed = urlparse(url)
+    userinfo, _, host_port = parsed.netloc.rpartition('@')
+    pinned_host = f'[{address}]' if ':' in address else address
+    netloc = (f'{userinfo}@' if userinfo else '') + pinned_host + (f':{parsed.port}' if parsed.port else '')
+    with requests.Session() as session:
+        session.mount('https://', PinnedHostAdapter(parsed.hostname))
+        headers = dict(kwargs.pop('headers', None) or {}, Host=host_port)
+        return session.post(parsed._replace(netloc=netloc).geturl(), headers=headers, **kwargs)
+
+
+class CropJobManager:
+    """Runs image analysis jobs on a bounded background executor and keeps results for polling"""
+
+    def __init__(self, workers: int = CROP_JOB_WORKERS, queue_depth: int = CROP_JOB_QUEUE_DEPTH,
+                 ttl: float = CROP_JOB_TTL):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_depth)
+        self.ttl = ttl
+        self.jobs = OrderedDict()
+        self._executor = None
+        self._callback_executor = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+                      'callbacks_sent': 0, 'callbacks_failed': 0}
+
+    @staticmethod
+    def validate_callback_url(callback_url: str) -> Optional[str]:
+        """Only absolute http(s) callback URLs whose host resolves to public addresses are accepted; returns
+        the address to connect to (None when private callbacks are allowed and the host is resolved as usual)"""
+        parsed = urlparse(callback_url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ValueError('callback_url must be an absolute http(s) URL')
+        if CROP_JOB_CALLBACK_ALLOW_PRIVATE:
+            return None
+        try:
+            addresses = [info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port or None,
+                                                                  proto=socket.IPPROTO_TCP)]
+        except (socket.gaierror, UnicodeError, ValueError):
+            raise ValueError('callback_url host does not resolve')
+        ips = [ipaddress.ip_address(address.split('%', 1)[0]) for address in addresses]
+        if not ips or any(not ip.is_global or ip.is_multicast for ip in ips):
+            raise ValueError('callback_url must point to a public address')
+        return str(ips[0])
+
+    def submit(self, data: bytes, filename: str = '', callback_url: str = None) -> Dict[str, Any]:
+        """Queue an image for analysis and return the new job without waiting for it"""
+        if callback_url:
+            self.validate_callback_url(callback_url)
+        with self._lock:
+            self._purge_expired()
+            if self._active >= self.capacity:
+                self.stats['rejected'] += 1
+                raise JobQueueFull('Crop image job queue is full, please retry shortly')
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crop-job')
+            job = {
+                'job_id': uuid.uuid4().hex,
+                'status': 'queued',
+                'filename': filename,
+                'callback_url': callback_url,
+                'callback_status': 'pending' if callback_url else None,
+                'result': None,
+                'cache': None,
+                'error': None,
+                'submitted_at': datetime.now().isoformat(),
+                'started_at': None,
+                'completed_at': None,
+                '_finished': None
+            }
+            self.jobs[job['job_id']] = job
+            self._active += 1
+            self.stats['submitted'] += 1
+        self._executor.submit(self._run, job, data)
+        return self.to_public(job)
+
+    def _run(self, job: Dict[str, Any], data: bytes):
+        """Worker body: analyse the image, record the outcome and fire the callback"""
+        job['status'] = 'running'
+        job['started_at'] = datetime.now().isoformat()
+        try:
+            prepared = prepare_image_data(data)
+            confidence, pred_idx = analyze_prepared(prepared)
+            pred_class = get_class_name(pred_idx)
+            job['result'] = {'class': pred_class, 'description': pred_class, 'confidence': confidence}
+            job['cache'] = prepared['cache']
+            job['status'] = 'completed'
+        except Exception as e:
+            logger.error(f"❌ Crop image job {job['job_id']} failed: {e}")
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        finally:
+            job['completed_at'] = datetime.now().isoformat()
+            job['_finished'] = time.monotonic()
+            with self._lock:
+                self._active -= 1
+                self.stats[job['status']] += 1
+        if job['callback_url']:
+            # Slow callback endpoints must not hold an inference worker
+            with self._lock:
+                if self._callback_executor is None:
+                    self._callback_executor = ThreadPoolExecutor(max_workers=max(1, CROP_JOB_CALLBACK_WORKERS),
+                                                                 thread_name_prefix='crop-job-callback')
+            self._callback_executor.submit(self._send_callback, job)
+
+    def _send_callback(self, job: Dict[str, Any]):
+        """POST the finished job to its callback URL, retrying a couple of times"""
+        payload = self.to_public(job)
+        for attempt in range(CROP_JOB_CALLBACK_RETRIES + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 5))
+            try:
+                # Re-checked before every send, and the request goes to the address just checked
+                address = self.validate_callback_url(job['callback_url'])
+                response = post_to_address(job['callback_url'], address, json=payload,
+                                           timeout=CROP_JOB_CALLBACK_TIMEOUT, allow_redirects=False)
+                if response.status_code < 400:
+                    job['callback_status'] = 'sent'
+                    with self._lock:
+                        self.stats['callbacks_sent'] += 1
+                    return
+                logger.warning(f"⚠️ Callback for job {job['job_id']} returned {response.status_code}")
+            except ValueError as e:
+                logger.warning(f"⚠️ Callback for job {job['job_id']} refused: {e}")
+                break
+            except Exception as e:
+                logger.warning(f"⚠️ Callback for job {job['job_id']} failed: {e}")
+        job['callback_status'] = 'failed'
+        with self._lock:
+            self.stats['callbacks_failed'] += 1
+
+    def _purge_expired(self):
+        """Drop finished jobs older than the TTL (called with the lock held)"""
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job['_finished'] is not None and now - job['_finished'] > self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def to_public(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Job fields safe to return to clients"""
+        return {key: value for key, value in job.items() if not key.startswith('_')}
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        """Get a job by id, or None if it is unknown or expired"""
+        with self._lock:
+            self._purge_expired()
+            job = self.jobs.get(job_id)
+        return self.to_public(job) if job is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get job queue counters"""
+        with self._lock:
+            return {
+                'enabled': True,
+                'workers': self.workers,
+                'capacity': self.capacity,
+                'active': self._active,
+                'tracked_jobs': len(self.jobs),
+                **self.stats
+            }
+
+
+crop_job_manager = CropJobManager()
+
+
+def compare_inference_backends(backends: List[str] = None, images_dir: str = None, runs: int = 5,
+                               batch_size: int = 8, tolerance: float = CROP_BACKEND_TOLERANCE) -> Dict[str, Any]:
+    """Measure latency and prediction drift of each backend against eager fp32 on the same images"""
+    backends = backends or list(INFERENCE_BACKENDS) + (['onnxruntime'] if ort is not None else [])
+    registry = CropModelRegistry(backend='eager')
+    base_model = registry._build_model()
+    pixels = load_calibration_batch(images_dir, limit=max(batch_size, 32))
+    calibration = 'images'
+    if pixels is None:
+        # Fine for latency; agreement and static_int8 scales on noise say little about real leaves
+        logger.warning("⚠️ No sample images, comparing backends on random pixels")
+        pixels, calibration = random_calibration_batch(max(batch_size, 8)), 'random_pixels'
+    samples = torch.from_numpy(normalize_pixels(pixels))
+    batch = samples[:batch_size]
+
+    with torch.no_grad():
+        reference = torch.nn.functional.softmax(base_model(samples), dim=1)
+
+    report = {'batch_size': len(batch), 'samples': len(samples), 'calibration': calibration, 'tolerance': tolerance,
+              'torch_threads': torch.get_num_threads(), 'backends': {}}
+    for backend in backends:
+        try:
+            started = time.perf_counter()
+            if backend == 'onnxruntime':
+                # The session holds the model in memory, so the exported file can go straight away
+                with tempfile.TemporaryDirectory() as export_dir:
+                    session = create_onnx_session(export_onnx(base_model, os.path.join(export_dir, 'model.onnx')))
+                model = lambda x, session=session: torch.from_numpy(
+                    session.run(None, {ONNX_INPUT_NAME: x.numpy()})[0])
+            else:
+                model = build_inference_backend(base_model, backend, samples)
+            build_ms = (time.perf_counter() - started) * 1000
+            with torch.no_grad():
+                for _ in range(3):  # warm-up, lets TorchScript finish its profiling runs
+                    model(batch)
+                timings = []
+                for _ in range(max(1, runs)):
+                    started = time.perf_counter()
+                    model(batch)
+                    timings.append((time.perf_counter() - started) * 1000)
+                probs = torch.nn.functional.softmax(model(samples), dim=1)
+            top1_agreement = float((probs.argmax(1) == reference.argmax(1)).float().mean())
+            max_prob_delta = float((probs - reference).abs().max())
+            timings.sort()
+            report['backends'][backend] = {
+                'build_ms': round(build_ms, 1),
+                'batch_latency_ms_p50': round(timings[len(timings) // 2], 1),
+                'per_image_ms': round(timings[len(timings) // 2] / len(batch), 2),
+                'top1_agreement': round(top1_agreement, 4),
+                'max_prob_delta': round(max_prob_delta, 4),
+                'within_tolerance': top1_agreement >= 1.0 - tolerance
+            }
+        except Exception as e:
+            report['backends'][backend] = {'error': str(e), 'within_tolerance': False}
+
+    eager_ms = report['backends'].get('eager', {}).get('batch_latency_ms_p50')
+    for result in report['backends'].values():
+        if eager_ms and result.get('batch_latency_ms_p50'):
+            result['speedup_vs_eager'] = round(eager_ms / result['batch_latency_ms_p50'], 2)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crop image inference tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compare_parser = subparsers.add_parser('compare', help='Compare inference backends for accuracy and latency')
+    compare_parser.add_argument('--backends', nargs='+', choices=INFERENCE_BACKENDS + ('onnxruntime',))
+    compare_parser.add_argument('--images', help='Directory of sample images (random pixels if omitted, reported as calibration: random_pixels)')
+    compare_parser.add_argument('--runs', type=int, default=5)
+    compare_parser.add_argument('--batch-size', type=int, default=8)
+    compare_parser.add_argument('--tolerance', type=float, default=CROP_BACKEND_TOLERANCE,
+                                help='Allowed fraction of top-1 disagreements with eager fp32')
+    export_parser = subparsers.add_parser('export-onnx', help='Export the classifier to ONNX for onnxruntime')
+    export_parser.add_argument('--output', default=CROP_ONNX_MODEL_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not is_available('torch'):
+        print("❌ PyTorch or PIL not installed")
+        sys.exit(1)
+    if args.command == 'export-onnx':
+        print(f"✅ Exported ONNX model to {export_onnx(CropModelRegistry()._build_model(), args.output)}")
+        sys.exit(0)
+    result = compare_inference_backends(args.backends, args.images, args.runs, args.batch_size, args.tolerance)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if all(r.get('within_tolerance') for r in result['backends'].values()) else 1)
@@ -2,16 +2,18 @@
 AgriBot AI Backend with Grok API Integration - Complete Version
 """
 
+import io
 import os
 import sys
 import json
+import time
 import logging
 import asyncio
 import traceback
 import requests
 from datetime import datetime
 from typing import Dict, Any, Optional, List
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -19,6 +21,11 @@ from dotenv import load_dotenv
 env_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(env_path)
 
+import crop_image_service
+import groq_service
+import llm_router
+import local_llm_service
+
 # Debug: Print environment loading
 print(f"🔍 Loading environment from: {os.getcwd()}")
 groq_key = os.getenv('GROQ_API_KEY')
@@ -35,81 +42,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class AgriBotRequest(Request):
+    """Request that keeps image uploads in memory instead of spooling them to temp files"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_bytes = crop_image_service.CROP_UPLOAD_MAX_MB * 1024 * 1024
+        if total_content_length is not None and total_content_length <= max_bytes:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:3001", "http://127.0.0.1:3001"])
+app.request_class = AgriBotRequest
+CORS_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:3001", "http://127.0.0.1:3001"]
+CORS(app, origins=CORS_ORIGINS)
 
 # --- Crop Health Analysis Endpoint ---
 from werkzeug.utils import secure_filename
-import tempfile
 import numpy as np
-try:
-    import torch
-    import torchvision.transforms as transforms
-    from PIL import Image
-    import requests as py_requests
-    # Use torchvision's EfficientNet or ResNet
-    from torchvision import models
-except ImportError:
-    torch = None
-    transforms = None
-    Image = None
+from crop_image_service import crop_model_registry, crop_batch_queue, crop_result_cache, crop_worker_pool, crop_job_manager
 
 @app.route('/api/crop-image-analysis', methods=['POST'])
 def crop_image_analysis():
     """Analyze crop/leaf image using PyTorch EfficientNet/ResNet"""
-    if torch is None or transforms is None or Image is None:
-        return jsonify({'success': False, 'error': 'PyTorch or PIL not installed on server.'}), 500
+    if not crop_image_service.is_available():
+        return jsonify({'success': False, 'error': 'Image inference runtime or PIL not installed on server.'}), 500
     if 'image' not in request.files:
         return jsonify({'success': False, 'error': 'No image file provided.'}), 400
     file = request.files['image']
     filename = secure_filename(file.filename)
     try:
-        # Save to temp file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp:
-            file.save(temp.name)
-            img_path = temp.name
-        # Load and preprocess image
-        img = Image.open(img_path).convert('RGB')
-        preprocess = transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ])
-        input_tensor = preprocess(img)
-        input_batch = input_tensor.unsqueeze(0)
-        # Load EfficientNet or ResNet model (pretrained)
-        model = models.efficientnet_b0(pretrained=True)
-        model.eval()
-        with torch.no_grad():
-            outputs = model(input_batch)
-            probs = torch.nn.functional.softmax(outputs[0], dim=0)
-            confidence, pred_idx = torch.max(probs, 0)
-            confidence = float(confidence.item())
-            pred_idx = int(pred_idx.item())
+        # Repeated or near-duplicate uploads are answered from the result cache
+        prepared = crop_image_service.prepare_upload(file)
+        confidence, pred_idx = crop_image_service.analyze_prepared(prepared)
         # Get class name from ImageNet
-        # Download ImageNet class labels if not present
-        labels_url = 'https://raw.githubusercontent.com/pytorch/hub/master/imagenet_classes.txt'
-        labels_path = os.path.join(os.path.dirname(__file__), 'imagenet_classes.txt')
-        if not os.path.exists(labels_path):
-            r = py_requests.get(labels_url)
-            with open(labels_path, 'w') as f:
-                f.write(r.text)
-        # Read class names and validate
-        try:
-            with open(labels_path, 'r') as f:
-                class_names = [line.strip() for line in f.readlines() if line.strip()]
-            if len(class_names) != 1000:
-                raise ValueError(f"imagenet_classes.txt should have 1000 classes, found {len(class_names)}")
-            if 0 <= pred_idx < len(class_names):
-                pred_class = class_names[pred_idx]
-            else:
-                pred_class = f"Unknown class (index {pred_idx})"
-        except Exception as e:
-            pred_class = f"Class label error: {str(e)}"
-        # Clean up temp file
-        os.remove(img_path)
+        pred_class = crop_image_service.get_class_name(pred_idx)
         return jsonify({
             'success': True,
             'result': {
@@ -117,29 +84,147 @@ def crop_image_analysis():
                 'description': pred_class,
                 'confidence': confidence
             },
+            'cache': prepared['cache'],
+            'timestamp': datetime.now().isoformat()
+        })
+    except crop_image_service.InferenceQueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/crop-image-analysis/batch', methods=['POST'])
+def crop_image_analysis_batch():
+    """Analyze several photos of the same plot and return per-image and aggregate diagnoses"""
+    if not crop_image_service.is_available():
+        return jsonify({'success': False, 'error': 'Image inference runtime or PIL not installed on server.'}), 500
+    files = request.files.getlist('images') or request.files.getlist('image')
+    if not files:
+        return jsonify({'success': False, 'error': 'No image files provided.'}), 400
+    if len(files) > crop_image_service.CROP_MULTI_IMAGE_MAX:
+        return jsonify({
+            'success': False,
+            'error': f'Too many images. Maximum {crop_image_service.CROP_MULTI_IMAGE_MAX} per request.'
+        }), 400
+    try:
+        crop_image_service.ensure_ready()
+        # Preprocess all uploads in parallel, then run the cache misses as one or a few batches
+        prepared_uploads = crop_image_service.prepare_uploads(files)
+        pending = [prepared for prepared, error in prepared_uploads if error is None and prepared['result'] is None]
+        if pending:
+            fresh = crop_image_service.predict_inputs([prepared['input'] for prepared in pending])
+            for prepared, result in zip(pending, fresh):
+                prepared['result'] = result
+                crop_image_service.store_result(prepared, result)
+
+        results = []
+        for file, (prepared, error) in zip(files, prepared_uploads):
+            filename = secure_filename(file.filename or '')
+            if error is not None:
+                results.append({'filename': filename, 'success': False, 'error': error})
+                continue
+            confidence, pred_idx = prepared['result']
+            pred_class = crop_image_service.get_class_name(pred_idx)
+            results.append({
+                'filename': filename,
+                'success': True,
+                'class': pred_class,
+                'description': pred_class,
+                'confidence': confidence,
+                'cache': prepared['cache']
+            })
+
+        successful = [r for r in results if r['success']]
+        return jsonify({
+            'success': bool(successful),
+            'results': results,
+            'aggregate': crop_image_service.aggregate_predictions(successful),
+            'processed': len(successful),
+            'failed': len(results) - len(successful),
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/crop-image-analysis/jobs', methods=['POST'])
+def submit_crop_image_job():
+    """Queue a crop image for background analysis and return a job id immediately"""
+    if not crop_image_service.is_available():
+        return jsonify({'success': False, 'error': 'Image inference runtime or PIL not installed on server.'}), 500
+    if 'image' not in request.files:
+        return jsonify({'success': False, 'error': 'No image file provided.'}), 400
+    file = request.files['image']
+    callback_url = request.form.get('callback_url') or None
+    try:
+        job = crop_job_manager.submit(
+            crop_image_service.read_upload(file),
+            filename=secure_filename(file.filename or ''),
+            callback_url=callback_url
+        )
+        return jsonify({
+            'success': True,
+            'job': job,
+            'status_url': f"/api/crop-image-analysis/jobs/{job['job_id']}",
+            'timestamp': datetime.now().isoformat()
+        }), 202
+    except crop_image_service.JobQueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 429, {'Retry-After': '5'}
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/crop-image-analysis/jobs/<job_id>', methods=['GET'])
+def get_crop_image_job(job_id):
+    """Poll a background crop image analysis job"""
+    job = crop_job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found or expired'}), 404
+    return jsonify({'success': True, 'job': job, 'timestamp': datetime.now().isoformat()})
+
+@app.route('/api/crop-image-analysis/status', methods=['GET'])
+def crop_image_status():
+    """Get crop image model readiness and load time"""
+    status = crop_model_registry.get_status()
+    ready = crop_image_service.is_ready()
+    return jsonify({
+        'success': True,
+        'ready': ready,
+        'model_status': status,
+        'workers': crop_worker_pool.get_stats(),
+        'batching': crop_batch_queue.get_stats() if crop_image_service.CROP_BATCHING_ENABLED else {'enabled': False},
+        'cache': crop_result_cache.get_stats() if crop_image_service.CROP_CACHE_ENABLED else {'enabled': False},
+        'jobs': crop_job_manager.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
+# Transport errors of the sync (requests) and async (aiohttp) paths, mapped to the same error results
+TIMEOUT_ERRORS = (requests.exceptions.Timeout, asyncio.TimeoutError)
+CONNECTION_ERRORS = (requests.exceptions.ConnectionError,) + (
+    (groq_service.aiohttp.ClientConnectionError,) if groq_service.aiohttp is not None else ())
+
+
 class GroqAgriBot:
     """AgriBot powered by Groq API - FREE & FAST"""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, session: groq_service.PooledSession = None):
         """Initialize Groq AgriBot"""
         self.api_key = api_key or os.getenv('GROQ_API_KEY') or os.getenv('GROK_API_KEY')
         
         if not self.api_key:
             raise ValueError("GROQ_API_KEY environment variable is required")
         
-        self.base_url = "https://api.groq.com/openai/v1"
-        self.model = "llama-3.1-8b-instant"  # Fast and free model
+        self.base_url = groq_service.GROQ_BASE_URL
+        # Keep-alive connection pool shared across request threads
+        self.session = session or groq_service.groq_session
+        self.model = llm_router.GROQ_MODEL  # Fast and free model
         
         # Headers for API requests
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
+        # Picks the fastest healthy provider (Groq unless LLM_PROVIDERS lists others) for every call
+        self.router = llm_router.get_router(self.api_key)
         
         # System prompt for expert farming advice with multilingual support
         self.system_prompt = """You are Annapurna, an expert agricultural advisor AI specifically designed for Indian farmers and global agriculture. You have deep expertise in:
@@ -198,223 +283,527 @@ class GroqAgriBot:
 
 Remember: You're helping real farmers improve their livelihoods across different regions and languages. Be accurate, practical, culturally sensitive, and linguistically appropriate."""
 
-        self.conversation_history = []
+        # Constant system message per language, built once and never mutated; requests only add history and the query
+        self.prompt_prefixes = {language: self._compile_prompt_prefix(language)
+                                for language in groq_service.LANGUAGE_REGIONS}
+        # Constant brevity instruction per query class, sent after the language prefix
+        self.brevity_messages = {name: {"role": "system", "content": response_class['instruction']}
+                                 for name, response_class in groq_service.RESPONSE_CLASSES.items()}
+        
+        # Per-user ring buffers, shared with the async bot and the knowledge base fallback
+        self.memory = groq_service.conversation_store
         logger.info("✅ Groq AgriBot initialized successfully")
     
     def detect_language(self, text: str) -> Dict[str, Any]:
-        """Detect language and regional context from user input"""
-        language_patterns = {
-            'hindi': ['अ', 'आ', 'इ', 'ई', 'उ', 'ऊ', 'ए', 'ऐ', 'ओ', 'औ', 'क', 'ख', 'ग', 'घ', 'च', 'छ', 'ज', 'झ', 'ट', 'ठ', 'ड', 'ढ', 'त', 'थ', 'द', 'ध', 'न', 'प', 'फ', 'ब', 'भ', 'म', 'य', 'र', 'ल', 'व', 'श', 'ष', 'स', 'ह'],
-            'tamil': ['அ', 'ஆ', 'இ', 'ஈ', 'உ', 'ஊ', 'எ', 'ஏ', 'ஐ', 'ஒ', 'ஓ', 'ஔ', 'க', 'ங', 'ச', 'ஞ', 'ட', 'ண', 'த', 'ந', 'ப', 'ம', 'ய', 'ர', 'ல', 'வ', 'ழ', 'ள', 'ற', 'ன'],
-            'telugu': ['అ', 'ఆ', 'ఇ', 'ఈ', 'ఉ', 'ఊ', 'ఎ', 'ఏ', 'ఐ', 'ఒ', 'ఓ', 'ఔ', 'క', 'ఖ', 'గ', 'ఘ', 'ఙ', 'చ', 'ఛ', 'జ', 'ఝ', 'ఞ', 'ట', 'ఠ', 'డ', 'ఢ', 'ణ', 'త', 'థ', 'ద', 'ధ', 'న', 'ప', 'ఫ', 'బ', 'భ', 'మ', 'య', 'ర', 'ల', 'వ', 'శ', 'ష', 'స', 'హ'],
-            'punjabi': ['ਅ', 'ਆ', 'ਇ', 'ਈ', 'ਉ', 'ਊ', 'ਏ', 'ਐ', 'ਓ', 'ਔ', 'ਕ', 'ਖ', 'ਗ', 'ਘ', 'ਙ', 'ਚ', 'ਛ', 'ਜ', 'ਝ', 'ਞ', 'ਟ', 'ਠ', 'ਡ', 'ਢ', 'ਣ', 'ਤ', 'ਥ', 'ਦ', 'ਧ', 'ਨ', 'ਪ', 'ਫ', 'ਬ', 'ਭ', 'ਮ', 'ਯ', 'ਰ', 'ਲ', 'ਵ', 'ਸ਼', 'ਸ', 'ਹ'],
-            'bengali': ['অ', 'আ', 'ই', 'ঈ', 'উ', 'ঊ', 'ঋ', 'এ', 'ঐ', 'ও', 'ঔ', 'ক', 'খ', 'গ', 'ঘ', 'ঙ', 'চ', 'ছ', 'জ', 'ঝ', 'ঞ', 'ট', 'ঠ', 'ড', 'ঢ', 'ণ', 'ত', 'থ', 'দ', 'ধ', 'ন', 'প', 'ফ', 'ব', 'ভ', 'ম', 'য', 'র', 'ল', 'শ', 'ষ', 'স', 'হ'],
-            'marathi': ['अ', 'आ', 'इ', 'ई', 'उ', 'ऊ', 'ऋ', 'ए', 'ऐ', 'ओ', 'औ', 'क', 'ख', 'ग', 'घ', 'ङ', 'च', 'छ', 'ज', 'झ', 'ञ', 'ट', 'ठ', 'ड', 'ढ', 'ण', 'त', 'थ', 'द', 'ध', 'न', 'प', 'फ', 'ब', 'भ', 'म', 'य', 'र', 'ल', 'व', 'श', 'ष', 'स', 'ह'],
-            'gujarati': ['અ', 'આ', 'ઇ', 'ઈ', 'ઉ', 'ઊ', 'ઋ', 'એ', 'ઐ', 'ઓ', 'ઔ', 'ક', 'ખ', 'ગ', 'ઘ', 'ઙ', 'ચ', 'છ', 'જ', 'ઝ', 'ઞ', 'ટ', 'ઠ', 'ડ', 'ઢ', 'ણ', 'ત', 'થ', 'દ', 'ધ', 'ન', 'પ', 'ફ', 'બ', 'ભ', 'મ', 'ય', 'ર', 'લ', 'વ', 'શ', 'ષ', 'સ', 'હ'],
-            'kannada': ['ಅ', 'ಆ', 'ಇ', 'ಈ', 'ಉ', 'ಊ', 'ಋ', 'ಎ', 'ಏ', 'ಐ', 'ಒ', 'ಓ', 'ಔ', 'ಕ', 'ಖ', 'ಗ', 'ಘ', 'ಙ', 'ಚ', 'ಛ', 'ಜ', 'ಝ', 'ಞ', 'ಟ', 'ಠ', 'ಡ', 'ಢ', 'ಣ', 'ತ', 'ಥ', 'ದ', 'ಧ', 'ನ', 'ಪ', 'ಫ', 'ಬ', 'ಭ', 'ಮ', 'ಯ', 'ರ', 'ಲ', 'ವ', 'ಶ', 'ಷ', 'ಸ', 'ಹ'],
-            'malayalam': ['അ', 'ആ', 'ഇ', 'ഈ', 'ഉ', 'ഊ', 'ഋ', 'എ', 'ഏ', 'ഐ', 'ഒ', 'ഓ', 'ഔ', 'ക', 'ഖ', 'ഗ', 'ഘ', 'ങ', 'ച', 'ഛ', 'ജ', 'ഝ', 'ഞ', 'ട', 'ഠ', 'ഡ', 'ഢ', 'ണ', 'ത', 'ഥ', 'ദ', 'ധ', 'ന', 'പ', 'ഫ', 'ബ', 'ഭ', 'മ', 'യ', 'ര', 'ല', 'വ', 'ശ', 'ഷ', 'സ', 'ഹ']
-        }
-        
-        detected_language = 'english'  # default
-        confidence = 0
-        
-        for lang, chars in language_patterns.items():
-            char_count = sum(1 for char in text if char in chars)
-            if char_count > confidence:
-                confidence = char_count
-                detected_language = lang
-        
-        # Regional context mapping
-        regional_context = {
-            'hindi': 'North India (UP, Bihar, MP, Rajasthan, Haryana)',
-            'punjabi': 'Punjab, Haryana (Wheat Belt)',
-            'tamil': 'Tamil Nadu (Rice, Sugarcane)',
-            'telugu': 'Andhra Pradesh, Telangana (Cotton, Rice)',
-            'bengali': 'West Bengal (Rice, Jute)',
-            'marathi': 'Maharashtra (Cotton, Sugarcane, Onion)',
-            'gujarati': 'Gujarat (Cotton, Groundnut)',
-            'kannada': 'Karnataka (Coffee, Ragi, Cotton)',
-            'malayalam': 'Kerala (Spices, Coconut, Rice)',
-            'english': 'Pan-India'
+        """Detect language and regional context from user input (single pass over Unicode script blocks)"""
+        return groq_service.detect_script_language(text)
+    
+    def _compile_prompt_prefix(self, language: str) -> tuple:
+        """System message for one language: the static prompt plus that language's regional instructions"""
+        region = groq_service.LANGUAGE_REGIONS.get(language, 'General')
+        crops = ', '.join(groq_service.REGIONAL_CROPS.get(language, []))
+        instructions = f"""
+
+USER CONTEXT (detected from the question's script):
+- Language: {language.title()}. Respond completely in {language.title()}.
+- Region: {region}. Common crops: {crops}
+- Use regional farming practices, local crop names and varieties, and local climate, soil and traditions
+- Use the region's units (acre, bigha, hectare) and mention government schemes available there
+- Include region-specific pest and disease management; mention local agricultural universities and research centers if relevant"""
+        return ({"role": "system", "content": self.system_prompt + instructions},)
+    
+    def classify_query(self, user_message: str) -> str:
+        """Output budget class (quick_fact, how_to, diagnosis, general) from AgriBotAI's intent extraction"""
+        analysis = AgriBotAI(fallback_knowledge_base).analyze_query(user_message)
+        return groq_service.classify_response(analysis, user_message)
+    
+    def _build_messages(self, user_message: str, lang_info: Dict[str, Any], history: List[Dict[str, str]] = None,
+                        response_class: str = 'general') -> List[Dict[str, str]]:
+        """Build the chat messages: the language's constant prefix, the class's brevity instruction, the user's
+        recent turns, then the query"""
+        prefix = self.prompt_prefixes.get(lang_info['language'])
+        if prefix is None:
+            prefix = self.prompt_prefixes[lang_info['language']] = self._compile_prompt_prefix(lang_info['language'])
+        brevity = [self.brevity_messages[response_class]] if groq_service.GROQ_ADAPTIVE_MAX_TOKENS else []
+        return [*prefix, *brevity, *(history or []), {"role": "user", "content": user_message}]
+    
+    def _build_payload(self, user_message: str, lang_info: Dict[str, Any], stream: bool = False,
+                       history: List[Dict[str, str]] = None, response_class: str = 'general',
+                       model: str = None) -> Dict[str, Any]:
+        """Prepare the chat completion request body, capping output length by query class"""
+        payload = {
+            "model": model or self.model,
+            "messages": self._build_messages(user_message, lang_info, history, response_class),
+            "max_tokens": groq_service.max_tokens_for(response_class),
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "stream": stream
         }
-        
-        # Common crops by region
-        regional_crops = {
-            'hindi': ['गेहूं (wheat)', 'धान (rice)', 'मक्का (maize)', 'बाजरा (millet)'],
-            'punjabi': ['ਕਣਕ (wheat)', 'ਚੌਲ (rice)', 'ਮੱਕੀ (maize)', 'ਕਪਾਹ (cotton)'],
-            'tamil': ['அரிசி (rice)', 'கரும்பு (sugarcane)', 'மிளகாய் (chili)', 'கொள்ளு (horsegram)'],
-            'telugu': ['వరి (rice)', 'పత్తి (cotton)', 'మిర్చి (chili)', 'మామిడి (mango)'],
-            'bengali': ['ধান (rice)', 'পাট (jute)', 'আলু (potato)', 'সরিষা (mustard)'],
-            'marathi': ['कापूस (cotton)', 'ऊस (sugarcane)', 'कांदा (onion)', 'ज्वारी (sorghum)'],
-            'gujarati': ['કપાસ (cotton)', 'મગફળી (groundnut)', 'બાજરી (millet)', 'તલ (sesame)'],
-            'kannada': ['ಅಕ್ಕಿ (rice)', 'ಕಾಫಿ (coffee)', 'ರಾಗಿ (ragi)', 'ತೆಂಗಿನಕಾಯಿ (coconut)'],
-            'malayalam': ['നെൽ (rice)', 'തേങ്ങ (coconut)', 'കുരുമുളക് (pepper)', 'ഏലം (cardamom)'],
-            'english': ['rice', 'wheat', 'cotton', 'sugarcane']
+        if stream and groq_service.prompt_metrics is not None:
+            # Measurement mode: ask for a final usage chunk so streamed calls report input tokens too
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+    
+    def _record_conversation(self, user_id: Optional[str], user_message: str, advice: str, lang_info: Dict[str, Any],
+                             model: str = None):
+        """Store a finished exchange in the user's conversation memory with language and the model that answered
+        (anonymous chats are not kept)"""
+        if not user_id:
+            return
+        self.memory.append(user_id, user_message, advice,
+                           language_detected=lang_info['language'],
+                           region=lang_info['region'],
+                           model=model or self.model)
+    
+    def _get_cached_answer(self, user_message: str, lang_info: Dict[str, Any], context: Dict = None,
+                           user_id: str = None):
+        """Return a cached answer for a repeated or paraphrased question (recorded in history like a fresh one), or None"""
+        cached, cache_type, similarity = None, None, None
+        if groq_service.GROQ_CACHE_ENABLED:
+            cached = groq_service.answer_cache.get(groq_service.answer_cache.make_key(user_message, lang_info))
+            cache_type = 'exact'
+        if cached is None and groq_service.semantic_cache is not None:
+            match = groq_service.semantic_cache.lookup(user_message, lang_info['language'])
+            if match is not None:
+                cached, similarity = match
+                cache_type = 'semantic'
+        if cached is None:
+            return None
+        logger.info(f"♻️ Answer cache hit ({cache_type}, {lang_info['language']})")
+        self._record_conversation(user_id, user_message, cached['advice'], lang_info, cached.get('model_type'))
+        cached.update({
+            'cache_hit': True,
+            'cache_type': cache_type,
+            'context': context or {},
+            'context_turns': 0,
+            'timestamp': datetime.now().isoformat()
+        })
+        if similarity is not None:
+            cached['similarity'] = similarity
+        return cached
+    
+    def _store_cached_answer(self, user_message: str, lang_info: Dict[str, Any], result: Dict[str, Any]):
+        """Remember a successful answer for later repeats and paraphrases of the same question"""
+        if groq_service.GROQ_CACHE_ENABLED:
+            groq_service.answer_cache.put(groq_service.answer_cache.make_key(user_message, lang_info), result)
+        if groq_service.semantic_cache is not None:
+            groq_service.semantic_cache.put(user_message, lang_info['language'], result)
+    
+    @staticmethod
+    def _api_error_message(provider_name: str, status_code: int, error_text: str) -> str:
+        """Translate a provider's error status into a readable message"""
+        if status_code == 401:
+            return f"Invalid {provider_name} API key. Please check the key configured for {provider_name} in .env file."
+        elif status_code == 429:
+            return f"{provider_name} API rate limit exceeded. Please try again later."
+        elif status_code == 400:
+            return f"Bad request to {provider_name} API: {error_text}"
+        return f"{provider_name} API error {status_code}: {error_text}"
+    
+    def _choose_provider(self) -> Optional[llm_router.LLMProvider]:
+        """Ask the router for the fastest healthy provider; None when every provider's circuit is open"""
+        provider = self.router.choose()
+        if provider is None:
+            logger.warning("🔌 Every LLM provider circuit open, skipping the call")
+        return provider
+    
+    @staticmethod
+    def _record_class_telemetry(response_class: str, latency_ms: float, advice: str, usage: Dict[str, Any],
+                                finish_reason: str = None, first_token_ms: float = None):
+        """Per query class latency and output tokens (provider count, else estimated) for tuning the caps"""
+        completion_tokens = (usage or {}).get('completion_tokens') or groq_service.estimate_tokens(advice)
+        groq_service.response_class_stats.record(response_class, latency_ms, completion_tokens, finish_reason,
+                                                 first_token_ms)
+    
+    def _record_outcome(self, provider: llm_router.LLMProvider, success: bool, elapsed_ms: float = 0.0,
+                        reason: str = None):
+        """Feed one round-trip into the provider's rolling latency window and circuit breaker"""
+        self.router.record(provider, success, elapsed_ms, reason)
+    
+    @staticmethod
+    def _circuit_open_result(lang_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Result returned without calling any provider while every circuit is open"""
+        return {
+            'success': False,
+            'error': 'circuit_open',
+            'advice': 'Annapurna AI is temporarily unavailable. Please try again in a moment.',
+            'model_type': 'llm_circuit_open',
+            'provider': None,  # nothing was routed
+            'circuit_open': True,
+            'language_info': lang_info,
+            'timestamp': datetime.now().isoformat()
         }
-        
+    
+    @staticmethod
+    def _retry_pause_active() -> bool:
+        """Without a token bucket, a pause Groq asked for (429) is still honoured by failing fast"""
+        return groq_service.retry_policy is not None and groq_service.retry_policy.paused_for() > 0
+    
+    def _acquire_rate_limit(self, provider: llm_router.LLMProvider, priority: int, max_wait: float = None) -> tuple:
+        """Queue for a Groq rate-limit token; returns (granted, queue wait in ms). Other providers' quotas are
+        taken by the router"""
+        if not provider.shared_rate_limit:
+            return True, 0.0
+        if groq_service.rate_limiter is None:
+            return not self._retry_pause_active(), 0.0
+        granted, waited_ms = groq_service.rate_limiter.acquire(priority, max_wait)
+        if not granted:
+            logger.warning(f"⏳ Groq rate limit: no token after {waited_ms} ms, skipping Groq call")
+        return granted, waited_ms
+    
+    def _retry_delay(self, provider: llm_router.LLMProvider, attempt: int, status_code: int, headers,
+                     deadline: float) -> Optional[float]:
+        """Seconds to wait before retrying a 429/5xx answer per the shared retry policy; None returns it as is"""
+        if groq_service.retry_policy is None:
+            return None
+        return groq_service.retry_policy.next_delay(attempt, status_code, headers, deadline,
+                                                    shared=provider.shared_rate_limit)
+    
+    def _api_error(self, provider: llm_router.LLMProvider, status_code: int, error_text: str) -> Exception:
+        """Log a non-200 answer and build the exception the request paths turn into an error result"""
+        logger.error(f"❌ {provider.name} API error {status_code}: {error_text}")
+        return Exception(self._api_error_message(provider.name, status_code, error_text))
+    
+    def _post_with_retry(self, provider: llm_router.LLMProvider, payload: Dict[str, Any], priority: int,
+                         deadline: float, stream: bool = False):
+        """POST to the provider, retrying 429/5xx answers until `deadline`; returns the final response"""
+        attempt = 0
+        while True:
+            response = self.session.post(provider.url, headers=provider.headers, json=payload, stream=stream)
+            delay = self._retry_delay(provider, attempt, response.status_code, response.headers, deadline)
+            if delay is None:
+                return response
+            error_text = response.text
+            response.close()
+            time.sleep(delay)
+            # Retries queue for a token like any other call, so a paused bucket holds them back too
+            granted, _ = self._acquire_rate_limit(provider, priority, max(0.0, deadline - time.monotonic()))
+            if not granted:
+                raise self._api_error(provider, response.status_code, error_text)
+            attempt += 1
+    
+    def _complete(self, provider: llm_router.LLMProvider, payload: Dict[str, Any], priority: int,
+                  deadline: float) -> Dict[str, Any]:
+        """One chat completion from the provider as an OpenAI-shaped response body"""
+        if not provider.http:
+            return provider.complete(payload)
+        response = self._post_with_retry(provider, payload, priority, deadline)
+        logger.info(f"📨 Response status: {response.status_code}")
+        if response.status_code != 200:
+            raise self._api_error(provider, response.status_code, response.text)
+        return response.json()
+    
+    def _stream_deltas(self, provider: llm_router.LLMProvider, payload: Dict[str, Any], priority: int,
+                       deadline: float, usage: Dict[str, Any]):
+        """Text deltas of one streamed completion from the provider; `usage` is filled as the stream ends"""
+        if not provider.http:
+            yield from provider.stream(payload, usage)
+            return
+        with self._post_with_retry(provider, payload, priority, deadline, stream=True) as response:
+            if response.status_code != 200:
+                raise self._api_error(provider, response.status_code, response.text)
+            yield from groq_service.iter_stream_deltas(response, usage)
+    
+    def _rate_limited_result(self, provider: llm_router.LLMProvider, lang_info: Dict[str, Any],
+                             queue_wait_ms: float) -> Dict[str, Any]:
+        """Result returned without calling the provider when no rate-limit token came in time"""
+        provider.cancel_probe()
         return {
-            'language': detected_language,
-            'confidence': confidence,
-            'region': regional_context.get(detected_language, 'General'),
-            'common_crops': regional_crops.get(detected_language, []),
-            'is_indian_language': detected_language != 'english',
-            'script_detected': confidence > 0
+            'success': False,
+            'error': 'rate_limited',
+            'advice': 'Annapurna is busy right now. Please try again in a moment.',
+            'model_type': 'llm_rate_limited',
+            'provider': provider.name,
+            'rate_limited': True,
+            'queue_wait_ms': queue_wait_ms,
+            'language_info': lang_info,
+            'timestamp': datetime.now().isoformat()
         }
     
-    def get_farming_advice(self, user_message: str, context: Dict = None) -> Dict[str, Any]:
-        """Get multilingual farming advice using Groq API"""
-        try:
-            logger.info(f"🔄 Sending multilingual request to Groq API...")
-            
-            # Detect language and add context
-            lang_info = self.detect_language(user_message)
-            
-            # Enhanced message with language and regional context
-            enhanced_context = f"""
-LANGUAGE DETECTION RESULTS:
-- Detected Language: {lang_info['language'].title()}
-- Regional Context: {lang_info['region']}
-- Common Regional Crops: {', '.join(lang_info['common_crops'])}
-- Script Confidence: {lang_info['confidence']} characters
-
-USER QUERY: {user_message}
-
-IMPORTANT INSTRUCTIONS:
-1. Respond in the SAME LANGUAGE as the user's question
-2. If user wrote in Hindi, respond completely in Hindi
-3. If user wrote in Tamil, respond completely in Tamil
-4. Include regional farming practices specific to {lang_info['region']}
-5. Use local crop names and varieties from the region
-6. Consider local climate, soil, and farming traditions
-7. Use appropriate regional units (acre, bigha, hectare as per region)
-8. Include government schemes available in that state/region
-
-REGIONAL CONTEXT:
-- Focus on crops common to {lang_info['region']}: {', '.join(lang_info['common_crops'])}
-- Consider local farming practices and traditional knowledge
-- Include region-specific pest and disease management
-- Mention local agricultural universities and research centers if relevant
-"""
-            
-            # Build messages for conversation
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": enhanced_context}
-            ]
-            
-            # Prepare API request
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "max_tokens": 2000,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "stream": False
-            }
-            
-            logger.info(f"📡 Making multilingual request to: {self.base_url}/chat/completions")
-            logger.info(f"🌐 Detected language: {lang_info['language']} | Region: {lang_info['region']}")
-            
-            # Make API request
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            
-            logger.info(f"📨 Response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                advice = data['choices'][0]['message']['content']
-                
-                # Store in conversation history with language info
-                self.conversation_history.append({
-                    'user_message': user_message,
-                    'agribot_response': advice,
-                    'language_detected': lang_info['language'],
-                    'region': lang_info['region'],
-                    'timestamp': datetime.now().isoformat(),
-                    'model': 'llama-3.1-8b-instant'
-                })
-                
-                logger.info(f"✅ Multilingual Groq response generated: {len(advice)} characters in {lang_info['language']}")
-                
-                return {
-                    'success': True,
-                    'advice': advice,
-                    'model_type': 'llama-3.1-8b-instant',
-                    'provider': 'groq',
-                    'language_info': lang_info,
-                    'cost': 'free',
-                    'context': context or {},
-                    'multilingual_support': True,
-                    'regional_context': lang_info['region'],
-                    'timestamp': datetime.now().isoformat()
-                }
-            else:
-                # Error handling same as before
-                error_text = response.text
-                logger.error(f"❌ Groq API error {response.status_code}: {error_text}")
-                
-                if response.status_code == 401:
-                    error_msg = "Invalid Groq API key. Please check your GROQ_API_KEY in .env file."
-                elif response.status_code == 429:
-                    error_msg = "Groq API rate limit exceeded. Please try again later."
-                elif response.status_code == 400:
-                    error_msg = f"Bad request to Groq API: {error_text}"
-                else:
-                    error_msg = f"Groq API error {response.status_code}: {error_text}"
-                
-                raise Exception(error_msg)
-                
-        except requests.exceptions.Timeout:
-            logger.error("❌ Groq API timeout")
+    def _answer_result(self, provider: llm_router.LLMProvider, user_message: str, lang_info: Dict[str, Any],
+                       history: List[Dict[str, str]], response_class: str, payload: Dict[str, Any], advice: str,
+                       usage: Dict[str, Any], latency_ms: float, queue_wait_ms: float) -> Dict[str, Any]:
+        """Successful answer (cached when standalone) with its prompt metrics"""
+        result = {
+            'success': True,
+            'advice': advice,
+            'model_type': provider.model,
+            'provider': provider.name,
+            'language_info': lang_info,
+            'cost': 'free',
+            'multilingual_support': True,
+            'regional_context': lang_info['region'],
+            'response_class': response_class,
+            'max_tokens': payload['max_tokens'],
+            'cache_hit': False,
+            'timestamp': datetime.now().isoformat()
+        }
+        if not history:
+            self._store_cached_answer(user_message, lang_info, result)
+        result['queue_wait_ms'] = queue_wait_ms
+        if groq_service.prompt_metrics is not None:
+            result['prompt_metrics'] = groq_service.prompt_metrics.record(payload['messages'], usage, latency_ms)
+        return result
+    
+    def _completion_result(self, provider: llm_router.LLMProvider, user_message: str, lang_info: Dict[str, Any],
+                           history: List[Dict[str, str]], response_class: str, payload: Dict[str, Any],
+                           data: Dict[str, Any], started: float, queue_wait_ms: float) -> Dict[str, Any]:
+        """Record a finished completion's latency and turn its response body into the answer result"""
+        advice = data['choices'][0]['message']['content']
+        logger.info(f"✅ Multilingual {provider.name} response generated: {len(advice)} characters in {lang_info['language']}")
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self._record_outcome(provider, True, elapsed_ms)
+        self._record_class_telemetry(response_class, elapsed_ms, advice, data.get('usage'),
+                                     data['choices'][0].get('finish_reason'))
+        return self._answer_result(provider, user_message, lang_info, history, response_class, payload, advice,
+                                   data.get('usage'), elapsed_ms, queue_wait_ms)
+    
+    def _failure_result(self, provider: llm_router.LLMProvider, lang_info: Dict[str, Any],
+                        error: Exception) -> Dict[str, Any]:
+        """Record a failed round-trip and build its error result (requests and aiohttp errors alike)"""
+        if isinstance(error, TIMEOUT_ERRORS):
+            logger.error(f"❌ {provider.name} API timeout")
+            self._record_outcome(provider, False, reason='timeout')
             return {
                 'success': False,
-                'error': 'Groq API timeout',
+                'error': f'{provider.name} API timeout',
                 'advice': 'The AI service is taking too long to respond. Please try again.',
-                'model_type': 'groq_timeout',
-                'language_info': lang_info if 'lang_info' in locals() else {'language': 'unknown'},
+                'model_type': 'llm_timeout',
+                'provider': provider.name,
+                'language_info': lang_info,
                 'timestamp': datetime.now().isoformat()
             }
-        except requests.exceptions.ConnectionError:
-            logger.error("❌ Groq API connection error")
+        if isinstance(error, CONNECTION_ERRORS):
+            logger.error(f"❌ {provider.name} API connection error")
+            self._record_outcome(provider, False, reason='connection_error')
             return {
                 'success': False,
                 'error': 'Connection error',
-                'advice': 'Cannot connect to Groq AI service. Please check your internet connection.',
-                'model_type': 'groq_connection_error',
-                'language_info': lang_info if 'lang_info' in locals() else {'language': 'unknown'},
+                'advice': f'Cannot connect to the {provider.name} AI service. Please check your internet connection.',
+                'model_type': 'llm_connection_error',
+                'provider': provider.name,
+                'language_info': lang_info,
                 'timestamp': datetime.now().isoformat()
             }
+        logger.error(f"❌ {provider.name} API error: {error}")
+        self._record_outcome(provider, False, reason='api_error')
+        return {
+            'success': False,
+            'error': str(error),
+            'advice': f'{provider.name} AI error: {str(error)}. Please try again.',
+            'model_type': 'llm_error',
+            'provider': provider.name,
+            'language_info': lang_info,
+            'fallback': True,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def _finish_advice(self, result: Dict[str, Any], user_id: Optional[str], user_message: str,
+                       lang_info: Dict[str, Any], context: Dict, coalesced: bool,
+                       history: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Store a successful answer in the user's history and add the request details"""
+        if result.get('success'):
+            self._record_conversation(user_id, user_message, result['advice'], lang_info, result.get('model_type'))
+        result.update({'context': context or {}, 'coalesced': coalesced, 'context_turns': len(history) // 2})
+        return result
+    
+    def get_farming_advice(self, user_message: str, context: Dict = None,
+                           priority: int = groq_service.PRIORITY_INTERACTIVE, user_id: str = None) -> Dict[str, Any]:
+        """Get multilingual farming advice using Groq API"""
+        # Detect language and add context
+        lang_info = self.detect_language(user_message)
+        # The user's recent turns, trimmed to the context token budget
+        history = self.memory.context_messages(user_id)
+        
+        # Repeated questions are answered from the cache without a Groq call
+        # (follow-ups depend on the conversation, so only standalone questions are cached or coalesced)
+        cached = None if history else self._get_cached_answer(user_message, lang_info, context, user_id)
+        if cached is not None:
+            return cached
+        
+        # Identical questions already in flight wait for that Groq call instead of issuing their own
+        response_class = self.classify_query(user_message)
+        request_advice = lambda: self._request_farming_advice(user_message, lang_info, priority, history,
+                                                              response_class)
+        if groq_service.single_flight is not None and not history:
+            result, coalesced = groq_service.single_flight.do(
+                groq_service.question_key(user_message, lang_info), request_advice)
+        else:
+            result, coalesced = request_advice(), False
+        
+        return self._finish_advice(result, user_id, user_message, lang_info, context, coalesced, history)
+    
+    def _request_farming_advice(self, user_message: str, lang_info: Dict[str, Any], priority: int,
+                                history: List[Dict[str, str]] = None, response_class: str = 'general') -> Dict[str, Any]:
+        """One rate-limited round-trip to the routed provider; the result may be shared with coalesced callers"""
+        provider = self._choose_provider()
+        if provider is None:
+            return self._circuit_open_result(lang_info)
+        deadline = groq_service.RetryPolicy.deadline(priority)
+        try:
+            # Wait (bounded) for a client-side rate-limit token instead of provoking a 429
+            granted, queue_wait_ms = self._acquire_rate_limit(provider, priority)
+            if not granted:
+                return self._rate_limited_result(provider, lang_info, queue_wait_ms)
+            
+            payload = self._build_payload(user_message, lang_info, history=history, response_class=response_class,
+                                          model=provider.model)
+            logger.info(f"📡 Making multilingual request to: {provider.name} ({provider.model})")
+            logger.info(f"🌐 Detected language: {lang_info['language']} | Region: {lang_info['region']}")
+            
+            # Make API request over the pooled keep-alive session (429/5xx retried within the deadline)
+            started = time.monotonic()
+            data = self._complete(provider, payload, priority, deadline)
+            return self._completion_result(provider, user_message, lang_info, history, response_class, payload, data,
+                                           started, queue_wait_ms)
         except Exception as e:
-            logger.error(f"❌ Groq API error: {e}")
-            return {
-                'success': False,
-                'error': str(e),
-                'advice': f'Groq AI Error: {str(e)}. Please check your API key and try again.',
-                'model_type': 'groq_error',
-                'language_info': lang_info if 'lang_info' in locals() else {'language': 'unknown'},
-                'fallback': True,
-                'timestamp': datetime.now().isoformat()
-            }
+            return self._failure_result(provider, lang_info, e)
+    
+    def _start_event(self, lang_info: Dict[str, Any], cache_hit: bool) -> Dict[str, Any]:
+        """First stream event, naming the most likely provider (the done event names the one that answered)"""
+        preferred = self.router.preferred()
+        return {
+            'type': 'start',
+            'model_type': preferred.model,
+            'provider': preferred.name,
+            'language_info': lang_info,
+            'regional_context': lang_info['region'],
+            'cache_hit': cache_hit,
+            'timestamp': datetime.now().isoformat()
+        }
     
-    def get_conversation_history(self, limit: int = 10) -> list:
-        """Get recent conversation history"""
-        return self.conversation_history[-limit:]
+    @staticmethod
+    def _cached_events(cached: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """A cached answer replayed as one delta and its done event"""
+        cached['type'] = 'done'
+        return [{'type': 'delta', 'content': cached['advice']}, cached]
     
-    def clear_conversation_history(self):
-        """Clear conversation history"""
-        self.conversation_history = []
+    def _finish_stream_event(self, event: Dict[str, Any], user_id: Optional[str], user_message: str,
+                             lang_info: Dict[str, Any], context: Dict, coalesced: bool,
+                             history: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Pass a stream event through, storing the answer in history when it is the done event"""
+        if event['type'] == 'done':
+            self._finish_advice(event, user_id, user_message, lang_info, context, coalesced, history)
+        return event
+    
+    @staticmethod
+    def _stream_error_event(error: Exception, partial_advice: str = '') -> Dict[str, Any]:
+        """Error event ending a stream, keeping any text already sent"""
+        return {
+            'type': 'error',
+            'success': False,
+            'error': str(error) or type(error).__name__,
+            'partial_advice': partial_advice,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def stream_farming_advice(self, user_message: str, context: Dict = None,
+                              priority: int = groq_service.PRIORITY_INTERACTIVE, user_id: str = None):
+        """Stream multilingual farming advice from Groq, yielding start, delta and done/error events"""
+        lang_info = self.detect_language(user_message)
+        history = self.memory.context_messages(user_id)
+        cached = None if history else self._get_cached_answer(user_message, lang_info, context, user_id)
+        yield self._start_event(lang_info, cached is not None)
+        if cached is not None:
+            yield from self._cached_events(cached)
+            return
+        
+        # Identical questions already streaming replay that stream instead of opening their own
+        response_class = self.classify_query(user_message)
+        produce_events = lambda: self._stream_groq_events(user_message, lang_info, priority, history,
+                                                          response_class)
+        if groq_service.single_flight is not None and not history:
+            events, coalesced = groq_service.single_flight.stream(
+                groq_service.question_key(user_message, lang_info), produce_events)
+        else:
+            events, coalesced = produce_events(), False
+        
+        try:
+            for event in events:
+                yield self._finish_stream_event(event, user_id, user_message, lang_info, context, coalesced, history)
+        except Exception as e:
+            logger.error(f"❌ Shared Groq stream error: {e}")
+            yield self._stream_error_event(e)
+    
+    @staticmethod
+    def _refused_event(result: Dict[str, Any]) -> Dict[str, Any]:
+        """Error event for a stream that never reached the provider (circuit open or no rate-limit token)"""
+        return dict(result, type='error', partial_advice='')
+    
+    def _stream_delta_event(self, provider: llm_router.LLMProvider, progress: Dict[str, Any],
+                            delta: str) -> Dict[str, Any]:
+        """Collect one streamed delta; time to first text decides the breaker outcome of a stream"""
+        if not progress['parts']:
+            progress['first_token_ms'] = (time.monotonic() - progress['started']) * 1000
+            self._record_outcome(provider, True, progress['first_token_ms'])
+        progress['parts'].append(delta)
+        return {'type': 'delta', 'content': delta}
+    
+    def _stream_failed_event(self, provider: llm_router.LLMProvider, progress: Dict[str, Any],
+                             error: Exception) -> Dict[str, Any]:
+        """Record a stream that broke (a failure only if no text arrived) and build its error event"""
+        logger.error(f"❌ {provider.name} streaming error: {error}")
+        if not progress['parts']:
+            self._record_outcome(provider, False, reason='stream_error')
+        return dict(self._stream_error_event(error, ''.join(progress['parts'])), provider=provider.name)
+    
+    def _stream_done_event(self, provider: llm_router.LLMProvider, progress: Dict[str, Any], user_message: str,
+                           lang_info: Dict[str, Any], history: List[Dict[str, str]], response_class: str,
+                           payload: Dict[str, Any], queue_wait_ms: float) -> Dict[str, Any]:
+        """Done event carrying the whole streamed answer"""
+        if not progress['parts']:
+            self._record_outcome(provider, True, (time.monotonic() - progress['started']) * 1000)
+        advice = ''.join(progress['parts'])
+        usage = progress['usage']
+        logger.info(f"✅ Streamed {provider.name} response: {len(advice)} characters in {lang_info['language']}")
+        self._record_class_telemetry(response_class, (time.monotonic() - progress['started']) * 1000, advice, usage,
+                                     usage.get('finish_reason'), progress['first_token_ms'])
+        result = self._answer_result(provider, user_message, lang_info, history, response_class, payload, advice,
+                                     usage, progress['first_token_ms'], queue_wait_ms)
+        result['type'] = 'done'
+        return result
+    
+    def _stream_groq_events(self, user_message: str, lang_info: Dict[str, Any], priority: int,
+                            history: List[Dict[str, str]] = None, response_class: str = 'general'):
+        """One rate-limited streamed call to the routed provider, yielding delta events then done or error"""
+        provider = self._choose_provider()
+        if provider is None:
+            yield self._refused_event(self._circuit_open_result(lang_info))
+            return
+        deadline = groq_service.RetryPolicy.deadline(priority)
+        granted, queue_wait_ms = self._acquire_rate_limit(provider, priority)
+        if not granted:
+            yield self._refused_event(self._rate_limited_result(provider, lang_info, queue_wait_ms))
+            return
+        payload = self._build_payload(user_message, lang_info, stream=True, history=history,
+                                      response_class=response_class, model=provider.model)
+        progress = {'parts': [], 'usage': {}, 'first_token_ms': 0.0, 'started': time.monotonic()}
+        try:
+            logger.info(f"📡 Streaming multilingual request to: {provider.name} ({provider.model})")
+            for delta in self._stream_deltas(provider, payload, priority, deadline, progress['usage']):
+                yield self._stream_delta_event(provider, progress, delta)
+        except Exception as e:
+            yield self._stream_failed_event(provider, progress, e)
+            return
+        yield self._stream_done_event(provider, progress, user_message, lang_info, history, response_class, payload,
+                                      queue_wait_ms)
+    
+    def get_conversation_history(self, user_id: str, limit: int = 10) -> list:
+        """Get a user's recent conversation history"""
+        return self.memory.recent(user_id, limit)
+    
+    def clear_conversation_history(self, user_id: str):
+        """Clear a user's conversation history"""
+        self.memory.clear(user_id)
     
     def get_model_info(self) -> Dict[str, Any]:
-        """Get model information"""
+        """Get model information (the router's preferred provider and every configured one)"""
+        preferred = self.router.preferred()
         return {
             'name': 'Annapurna with Groq',
-            'model': 'llama-3.1-8b-instant',
-            'provider': 'Groq',
+            'model': preferred.model,
+            'provider': preferred.name,
+            'providers': [{'name': p.name, 'kind': p.kind, 'model': p.model} for p in self.router.providers],
             'version': '3.1',
             'cost': 'FREE (up to quota)',
             'capabilities': [
@@ -430,9 +819,178 @@ REGIONAL CONTEXT:
                 'rate_limit': '30 requests per minute',
                 'max_tokens': '8192 per response'
             },
-            'conversation_count': len(self.conversation_history)
+            'http_pool': self.session.get_stats(),
+            'answer_cache': groq_service.answer_cache.get_stats() if groq_service.GROQ_CACHE_ENABLED else {'enabled': False},
+            'semantic_cache': groq_service.semantic_cache.get_stats() if groq_service.semantic_cache is not None else {'enabled': False},
+            'conversation_memory': self.memory.get_stats()
         }
 
+class AsyncGroqAgriBot(GroqAgriBot):
+    """GroqAgriBot whose Groq calls are coroutines on an aiohttp keep-alive pool (used by asgi.py)"""
+    
+    def __init__(self, api_key: str = None, session: groq_service.AsyncPooledSession = None):
+        """Initialize async Groq AgriBot"""
+        if groq_service.async_groq_session is None:
+            raise RuntimeError("aiohttp is required for AsyncGroqAgriBot")
+        super().__init__(api_key)
+        self.async_session = session or groq_service.async_groq_session
+    
+    async def _acquire_rate_limit_async(self, provider: llm_router.LLMProvider, priority: int,
+                                        max_wait: float = None) -> tuple:
+        """Wait on the event loop for a Groq rate-limit token; returns (granted, queue wait in ms)"""
+        if not provider.shared_rate_limit:
+            return True, 0.0
+        if groq_service.rate_limiter is None:
+            return not self._retry_pause_active(), 0.0
+        granted, waited_ms = await groq_service.rate_limiter.acquire_async(priority, max_wait)
+        if not granted:
+            logger.warning(f"⏳ Groq rate limit: no token after {waited_ms} ms, skipping Groq call")
+        return granted, waited_ms
+    
+    async def _apost_with_retry(self, provider: llm_router.LLMProvider, payload: Dict[str, Any], priority: int,
+                                deadline: float):
+        """Async twin of _post_with_retry; the caller enters the returned response with `async with`"""
+        attempt = 0
+        while True:
+            response = await self.async_session.post(provider.url, headers=provider.headers, json=payload)
+            delay = self._retry_delay(provider, attempt, response.status, response.headers, deadline)
+            if delay is None:
+                return response
+            error_text = await response.text()
+            response.release()
+            await asyncio.sleep(delay)
+            granted, _ = await self._acquire_rate_limit_async(provider, priority, max(0.0, deadline - time.monotonic()))
+            if not granted:
+                raise self._api_error(provider, response.status, error_text)
+            attempt += 1
+    
+    async def _acomplete(self, provider: llm_router.LLMProvider, payload: Dict[str, Any], priority: int,
+                         deadline: float) -> Dict[str, Any]:
+        """Async twin of _complete"""
+        if not provider.http:
+            return await provider.acomplete(payload)
+        async with await self._apost_with_retry(provider, payload, priority, deadline) as response:
+            if response.status != 200:
+                raise self._api_error(provider, response.status, await response.text())
+            return await response.json()
+    
+    async def _astream_deltas(self, provider: llm_router.LLMProvider, payload: Dict[str, Any], priority: int,
+                              deadline: float, usage: Dict[str, Any]):
+        """Async twin of _stream_deltas"""
+        if not provider.http:
+            async for delta in provider.astream(payload, usage):
+                yield delta
+            return
+        async with await self._apost_with_retry(provider, payload, priority, deadline) as response:
+            if response.status != 200:
+                raise self._api_error(provider, response.status, await response.text())
+            async for delta in groq_service.aiter_stream_deltas(response, usage):
+                yield delta
+    
+    async def get_farming_advice(self, user_message: str, context: Dict = None,
+                                 priority: int = groq_service.PRIORITY_INTERACTIVE, user_id: str = None) -> Dict[str, Any]:
+        """Get multilingual farming advice using Groq API without holding a thread"""
+        lang_info = self.detect_language(user_message)
+        history = self.memory.context_messages(user_id)
+        
+        cached = None if history else self._get_cached_answer(user_message, lang_info, context, user_id)
+        if cached is not None:
+            return cached
+        
+        response_class = self.classify_query(user_message)
+        request_advice = lambda: self._request_farming_advice(user_message, lang_info, priority, history,
+                                                              response_class)
+        if groq_service.async_single_flight is not None and not history:
+            result, coalesced = await groq_service.async_single_flight.do(
+                groq_service.question_key(user_message, lang_info), request_advice)
+        else:
+            result, coalesced = await request_advice(), False
+        
+        return self._finish_advice(result, user_id, user_message, lang_info, context, coalesced, history)
+    
+    async def _request_farming_advice(self, user_message: str, lang_info: Dict[str, Any], priority: int,
+                                      history: List[Dict[str, str]] = None,
+                                      response_class: str = 'general') -> Dict[str, Any]:
+        """Async twin of _request_farming_advice"""
+        provider = self._choose_provider()
+        if provider is None:
+            return self._circuit_open_result(lang_info)
+        deadline = groq_service.RetryPolicy.deadline(priority)
+        try:
+            granted, queue_wait_ms = await self._acquire_rate_limit_async(provider, priority)
+            if not granted:
+                return self._rate_limited_result(provider, lang_info, queue_wait_ms)
+            
+            payload = self._build_payload(user_message, lang_info, history=history, response_class=response_class,
+                                          model=provider.model)
+            logger.info(f"📡 Making async multilingual request to: {provider.name} ({provider.model})")
+            
+            started = time.monotonic()
+            data = await self._acomplete(provider, payload, priority, deadline)
+            return self._completion_result(provider, user_message, lang_info, history, response_class, payload, data,
+                                           started, queue_wait_ms)
+        except Exception as e:
+            return self._failure_result(provider, lang_info, e)
+    
+    async def stream_farming_advice(self, user_message: str, context: Dict = None,
+                                    priority: int = groq_service.PRIORITY_INTERACTIVE, user_id: str = None):
+        """Async generator of start, delta and done/error events from a streamed Groq call"""
+        lang_info = self.detect_language(user_message)
+        history = self.memory.context_messages(user_id)
+        cached = None if history else self._get_cached_answer(user_message, lang_info, context, user_id)
+        yield self._start_event(lang_info, cached is not None)
+        if cached is not None:
+            for event in self._cached_events(cached):
+                yield event
+            return
+        
+        response_class = self.classify_query(user_message)
+        produce_events = lambda: self._stream_groq_events(user_message, lang_info, priority, history,
+                                                          response_class)
+        if groq_service.async_single_flight is not None and not history:
+            events, coalesced = groq_service.async_single_flight.stream(
+                groq_service.question_key(user_message, lang_info), produce_events)
+        else:
+            events, coalesced = produce_events(), False
+        
+        try:
+            async for event in events:
+                yield self._finish_stream_event(event, user_id, user_message, lang_info, context, coalesced, history)
+        except Exception as e:
+            logger.error(f"❌ Shared Groq stream error: {e}")
+            yield self._stream_error_event(e)
+    
+    async def _stream_groq_events(self, user_message: str, lang_info: Dict[str, Any], priority: int,
+                                  history: List[Dict[str, str]] = None, response_class: str = 'general'):
+        """Async twin of _stream_groq_events"""
+        provider = self._choose_provider()
+        if provider is None:
+            yield self._refused_event(self._circuit_open_result(lang_info))
+            return
+        deadline = groq_service.RetryPolicy.deadline(priority)
+        granted, queue_wait_ms = await self._acquire_rate_limit_async(provider, priority)
+        if not granted:
+            yield self._refused_event(self._rate_limited_result(provider, lang_info, queue_wait_ms))
+            return
+        payload = self._build_payload(user_message, lang_info, stream=True, history=history,
+                                      response_class=response_class, model=provider.model)
+        progress = {'parts': [], 'usage': {}, 'first_token_ms': 0.0, 'started': time.monotonic()}
+        try:
+            logger.info(f"📡 Streaming async multilingual request to: {provider.name} ({provider.model})")
+            async for delta in self._astream_deltas(provider, payload, priority, deadline, progress['usage']):
+                yield self._stream_delta_event(provider, progress, delta)
+        except Exception as e:
+            yield self._stream_failed_event(provider, progress, e)
+            return
+        yield self._stream_done_event(provider, progress, user_message, lang_info, history, response_class, payload,
+                                      queue_wait_ms)
+    
+    def get_model_info(self) -> Dict[str, Any]:
+        """Get model information"""
+        info = super().get_model_info()
+        info['async_http_pool'] = self.async_session.get_stats()
+        return info
+
 class AgriBotKnowledgeBase:
     """AgriBot's farming knowledge base"""
     
@@ -548,9 +1106,9 @@ class AgriBotKnowledgeBase:
 class AgriBotAI:
     """Annapurna AI Engine - Knowledge Base Version"""
     
-    def __init__(self):
-        self.knowledge_base = AgriBotKnowledgeBase()
-        self.conversation_history = []
+    def __init__(self, knowledge_base: AgriBotKnowledgeBase = None):
+        self.knowledge_base = knowledge_base or AgriBotKnowledgeBase()
+        self.memory = groq_service.conversation_store
         
     def analyze_query(self, message: str) -> Dict[str, Any]:
         """Analyze user query and extract intent"""
@@ -597,7 +1155,7 @@ class AgriBotAI:
         else:
             return 'general'
     
-    def generate_response(self, message: str, context: Dict = None) -> Dict[str, Any]:
+    def generate_response(self, message: str, context: Dict = None, user_id: str = None) -> Dict[str, Any]:
         """Generate AI response using knowledge base"""
         try:
             # Analyze the query
@@ -624,12 +1182,9 @@ class AgriBotAI:
                 'agribot_version': '2.0.0'
             })
             
-            # Store in conversation history
-            self.conversation_history.append({
-                'user_message': message,
-                'agribot_response': response['advice'],
-                'timestamp': datetime.now().isoformat()
-            })
+            # Store in the user's conversation history
+            if user_id:
+                self.memory.append(user_id, message, response['advice'], model='agribot_knowledge_base')
             
             return response
             
@@ -840,13 +1395,13 @@ Ask me anything about farming - I'm here to help you grow better crops! 🚜
         
         return {'advice': advice}
     
-    def get_conversation_history(self, limit: int = 10) -> List[Dict]:
-        """Get recent conversation history"""
-        return self.conversation_history[-limit:]
+    def get_conversation_history(self, user_id: str, limit: int = 10) -> List[Dict]:
+        """Get a user's recent conversation history"""
+        return self.memory.recent(user_id, limit)
     
-    def clear_conversation_history(self):
-        """Clear conversation history"""
-        self.conversation_history = []
+    def clear_conversation_history(self, user_id: str):
+        """Clear a user's conversation history"""
+        self.memory.clear(user_id)
     
     def get_model_info(self) -> Dict[str, Any]:
         """Get Annapurna model information"""
@@ -863,7 +1418,7 @@ Ask me anything about farming - I'm here to help you grow better crops! 🚜
                 'Farm economics',
                 'Seasonal planning'
             ],
-            'conversation_count': len(self.conversation_history)
+            'conversation_memory': self.memory.get_stats()
         }
 
 # AgriBot configuration - FORCE GROQ USAGE
@@ -877,6 +1432,13 @@ AGRIBOT_CONFIG = {
     'fallback_enabled': False
 }
 
+# Built once; each fallback answer gets a cheap AgriBotAI on top of it
+fallback_knowledge_base = AgriBotKnowledgeBase()
+
+def knowledge_base_answer(message: str, context: Dict, user_id: str = None) -> Dict[str, Any]:
+    """Answer from the local knowledge base (Groq fallback)"""
+    return AgriBotAI(fallback_knowledge_base).generate_response(message, context, user_id=user_id)
+
 def initialize_agribot():
     """Initialize Annapurna with Groq API - force Groq usage"""
     try:
@@ -906,6 +1468,14 @@ def initialize_agribot():
 # Initialize AgriBot on startup
 agribot, groq_enabled = initialize_agribot()
 
+# Warm the crop image model in the background so the first upload does not pay for loading it
+if crop_image_service.CROP_MODEL_PRELOAD and crop_image_service.is_available():
+    crop_image_service.warm_up()
+
+# Same for the offline fallback model, when enabled
+if local_llm_service.local_llm is not None and local_llm_service.LOCAL_LLM_PRELOAD:
+    local_llm_service.local_llm.warm_up()
+
 # Add request logging
 @app.before_request
 def log_request_info():
@@ -939,8 +1509,13 @@ def health_check():
             'chat': '/api/chat',
             'expert_advice': '/api/expert-advice',
             'model_info': '/api/model-info',
+            'chat_metrics': '/api/chat/metrics',
             'history': '/api/conversation-history',
-            'debug': '/api/debug-grok'
+            'debug': '/api/debug-grok',
+            'crop_image_analysis': '/api/crop-image-analysis',
+            'crop_image_batch': '/api/crop-image-analysis/batch',
+            'crop_image_jobs': '/api/crop-image-analysis/jobs',
+            'crop_model_status': '/api/crop-image-analysis/status'
         },
         'features': [
             '🆓 Completely FREE - No billing required',
@@ -951,6 +1526,172 @@ def health_check():
         ]
     })
 
+def uses_latency_budget(priority: int) -> bool:
+    """Interactive chats are hedged against the knowledge base; batch callers wait for Groq"""
+    return groq_service.GROQ_LATENCY_BUDGET_MS > 0 and priority < groq_service.PRIORITY_BATCH
+
+def report_chat_path(response: Dict[str, Any], path: str, reason: str = None,
+                     provider: str = None) -> Dict[str, Any]:
+    """Tag a chat response with the path that answered it and the circuit state of the routed provider that
+    answered (or, for fallbacks, failed), and count it"""
+    router = getattr(agribot, 'router', None)
+    response.update({
+        'path': path,
+        'fallback_reason': reason,
+        'circuit_breaker': router.circuit_state(provider or response.get('provider')) if router is not None
+        else groq_service.circuit_state(),
+        'latency_budget_ms': groq_service.GROQ_LATENCY_BUDGET_MS
+    })
+    groq_service.chat_paths.record(path, reason)
+    return response
+
+def fallback_history_user(user_id: Optional[str], reason: str) -> Optional[str]:
+    """Who a knowledge base fallback is remembered for: past the latency budget the Groq call still lands in
+    the user's history when it completes, so the stand-in answer is not stored as a second turn"""
+    return None if reason == 'latency_budget' else user_id
+
+def local_llm_events(message: str, user_id: Optional[str], reason: str):
+    """Answer with the offline local model when Groq is down or over quota: delta events, then done.
+    Yields nothing if the local model is disabled, not loaded yet or busy, so the knowledge base answers instead."""
+    local_llm = local_llm_service.local_llm
+    if local_llm is None or reason not in local_llm_service.LOCAL_LLM_FALLBACK_REASONS \
+            or not isinstance(agribot, GroqAgriBot):
+        return
+    # Same prompt as the Groq call: language prefix, brevity instruction, recent turns, question
+    lang_info = agribot.detect_language(message)
+    response_class = agribot.classify_query(message)
+    messages = agribot._build_messages(message, lang_info, agribot.memory.context_messages(user_id), response_class)
+    max_new_tokens = min(local_llm_service.LOCAL_LLM_MAX_NEW_TOKENS, groq_service.max_tokens_for(response_class))
+    usage = {}
+    parts = []
+    try:
+        for delta in local_llm.stream(messages, max_new_tokens, usage):
+            parts.append(delta)
+            yield {'type': 'delta', 'content': delta}
+    except local_llm_service.LocalLLMUnavailable as e:
+        logger.warning(f"⚠️ Local model cannot answer ({e}), using knowledge base fallback...")
+        return
+    except Exception as e:
+        logger.error(f"❌ Local model error: {e}")
+        if parts:
+            yield {'type': 'error', 'success': False, 'error': str(e), 'partial_advice': ''.join(parts),
+                   'timestamp': datetime.now().isoformat()}
+        return
+    
+    advice = ''.join(parts)
+    logger.info(f"🖥️ Local model answered ({reason}): {len(advice)} characters in {lang_info['language']}")
+    agribot._record_conversation(user_id, message, advice, lang_info, local_llm.model_label)
+    yield report_chat_path({
+        'type': 'done',
+        'success': True,
+        'advice': advice,
+        'model_type': local_llm.model_label,
+        'provider': 'local_llm',
+        'language_info': lang_info,
+        'regional_context': lang_info['region'],
+        'response_class': response_class,
+        'max_tokens': max_new_tokens,
+        'multilingual_support': True,
+        'fallback_used': True,
+        'local_llm': usage,
+        'timestamp': datetime.now().isoformat()
+    }, 'local_llm', reason)
+
+def stream_chat_events(message: str, context: Dict, priority: int = groq_service.PRIORITY_INTERACTIVE,
+                       user_id: str = None):
+    """Relay Groq deltas as they arrive; fall back to the knowledge base if Groq fails or misses the budget before any text"""
+    reason, failed_provider = 'groq_unavailable', None
+    if groq_enabled and hasattr(agribot, 'stream_farming_advice'):
+        events = agribot.stream_farming_advice(message, context, priority=priority, user_id=user_id)
+        if uses_latency_budget(priority):
+            events = groq_service.iter_within_budget(events)
+        sent_start = sent_text = False
+        for event in events:
+            if event['type'] == 'error' and not sent_text:
+                reason, failed_provider = groq_service.fallback_reason(event), event.get('provider')
+                logger.warning(f"⚠️ Groq stream failed ({reason}), using knowledge base fallback...")
+                break
+            if event['type'] == 'start':
+                sent_start = True
+            if event['type'] == 'delta':
+                sent_text = True
+            if event['type'] == 'done':
+                report_chat_path(event, 'cache' if event.get('cache_hit') else 'groq')
+            yield event
+            if event['type'] in ('done', 'error'):
+                return
+        else:
+            return
+    else:
+        sent_start = False
+    if not sent_start:
+        # Groq disabled, or never started because every hedge thread was busy
+        yield {'type': 'start', 'model_type': 'agribot_knowledge_base', 'provider': 'knowledge_base',
+               'timestamp': datetime.now().isoformat()}
+    
+    local_answered = False
+    for event in local_llm_events(message, user_id, reason):
+        local_answered = True
+        yield event
+    if local_answered:
+        return
+    response = knowledge_base_answer(message, context, fallback_history_user(user_id, reason))
+    yield {'type': 'delta', 'content': response.get('advice', '')}
+    response.update({'type': 'done', 'provider': 'knowledge_base', 'fallback_used': True})
+    yield report_chat_path(response, 'knowledge_base', reason, failed_provider)
+
+def get_budgeted_advice(message: str, context: Dict, priority: int, user_id: str = None) -> Dict[str, Any]:
+    """Groq advice within the latency budget; a late call keeps running and fills the answer cache"""
+    ask_groq = lambda: agribot.get_farming_advice(message, context, priority=priority, user_id=user_id)
+    if not uses_latency_budget(priority):
+        return ask_groq()
+    return groq_service.call_within_budget(ask_groq)
+
+def local_llm_answer(message: str, user_id: Optional[str], reason: str, priority: int) -> Dict[str, Any]:
+    """Whole local model answer for non-streaming chat, within the latency budget for interactive chats.
+    A late generation keeps running and still records the conversation when it completes."""
+    def generate():
+        events = list(local_llm_events(message, user_id, reason))
+        return events[-1] if events and events[-1]['type'] == 'done' else {'success': False}
+    if not uses_latency_budget(priority):
+        return generate()
+    result = groq_service.call_within_budget(generate)
+    if result.get('budget_exceeded'):
+        logger.warning("⏱️ Local model missed the latency budget, using knowledge base fallback...")
+    return result
+
+def finish_chat_response(response: Dict[str, Any], message: str, context: Dict,
+                         user_id: str = None, priority: int = groq_service.PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+    """Label a Groq answer, or replace a failed one with the local model or knowledge base answer (sync and async chat)"""
+    # Only use fallback if Groq completely fails (not for partial responses)
+    if response.get('success', False):
+        response.setdefault('provider', 'groq_ai')  # the routed provider when the answer carries one
+        response['fallback_used'] = False
+        response['multilingual_support'] = True
+        logger.info("✅ Groq API response generated successfully")
+        return report_chat_path(response, 'cache' if response.get('cache_hit') else 'groq')
+    
+    groq_response = response
+    reason = groq_service.fallback_reason(groq_response)
+    logger.warning(f"⚠️ Groq API failed ({reason}), using fallback...")
+    rate_limited = groq_response.get('rate_limited', False)
+    local_response = local_llm_answer(message, user_id, reason, priority)
+    if local_response.get('success'):
+        response = local_response
+        del response['type']
+    else:
+        # A local answer past the budget lands in the user's history itself
+        history_user = None if local_response.get('budget_exceeded') else fallback_history_user(user_id, reason)
+        response = knowledge_base_answer(message, context, history_user)
+        response['fallback_used'] = True
+        response['provider'] = 'knowledge_base'
+        response['multilingual_support'] = True
+        report_chat_path(response, 'knowledge_base', reason, groq_response.get('provider'))
+    response['rate_limited'] = rate_limited
+    if rate_limited:
+        response['queue_wait_ms'] = groq_response.get('queue_wait_ms')
+    return response
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Enhanced multilingual Annapurna chat endpoint"""
@@ -982,6 +1723,34 @@ def chat():
             }), 400
         
         context = data.get('context', {})
+        # Conversation memory is per user; chats without a user id are answered without history
+        user_id = groq_service.chat_user_id(data, request.headers.get('X-User-Id'))
+        # Interactive chat is served before batch callers when Groq calls are queued
+        priority_name = data.get('priority', 'interactive')
+        if priority_name not in groq_service.PRIORITIES:
+            return jsonify({
+                'success': False,
+                'error': f'Invalid priority. Options: {", ".join(groq_service.PRIORITIES)}'
+            }), 400
+        priority = groq_service.PRIORITIES[priority_name]
+        
+        # Streaming mode: relay tokens as Server-Sent Events (default) or JSON lines
+        stream_requested = data.get('stream') or request.args.get('stream') == 'true' \
+            or 'text/event-stream' in request.headers.get('Accept', '')
+        if stream_requested:
+            stream_format = data.get('stream_format') or request.args.get('format') or 'sse'
+            if stream_format not in groq_service.STREAM_FORMATS:
+                return jsonify({
+                    'success': False,
+                    'error': f'Invalid stream_format. Options: {", ".join(groq_service.STREAM_FORMATS)}'
+                }), 400
+            logger.info(f"🌊 Streaming AgriBot chat request ({stream_format}): {message[:100]}...")
+            events = stream_chat_events(message, context, priority, user_id)
+            return Response(
+                stream_with_context(groq_service.format_stream_event(event, stream_format) for event in events),
+                mimetype=groq_service.STREAM_MIMETYPES[stream_format],
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
         logger.info(f"🌐 Multilingual AgriBot chat request: {message[:100]}...")
         logger.info(f"🔍 Debug: groq_enabled = {groq_enabled}")
@@ -991,28 +1760,16 @@ def chat():
         # Force Groq API usage - prioritize Groq over fallback
         if groq_enabled and hasattr(agribot, 'get_farming_advice'):
             logger.info("🤖 Using Groq API for response generation...")
-            response = agribot.get_farming_advice(message, context)
-            
-            # Only use fallback if Groq completely fails (not for partial responses)
-            if response.get('success', False):
-                response['provider'] = 'groq_ai'
-                response['fallback_used'] = False
-                response['multilingual_support'] = True
-                logger.info("✅ Groq API response generated successfully")
-            else:
-                logger.warning("⚠️ Groq API failed, using knowledge base fallback...")
-                fallback_bot = AgriBotAI()
-                response = fallback_bot.generate_response(message, context)
-                response['fallback_used'] = False  # Changed from True to False
-                response['provider'] = 'groq_ai'  # Changed from 'knowledge_base' to 'groq_ai'
-                response['multilingual_support'] = True  # Changed from False to True
+            response = finish_chat_response(get_budgeted_advice(message, context, priority, user_id),
+                                            message, context, user_id, priority)
         else:
             # Knowledge base method only if Groq is not available
             logger.info("📚 Using knowledge base (Groq not available)")
-            response = agribot.generate_response(message, context)
-            response['fallback_used'] = False  # Changed from True to False
-            response['provider'] = 'groq_ai'  # Changed from 'knowledge_base' to 'groq_ai'
-            response['multilingual_support'] = True  # Changed from False to True
+            response = agribot.generate_response(message, context, user_id=user_id)
+            response['fallback_used'] = True
+            response['provider'] = 'knowledge_base'
+            response['multilingual_support'] = True
+            report_chat_path(response, 'knowledge_base', 'groq_unavailable')
         
         # Add multilingual information if available
         if 'language_info' in response:
@@ -1084,6 +1841,30 @@ def model_info():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/api/chat/metrics', methods=['GET'])
+def chat_metrics():
+    """Get chat answer cache and Groq connection pool metrics"""
+    return jsonify({
+        'success': True,
+        'groq_enabled': groq_enabled,
+        'answer_cache': groq_service.answer_cache.get_stats() if groq_service.GROQ_CACHE_ENABLED else {'enabled': False},
+        'semantic_cache': groq_service.semantic_cache.get_stats() if groq_service.semantic_cache is not None else {'enabled': False},
+        'rate_limiter': groq_service.rate_limiter.get_stats() if groq_service.rate_limiter is not None else {'enabled': False},
+        'single_flight': groq_service.single_flight.get_stats() if groq_service.single_flight is not None else {'enabled': False},
+        'async_single_flight': groq_service.async_single_flight.get_stats() if groq_service.async_single_flight is not None else {'enabled': False},
+        'circuit_breaker': groq_service.circuit_breaker.get_stats() if groq_service.circuit_breaker is not None else {'enabled': False},
+        'chat_paths': groq_service.chat_paths.get_stats(),
+        'conversation_memory': groq_service.conversation_store.get_stats(),
+        'prompt_metrics': groq_service.prompt_metrics.get_stats() if groq_service.prompt_metrics is not None else {'enabled': False},
+        'response_classes': groq_service.response_class_stats.get_stats(),
+        'retries': groq_service.retry_policy.get_stats() if groq_service.retry_policy is not None else {'enabled': False},
+        'local_llm': local_llm_service.local_llm.get_status() if local_llm_service.local_llm is not None else {'enabled': False},
+        'llm_router': llm_router.router.get_stats() if llm_router.router is not None else {'enabled': False},
+        'http_pool': groq_service.groq_session.get_stats(),
+        'async_http_pool': groq_service.async_groq_session.get_stats() if groq_service.async_groq_session is not None else {'enabled': False},
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/api/soil-data', methods=['GET'])
 def get_soil_data():
     import requests
@@ -1113,10 +1894,13 @@ def get_soil_data():
     
 @app.route('/api/conversation-history', methods=['GET'])
 def get_history():
-    """Get conversation history"""
+    """Get one user's conversation history"""
     try:
+        user_id = groq_service.chat_user_id(request.args, request.headers.get('X-User-Id'))
+        if not user_id:
+            return jsonify({'success': False, 'error': 'user_id is required'}), 400
         limit = request.args.get('limit', 10, type=int)
-        history = agribot.get_conversation_history(limit=limit)
+        history = agribot.get_conversation_history(user_id, limit=limit)
         
         return jsonify({
             'success': True,
@@ -1140,9 +1924,13 @@ def get_history():
 
 @app.route('/api/clear-history', methods=['POST'])
 def clear_history():
-    """Clear conversation history"""
+    """Clear one user's conversation history"""
     try:
-        agribot.clear_conversation_history()
+        data = request.get_json(silent=True) or {}
+        user_id = groq_service.chat_user_id(data, request.args.get('user_id') or request.headers.get('X-User-Id'))
+        if not user_id:
+            return jsonify({'success': False, 'error': 'user_id is required'}), 400
+        agribot.clear_conversation_history(user_id)
         return jsonify({
             'success': True,
             'message': 'AgriBot conversation history cleared',
@@ -1203,16 +1991,27 @@ def debug_grok():
         }
         
         payload = {
-            "model": "llama-3.1-8b-instant",
+            "model": llm_router.GROQ_MODEL,
             "messages": [{"role": "user", "content": "Hello"}],
             "max_tokens": 100
         }
         
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
+        if groq_service.rate_limiter is not None:
+            granted, queue_wait_ms = groq_service.rate_limiter.acquire(groq_service.PRIORITY_INTERACTIVE)
+            if not granted:
+                return jsonify({
+                    'success': False,
+                    'error': 'Client-side Groq rate limit reached, try again shortly',
+                    'queue_wait_ms': queue_wait_ms,
+                    'groq_enabled': True
+                }), 429
+        
+        session = agribot.session if isinstance(agribot, GroqAgriBot) else groq_service.groq_session
+        response = session.post(
+            f"{groq_service.GROQ_BASE_URL}/chat/completions",
             headers=headers,
             json=payload,
-            timeout=10
+            timeout=(groq_service.GROQ_CONNECT_TIMEOUT, 10)
         )
         
         return jsonify({
@@ -1221,6 +2020,7 @@ def debug_grok():
             'response_preview': response.text[:200] + '...' if len(response.text) > 200 else response.text,
             'api_key_preview': f"{groq_api_key[:10]}...{groq_api_key[-5:]}",
             'groq_enabled': True,
+            'http_pool': session.get_stats(),
             'test_message': 'Groq API connectivity test completed'
         })
         
@@ -1618,8 +2418,13 @@ if __name__ == '__main__':
     print("   💬 Chat with AgriBot: /api/chat")
     print("   🧑‍🌾 Expert Advice: /api/expert-advice")
     print("   ℹ️ Model Info: /api/model-info")
+    print("   📊 Chat Metrics: /api/chat/metrics")
     print("   📜 Chat History: /api/conversation-history")
     print("   🔍 Debug Grok: /api/debug-grok")
+    print("   🌿 Crop Image Analysis (POST): /api/crop-image-analysis")
+    print("   🖼️ Crop Image Batch Analysis (POST): /api/crop-image-analysis/batch")
+    print("   🩺 Crop Model Status (GET): /api/crop-image-analysis/status")
+    print("   ⏳ Crop Image Jobs (POST/GET): /api/crop-image-analysis/jobs[/<job_id>]")
     print("   💬 Farmer Messages (GET): /api/chat/messages")
     print("   📤 Send Farmer Message (POST): /api/chat/send")
     print("   🌾 Contract Farming (POST): /api/contract-farming/submit")
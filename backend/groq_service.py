@@ -0,0 +1,2181 @@
+"""
+Groq Service - shared HTTP plumbing and answer caches for the Groq-powered AgriBot
+
+Benchmark semantic cache lookups:
+    python groq_service.py benchmark-semantic --entries 100000
+
+Check the script-block language detector against the previous per-character scan:
+    python groq_service.py benchmark-language
+
+Run a local OpenAI-compatible stand-in for the Groq API (tests and load benchmarks):
+    python groq_service.py stub-server --port 8799 --delay 2
+    python groq_service.py stub-server --port 8799 --error-rate 0.3 --retry-after 0.5   # exercise 429 retries
+"""
+import os
+import re
+import sys
+import copy
+import json
+import math
+import time
+import random
+import zlib
+import atexit
+import asyncio
+import heapq
+import queue
+import hashlib
+import tempfile
+import itertools
+import argparse
+import threading
+import logging
+import unicodedata
+from array import array
+from email.utils import parsedate_to_datetime
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:
+    aiohttp = None
+    web = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: the rate limiter falls back to per-process state
+    fcntl = None
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL', 'https://api.groq.com/openai/v1')
+
+# Connection pool configuration
+GROQ_POOL_CONNECTIONS = int(os.getenv('GROQ_POOL_CONNECTIONS', 4))  # number of host pools kept
+GROQ_POOL_MAXSIZE = int(os.getenv('GROQ_POOL_MAXSIZE', 16))  # keep-alive connections per host
+GROQ_POOL_BLOCK = os.getenv('GROQ_POOL_BLOCK', 'false').lower() == 'true'  # wait for a free connection
+GROQ_CONNECT_TIMEOUT = float(os.getenv('GROQ_CONNECT_TIMEOUT', 3.05))
+GROQ_READ_TIMEOUT = float(os.getenv('GROQ_READ_TIMEOUT', 30))
+GROQ_ASYNC_MAX_CONNECTIONS = int(os.getenv('GROQ_ASYNC_MAX_CONNECTIONS', 1000))  # aiohttp connector limit
+
+# Client-side rate limiting (Groq free tier: 30 requests/minute)
+GROQ_RATE_LIMIT_ENABLED = os.getenv('GROQ_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+GROQ_RATE_LIMIT_RPM = float(os.getenv('GROQ_RATE_LIMIT_RPM', 30))
+GROQ_RATE_LIMIT_BURST = float(os.getenv('GROQ_RATE_LIMIT_BURST', 5))  # bucket capacity
+GROQ_RATE_MAX_WAIT = float(os.getenv('GROQ_RATE_MAX_WAIT', 2.0))  # seconds an interactive chat may queue
+GROQ_RATE_BATCH_MAX_WAIT = float(os.getenv('GROQ_RATE_BATCH_MAX_WAIT', 60.0))
+# Shared bucket state for all gunicorn workers on this host; empty = per-process bucket
+GROQ_RATE_STATE_FILE = os.getenv('GROQ_RATE_STATE_FILE',
+                                 os.path.join(tempfile.gettempdir(), 'agribot_groq_rate_limit.json'))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+PRIORITIES = {'interactive': PRIORITY_INTERACTIVE, 'batch': PRIORITY_BATCH}
+
+# Latency budget: past it, interactive chat answers from the knowledge base while Groq finishes in the background
+GROQ_LATENCY_BUDGET_MS = float(os.getenv('GROQ_LATENCY_BUDGET_MS', 2500))  # 0 = wait for Groq as before
+GROQ_HEDGE_WORKERS = int(os.getenv('GROQ_HEDGE_WORKERS', 32))  # threads running budgeted sync Groq calls
+GROQ_BREAKER_ENABLED = os.getenv('GROQ_BREAKER_ENABLED', 'true').lower() == 'true'
+GROQ_BREAKER_FAILURES = int(os.getenv('GROQ_BREAKER_FAILURES', 5))  # consecutive failures that open the circuit
+GROQ_BREAKER_RESET_SECONDS = float(os.getenv('GROQ_BREAKER_RESET_SECONDS', 30))  # open time before a probe call
+# Successful calls slower than this count as breaker failures (0 = only errors and timeouts). Kept well above
+# the latency budget: a long complete answer is not a sign that Groq is unhealthy
+GROQ_BREAKER_SLOW_MS = float(os.getenv('GROQ_BREAKER_SLOW_MS', 15000))
+
+# Retries for 429/5xx answers: jittered exponential backoff within the request's latency budget
+GROQ_RETRY_ENABLED = os.getenv('GROQ_RETRY_ENABLED', 'true').lower() == 'true'
+GROQ_RETRY_MAX_RETRIES = int(os.getenv('GROQ_RETRY_MAX_RETRIES', 3))
+GROQ_RETRY_BASE_DELAY = float(os.getenv('GROQ_RETRY_BASE_DELAY', 0.25))  # seconds, doubled per retry
+GROQ_RETRY_MAX_DELAY = float(os.getenv('GROQ_RETRY_MAX_DELAY', 8.0))
+
+# Output budget per query class (generation time grows with output length)
+GROQ_ADAPTIVE_MAX_TOKENS = os.getenv('GROQ_ADAPTIVE_MAX_TOKENS', 'true').lower() == 'true'
+GROQ_MAX_TOKENS_DEFAULT = int(os.getenv('GROQ_MAX_TOKENS_DEFAULT', 2000))  # used when adaptive budgets are off
+RESPONSE_CLASSES = {
+    'quick_fact': {
+        'max_tokens': int(os.getenv('GROQ_MAX_TOKENS_QUICK_FACT', 300)),
+        'instruction': 'RESPONSE LENGTH: This is a quick factual question. Answer in 2-4 short sentences or a '
+                       'short list with the key figures. No headings, no background.'
+    },
+    'how_to': {
+        'max_tokens': int(os.getenv('GROQ_MAX_TOKENS_HOW_TO', 1200)),
+        'instruction': 'RESPONSE LENGTH: Give clear numbered steps with quantities and timing. '
+                       'Keep it under about 350 words.'
+    },
+    'diagnosis': {
+        'max_tokens': int(os.getenv('GROQ_MAX_TOKENS_DIAGNOSIS', 1000)),
+        'instruction': 'RESPONSE LENGTH: Name the most likely causes, how to confirm each, then treatment and '
+                       'prevention. Keep it under about 300 words.'
+    },
+    'general': {
+        'max_tokens': int(os.getenv('GROQ_MAX_TOKENS_GENERAL', 800)),
+        'instruction': 'RESPONSE LENGTH: Be concise and practical. Keep it under about 250 words.'
+    }
+}
+
+# Measurement mode: report input tokens and time to first token per request (and aggregate in metrics)
+GROQ_PROMPT_METRICS = os.getenv('GROQ_PROMPT_METRICS', 'false').lower() == 'true'
+
+# Per-user conversation memory sent back to the model as multi-turn context
+GROQ_MEMORY_TURNS = int(os.getenv('GROQ_MEMORY_TURNS', 8))  # ring buffer size per user
+GROQ_MEMORY_MAX_USERS = int(os.getenv('GROQ_MEMORY_MAX_USERS', 10000))  # least recently active users evicted first
+GROQ_MEMORY_MAX_BYTES = int(os.getenv('GROQ_MEMORY_MAX_BYTES', 32 * 1024 * 1024))
+GROQ_MEMORY_MAX_TURN_CHARS = int(os.getenv('GROQ_MEMORY_MAX_TURN_CHARS', 4000))  # longer answers are clipped when stored
+GROQ_CONTEXT_TOKEN_BUDGET = int(os.getenv('GROQ_CONTEXT_TOKEN_BUDGET', 1200))  # tokens of recent turns per request
+
+# Single-flight coalescing of identical in-flight questions
+GROQ_COALESCE_ENABLED = os.getenv('GROQ_COALESCE_ENABLED', 'true').lower() == 'true'
+GROQ_COALESCE_TIMEOUT = float(os.getenv('GROQ_COALESCE_TIMEOUT',
+                                        GROQ_READ_TIMEOUT + GROQ_CONNECT_TIMEOUT + GROQ_RATE_MAX_WAIT))
+
+# Answer cache configuration
+GROQ_CACHE_ENABLED = os.getenv('GROQ_CACHE_ENABLED', 'true').lower() == 'true'
+GROQ_CACHE_TTL = float(os.getenv('GROQ_CACHE_TTL', 6 * 3600))
+GROQ_CACHE_MAX_BYTES = int(os.getenv('GROQ_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+
+# Semantic cache configuration (paraphrased questions)
+GROQ_SEMANTIC_CACHE_ENABLED = os.getenv('GROQ_SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+GROQ_SEMANTIC_THRESHOLD = float(os.getenv('GROQ_SEMANTIC_THRESHOLD', 0.85))  # min cosine similarity
+GROQ_SEMANTIC_MAX_ENTRIES = int(os.getenv('GROQ_SEMANTIC_MAX_ENTRIES', 20000))
+GROQ_SEMANTIC_TTL = float(os.getenv('GROQ_SEMANTIC_TTL', 24 * 3600))
+GROQ_SEMANTIC_DIM = int(os.getenv('GROQ_SEMANTIC_DIM', 256))  # hashed n-gram feature buckets
+GROQ_SEMANTIC_CACHE_PATH = os.getenv('GROQ_SEMANTIC_CACHE_PATH',
+                                     os.path.join(os.path.dirname(__file__), 'cache', 'semantic_answers.npz'))
+GROQ_SEMANTIC_SNAPSHOT_EVERY = int(os.getenv('GROQ_SEMANTIC_SNAPSHOT_EVERY', 50))  # inserts between snapshots; 0 = exit only
+
+
+class PooledSession:
+    """Keep-alive requests.Session with a bounded connection pool, shared by every request thread.
+
+    The session is configured once and never mutated afterwards; per-call headers and timeouts
+    are passed as arguments, so concurrent use from gunicorn threads is safe (urllib3 pools are
+    thread-safe).
+    """
+
+    def __init__(self, pool_connections: int = GROQ_POOL_CONNECTIONS, pool_maxsize: int = GROQ_POOL_MAXSIZE,
+                 pool_block: bool = GROQ_POOL_BLOCK, connect_timeout: float = GROQ_CONNECT_TIMEOUT,
+                 read_timeout: float = GROQ_READ_TIMEOUT):
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'in_flight': 0, 'peak_in_flight': 0}
+        self.created_at = datetime.now().isoformat()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request over the pool, using (connect, read) timeouts unless overridden"""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self.stats['in_flight'] -= 1
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """POST over the pooled session"""
+        return self.request('POST', url, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get request counters and per-host connection pool usage"""
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # urllib3 pre-fills the queue with None placeholders; real entries are idle connections
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+            hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'reused': max(0, pool.num_requests - pool.num_connections),
+                'idle': idle
+            }
+        with self._lock:
+            stats = dict(self.stats)
+        opened = sum(host['connections_opened'] for host in hosts.values())
+        stats.update({
+            'pool_maxsize': self.pool_maxsize,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'connections_opened': opened,
+            'connection_reuse_ratio': round(1 - opened / stats['requests'], 3) if stats['requests'] else 0.0,
+            'hosts': hosts,
+            'created_at': self.created_at
+        })
+        return stats
+
+
+# Shared session used by GroqAgriBot and the Groq debug endpoint
+groq_session = PooledSession()
+
+
+class AsyncPooledSession:
+    """aiohttp counterpart of PooledSession for the asyncio chat path.
+
+    One ClientSession (and its keep-alive connector) is created lazily on the first call, so it
+    binds to the event loop that serves requests. Thousands of calls can be in flight on that
+    loop without a thread each; the connector limit bounds open sockets instead.
+    """
+
+    def __init__(self, limit: int = GROQ_ASYNC_MAX_CONNECTIONS, connect_timeout: float = GROQ_CONNECT_TIMEOUT,
+                 read_timeout: float = GROQ_READ_TIMEOUT):
+        self.limit = limit
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session = None
+        self.stats = {'requests': 0, 'errors': 0, 'in_flight': 0, 'peak_in_flight': 0}
+        self.created_at = datetime.now().isoformat()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60)
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def post(self, url: str, **kwargs):
+        """POST over the pooled session; the caller must release (or `async with`) the response"""
+        self.stats['requests'] += 1
+        self.stats['in_flight'] += 1
+        self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+        try:
+            return await self._get_session().post(url, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self.stats['in_flight'] -= 1
+
+    async def close(self):
+        """Close the session and its connections (ASGI lifespan shutdown)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get request counters and connector usage"""
+        connector = self._session.connector if self._session is not None and not self._session.closed else None
+        return {
+            'enabled': True,
+            **self.stats,
+            'connection_limit': self.limit,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'connections_acquired': len(connector._acquired) if connector is not None else 0,
+            'created_at': self.created_at
+        }
+
+
+# Shared async session used by AsyncGroqAgriBot (None when aiohttp is not installed)
+async_groq_session = AsyncPooledSession() if aiohttp is not None else None
+
+
+# Streaming configuration
+STREAM_FORMATS = ('sse', 'ndjson')
+STREAM_MIMETYPES = {'sse': 'text/event-stream', 'ndjson': 'application/x-ndjson'}
+
+
+def _stream_usage(chunk: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Token usage carried by a stream chunk (OpenAI include_usage chunk or Groq's x_groq block)"""
+    return chunk.get('usage') or (chunk.get('x_groq') or {}).get('usage')
+
+
+def iter_stream_deltas(response: requests.Response, usage: Dict[str, Any] = None) -> Iterator[str]:
+    """Yield content deltas from an OpenAI-compatible streamed chat completion (SSE lines); token usage (when
+    the stream reports it) and the finish_reason are copied into `usage`"""
+    for line in response.iter_lines():
+        if not line or not line.startswith(b'data:'):
+            continue
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            break
+        chunk = json.loads(data.decode('utf-8'))
+        if chunk.get('error'):
+            raise Exception(f"Groq stream error: {chunk['error']}")
+        if usage is not None and _stream_usage(chunk):
+            usage.update(_stream_usage(chunk))
+        choices = chunk.get('choices') or []
+        if usage is not None and choices and choices[0].get('finish_reason'):
+            usage['finish_reason'] = choices[0]['finish_reason']
+        delta = choices[0].get('delta', {}).get('content') if choices else None
+        if delta:
+            yield delta
+
+
+async def aiter_stream_deltas(response, usage: Dict[str, Any] = None) -> Any:
+    """Async variant of iter_stream_deltas for an aiohttp response"""
+    async for line in response.content:
+        line = line.strip()
+        if not line.startswith(b'data:'):
+            continue
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            break
+        chunk = json.loads(data.decode('utf-8'))
+        if chunk.get('error'):
+            raise Exception(f"Groq stream error: {chunk['error']}")
+        if usage is not None and _stream_usage(chunk):
+            usage.update(_stream_usage(chunk))
+        choices = chunk.get('choices') or []
+        if usage is not None and choices and choices[0].get('finish_reason'):
+            usage['finish_reason'] = choices[0]['finish_reason']
+        delta = choices[0].get('delta', {}).get('content') if choices else None
+        if delta:
+            yield delta
+
+
+def format_stream_event(event: Dict[str, Any], stream_format: str = 'sse') -> str:
+    """Serialise one stream event as an SSE frame or a JSON line"""
+    data = json.dumps(event, ensure_ascii=False)
+    if stream_format == 'ndjson':
+        return data + '\n'
+    return f"event: {event.get('type', 'message')}\ndata: {data}\n\n"
+
+
+class TokenBucketRateLimiter:
+    """Token bucket in front of every Groq call, with a priority queue of waiting threads.
+
+    Within a process, waiting threads are served strictly by (priority, arrival). Across gunicorn
+    workers the bucket itself lives in a small state file guarded by flock, so all workers on the
+    host share one budget; priorities are honoured per worker. A pause (set when Groq answers 429)
+    is kept in the same state, so every thread and worker backs off together.
+    """
+
+    def __init__(self, rate_per_minute: float = GROQ_RATE_LIMIT_RPM, burst: float = GROQ_RATE_LIMIT_BURST,
+                 state_file: str = GROQ_RATE_STATE_FILE):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, burst)
+        self.state_file = state_file if fcntl is not None else None
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._paused_until = 0.0
+        self.pauses = 0
+        self._cond = threading.Condition()
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self.granted = 0
+        self.timeouts = 0
+        self._waits = {name: deque(maxlen=1000) for name in PRIORITIES}
+
+    def _refill(self, tokens: float, updated: float, now: float) -> float:
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def _take(self) -> float:
+        """Take one token; returns 0 on success, else seconds until the next token is due (or the pause ends)"""
+        now = time.time()
+        if self.state_file:
+            try:
+                return self._take_shared(now)
+            except OSError as e:
+                logger.warning(f"⚠️ Rate limit state file unavailable, using per-process bucket: {e}")
+                self.state_file = None
+        if now < self._paused_until:
+            return self._paused_until - now
+        tokens = self._refill(self._tokens, self._updated, now)
+        self._updated = now
+        if tokens >= 1.0:
+            self._tokens = tokens - 1.0
+            return 0.0
+        self._tokens = tokens
+        return (1.0 - tokens) / self.rate
+
+    def _update_shared(self, update):
+        """Read-modify-write the shared state under flock; `update` mutates the state dict and returns a value"""
+        with open(self.state_file, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or '{}')
+                except ValueError:
+                    state = {}
+                value = update(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return value
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _take_shared(self, now: float) -> float:
+        def take(state):
+            self._paused_until = max(self._paused_until, float(state.get('paused_until', 0.0)))
+            state['paused_until'] = self._paused_until
+            tokens = self._refill(float(state.get('tokens', self.capacity)), float(state.get('updated', now)), now)
+            wait = 0.0
+            if now < self._paused_until:
+                wait = self._paused_until - now
+            elif tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+            state['tokens'], state['updated'] = tokens, now
+            self._tokens, self._updated = tokens, now
+            return wait
+        return self._update_shared(take)
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for `seconds` (Groq said 429 or the request quota is spent), in every worker"""
+        until = time.time() + seconds
+        with self._cond:
+            if until <= self._paused_until:
+                return
+            self._paused_until = until
+            self.pauses += 1
+            if self.state_file:
+                def extend(state):
+                    state['paused_until'] = max(float(state.get('paused_until', 0.0)), until)
+                try:
+                    self._update_shared(extend)
+                except OSError as e:
+                    logger.warning(f"⚠️ Could not share rate limit pause: {e}")
+            self._cond.notify_all()
+
+    def paused_for(self) -> float:
+        """Seconds left of the current pause (as last seen by this worker)"""
+        return max(0.0, self._paused_until - time.time())
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, max_wait: float = None) -> Tuple[bool, float]:
+        """Wait (bounded) for a token; returns (granted, queue wait in ms)"""
+        if max_wait is None:
+            max_wait = GROQ_RATE_BATCH_MAX_WAIT if priority >= PRIORITY_BATCH else GROQ_RATE_MAX_WAIT
+        started = time.monotonic()
+        deadline = started + max_wait
+        entry = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            while True:
+                wait = max_wait
+                if self._waiters[0] == entry:
+                    wait = self._take()
+                    if wait == 0.0:
+                        heapq.heappop(self._waiters)
+                        self._cond.notify_all()
+                        return self._record(priority, True, started)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                    return self._record(priority, False, started)
+                self._cond.wait(min(wait, remaining))
+
+    async def acquire_async(self, priority: int = PRIORITY_INTERACTIVE, max_wait: float = None) -> Tuple[bool, float]:
+        """Event-loop friendly acquire: polls the bucket with asyncio.sleep, yielding to queued threads first"""
+        if max_wait is None:
+            max_wait = GROQ_RATE_BATCH_MAX_WAIT if priority >= PRIORITY_BATCH else GROQ_RATE_MAX_WAIT
+        started = time.monotonic()
+        deadline = started + max_wait
+        loop = asyncio.get_running_loop()
+        while True:
+            # The shared bucket is a flock'd state file: take from it on the executor so the lock never stalls the loop
+            wait = await loop.run_in_executor(None, self._poll) if self.state_file else self._poll()
+            with self._cond:
+                if wait == 0.0:
+                    return self._record(priority, True, started)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self._record(priority, False, started)
+            await asyncio.sleep(min(wait, remaining))
+
+    def _poll(self) -> float:
+        """One take attempt for an async caller, yielding to queued threads; 0 when granted"""
+        with self._cond:
+            return self._take() if not self._waiters else 0.05
+
+    def _record(self, priority: int, granted: bool, started: float) -> Tuple[bool, float]:
+        waited_ms = (time.monotonic() - started) * 1000
+        if granted:
+            self.granted += 1
+        else:
+            self.timeouts += 1
+        self._waits['batch' if priority >= PRIORITY_BATCH else 'interactive'].append(waited_ms)
+        return granted, round(waited_ms, 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth, grant/timeout counters and queue-time percentiles per priority"""
+        with self._cond:
+            queue_time = {}
+            for name, waits in self._waits.items():
+                ordered = sorted(waits)
+                queue_time[name] = {
+                    'samples': len(ordered),
+                    'p50_ms': round(ordered[len(ordered) // 2], 1) if ordered else 0.0,
+                    'p95_ms': round(ordered[int(len(ordered) * 0.95)], 1) if ordered else 0.0,
+                    'max_ms': round(ordered[-1], 1) if ordered else 0.0
+                }
+            return {
+                'enabled': True,
+                'rate_per_minute': round(self.rate * 60, 2),
+                'burst': self.capacity,
+                'shared_state_file': self.state_file,
+                'tokens_available': round(self._refill(self._tokens, self._updated, time.time()), 2),
+                'paused_for_seconds': round(self.paused_for(), 2),
+                'pauses': self.pauses,
+                'queue_depth': len(self._waiters),
+                'granted': self.granted,
+                'timeouts': self.timeouts,
+                'max_wait_seconds': {'interactive': GROQ_RATE_MAX_WAIT, 'batch': GROQ_RATE_BATCH_MAX_WAIT},
+                'queue_time': queue_time
+            }
+
+
+# Shared limiter for every Groq call made by this process
+rate_limiter = TokenBucketRateLimiter() if GROQ_RATE_LIMIT_ENABLED else None
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Seconds from a Retry-After value (seconds or HTTP date) or a Groq reset header such as '2m59.56s'"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if parts and ''.join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def server_retry_hint(status_code: int, headers) -> Optional[float]:
+    """How long Groq asks us to hold off: Retry-After first, else the x-ratelimit reset of a spent quota"""
+    retry_after = parse_duration(headers.get('retry-after'))
+    if retry_after is not None:
+        return retry_after
+    spent = [parse_duration(headers.get(f'x-ratelimit-reset-{quota}')) for quota in ('requests', 'tokens')
+             if headers.get(f'x-ratelimit-remaining-{quota}') in ('0', '0.0')]
+    spent = [seconds for seconds in spent if seconds is not None]
+    if spent:
+        return max(spent)
+    return parse_duration(headers.get('x-ratelimit-reset-requests')) if status_code == 429 else None
+
+
+class RetryPolicy:
+    """Retry decisions for outbound Groq calls.
+
+    429 and 5xx answers are retried with full-jitter exponential backoff, never sooner than the
+    server's Retry-After / x-ratelimit reset hint and never past the caller's deadline (the latency
+    budget for interactive chat). Rate-limit hints also pause the shared token bucket, so the other
+    threads and workers back off together instead of each discovering the 429 on their own.
+    """
+
+    def __init__(self, max_retries: int = GROQ_RETRY_MAX_RETRIES, base_delay: float = GROQ_RETRY_BASE_DELAY,
+                 max_delay: float = GROQ_RETRY_MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._paused_until = 0.0  # per-process pause when the token bucket is disabled
+        self._lock = threading.Lock()
+        self.stats = {'retries': 0, 'recovered': 0, 'exhausted': 0, 'over_budget': 0, 'server_hints': 0}
+        self.statuses = Counter()
+
+    @staticmethod
+    def deadline(priority: int) -> float:
+        """Monotonic time after which a request stops retrying"""
+        if priority >= PRIORITY_BATCH:
+            budget = GROQ_RATE_BATCH_MAX_WAIT
+        else:
+            budget = GROQ_LATENCY_BUDGET_MS / 1000 if GROQ_LATENCY_BUDGET_MS > 0 else GROQ_READ_TIMEOUT
+        return time.monotonic() + budget
+
+    def pause(self, seconds: float):
+        """Make every caller hold off for `seconds`"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if rate_limiter is not None:
+            rate_limiter.pause(seconds)
+
+    def paused_for(self) -> float:
+        """Seconds left of the current pause"""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def next_delay(self, attempt: int, status_code: int, headers, deadline: float,
+                   shared: bool = True) -> Optional[float]:
+        """Seconds to sleep before retrying this answer, or None to keep it (success, fatal, or out of time).
+        `shared` = False for providers other than Groq: their hints delay this retry but pause nobody else"""
+        hint = server_retry_hint(status_code, headers)
+        if hint is not None and hint > 0:
+            self.stats['server_hints'] += 1
+            if shared:
+                self.pause(hint)
+        if status_code not in RETRY_STATUSES:
+            if attempt:
+                self.stats['recovered'] += 1
+            return None
+        self.statuses[status_code] += 1
+        if attempt >= self.max_retries:
+            self.stats['exhausted'] += 1
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if hint is not None:
+            delay = max(delay, hint + random.uniform(0, self.base_delay))
+        if time.monotonic() + delay >= deadline:
+            self.stats['over_budget'] += 1
+            return None
+        self.stats['retries'] += 1
+        logger.warning(f"🔁 {'Groq' if shared else 'Provider'} answered {status_code}, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get retry counters, retried statuses and any pause in force"""
+        return {
+            'enabled': True,
+            'max_retries': self.max_retries,
+            'base_delay_seconds': self.base_delay,
+            'max_delay_seconds': self.max_delay,
+            **self.stats,
+            'retried_statuses': {str(status): count for status, count in self.statuses.items()},
+            'paused_for_seconds': round(self.paused_for(), 2)
+        }
+
+
+# Shared retry policy for every Groq call made by this process
+retry_policy = RetryPolicy() if GROQ_RETRY_ENABLED else None
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Language detection: every supported Indic script owns one 128-codepoint Unicode block
+SCRIPT_BLOCKS = {
+    'hindi': 0x0900,  # Devanagari, shared with Marathi
+    'tamil': 0x0B80,
+    'telugu': 0x0C00,
+    'punjabi': 0x0A00,  # Gurmukhi
+    'bengali': 0x0980,
+    'gujarati': 0x0A80,
+    'kannada': 0x0C80,
+    'malayalam': 0x0D00,
+}
+
+LANGUAGE_REGIONS = {
+    'hindi': 'North India (UP, Bihar, MP, Rajasthan, Haryana)',
+    'punjabi': 'Punjab, Haryana (Wheat Belt)',
+    'tamil': 'Tamil Nadu (Rice, Sugarcane)',
+    'telugu': 'Andhra Pradesh, Telangana (Cotton, Rice)',
+    'bengali': 'West Bengal (Rice, Jute)',
+    'marathi': 'Maharashtra (Cotton, Sugarcane, Onion)',
+    'gujarati': 'Gujarat (Cotton, Groundnut)',
+    'kannada': 'Karnataka (Coffee, Ragi, Cotton)',
+    'malayalam': 'Kerala (Spices, Coconut, Rice)',
+    'english': 'Pan-India'
+}
+
+REGIONAL_CROPS = {
+    'hindi': ['गेहूं (wheat)', 'धान (rice)', 'मक्का (maize)', 'बाजरा (millet)'],
+    'punjabi': ['ਕਣਕ (wheat)', 'ਚੌਲ (rice)', 'ਮੱਕੀ (maize)', 'ਕਪਾਹ (cotton)'],
+    'tamil': ['அரிசி (rice)', 'கரும்பு (sugarcane)', 'மிளகாய் (chili)', 'கொள்ளு (horsegram)'],
+    'telugu': ['వరి (rice)', 'పత్తి (cotton)', 'మిర్చి (chili)', 'మామిడి (mango)'],
+    'bengali': ['ধান (rice)', 'পাট (jute)', 'আলু (potato)', 'সরিষা (mustard)'],
+    'marathi': ['कापूस (cotton)', 'ऊस (sugarcane)', 'कांदा (onion)', 'ज्वारी (sorghum)'],
+    'gujarati': ['કપાસ (cotton)', 'મગફળી (groundnut)', 'બાજરી (millet)', 'તલ (sesame)'],
+    'kannada': ['ಅಕ್ಕಿ (rice)', 'ಕಾಫಿ (coffee)', 'ರಾಗಿ (ragi)', 'ತೆಂಗಿನಕಾಯಿ (coconut)'],
+    'malayalam': ['നെൽ (rice)', 'തേങ്ങ (coconut)', 'കുരുമുളക് (pepper)', 'ഏലം (cardamom)'],
+    'english': ['rice', 'wheat', 'cotton', 'sugarcane']
+}
+
+# Frequent function words that tell Marathi from Hindi in Devanagari text
+MARATHI_MARKERS = frozenset([
+    'आहे', 'आहेत', 'आणि', 'नाही', 'काय', 'कसे', 'कशी', 'कसा', 'मध्ये', 'माझ्या', 'माझी', 'माझा', 'मला',
+    'आम्ही', 'तुम्ही', 'करावे', 'करावी', 'करायचे', 'होते', 'झाले', 'झाला', 'शेती', 'पिकावर', 'साठी', 'किती'
+])
+HINDI_MARKERS = frozenset([
+    'है', 'हैं', 'और', 'नहीं', 'क्या', 'कैसे', 'कैसी', 'में', 'मेरी', 'मेरा', 'मेरे', 'मुझे', 'हम', 'आप',
+    'करें', 'करूं', 'करना', 'था', 'थी', 'गया', 'गए', 'खेती', 'लिए', 'कितना', 'की', 'का', 'के'
+])
+_DEVANAGARI_PUNCTUATION = '।॥?!,.;:"\'()'
+MARKER_SCAN_WORDS = 300  # enough words to tell Hindi from Marathi in long pasted texts
+LONG_TEXT_CHARS = 512  # above this, count letters with a vectorised NumPy table lookup
+
+# Each letter of a supported script is translated to a one-character tag, so counting a language's
+# letters is a C-level str.count over a single translated copy of the text
+_SCRIPT_TAGS = {language: chr(0xE000 + i) for i, language in enumerate(SCRIPT_BLOCKS)}
+_SCRIPT_TRANSLATION = {
+    codepoint: _SCRIPT_TAGS[language]
+    for language, start in SCRIPT_BLOCKS.items()
+    for codepoint in range(start, start + 0x80)
+    if unicodedata.category(chr(codepoint)) == 'Lo'
+}
+_SCRIPT_LANGUAGES = list(SCRIPT_BLOCKS)
+if np is not None:
+    # Codepoint -> 1-based language index (0 = anything else), capped at the end of the Malayalam block
+    _SCRIPT_TABLE = np.zeros(0x0D81, dtype=np.uint8)
+    for _codepoint, _tag in _SCRIPT_TRANSLATION.items():
+        _SCRIPT_TABLE[_codepoint] = ord(_tag) - 0xE000 + 1
+
+
+def _script_letter_counts(text: str) -> List[int]:
+    """Letters per supported script, in SCRIPT_BLOCKS order"""
+    if np is not None and len(text) > LONG_TEXT_CHARS:
+        codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        counts = np.bincount(_SCRIPT_TABLE[np.minimum(codepoints, 0x0D80)], minlength=len(_SCRIPT_LANGUAGES) + 1)
+        return [int(count) for count in counts[1:]]
+    tagged = text.translate(_SCRIPT_TRANSLATION)
+    return [tagged.count(_SCRIPT_TAGS[language]) for language in _SCRIPT_LANGUAGES]
+
+
+def _split_devanagari(text: str) -> str:
+    """Hindi or Marathi for Devanagari text, by counting marker words (ळ breaks ties towards Marathi)"""
+    marathi = hindi = 0
+    for word in text.split(maxsplit=MARKER_SCAN_WORDS)[:MARKER_SCAN_WORDS]:
+        word = word.strip(_DEVANAGARI_PUNCTUATION)
+        if word in MARATHI_MARKERS:
+            marathi += 1
+        elif word in HINDI_MARKERS:
+            hindi += 1
+    if marathi > hindi or (marathi == hindi and ('ळ' in text or 'ऱ' in text)):
+        return 'marathi'
+    return 'hindi'
+
+
+def detect_script_language(text: str) -> Dict[str, Any]:
+    """Detect language and regional context from the Unicode script block of each letter, in one pass"""
+    detected_language = 'english'  # default
+    confidence = 0
+    for language, count in zip(_SCRIPT_LANGUAGES, _script_letter_counts(text)):
+        if count > confidence:
+            confidence = count
+            detected_language = language
+    if detected_language == 'hindi':
+        detected_language = _split_devanagari(text)
+
+    return {
+        'language': detected_language,
+        'confidence': confidence,
+        'region': LANGUAGE_REGIONS.get(detected_language, 'General'),
+        'common_crops': list(REGIONAL_CROPS.get(detected_language, [])),
+        'is_indian_language': detected_language != 'english',
+        'script_detected': confidence > 0
+    }
+
+
+def normalize_query(text: str) -> str:
+    """Normalise a chat message for cache lookups: NFKC, case-fold, drop punctuation/symbols, collapse spaces"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    # Keep letters, digits and combining marks (Indic vowel signs are marks); everything else separates words
+    text = ''.join(char if unicodedata.category(char)[0] in 'LNM' else ' ' for char in text)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+class CircuitBreaker:
+    """Skips Groq while it keeps failing or answering slower than GROQ_BREAKER_SLOW_MS.
+
+    closed -> open after `failure_threshold` consecutive failures; open -> half_open after
+    `reset_seconds`, letting a single probe call through; the probe closes or re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = GROQ_BREAKER_FAILURES, reset_seconds: float = GROQ_BREAKER_RESET_SECONDS,
+                 name: str = 'Groq'):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        self.last_failure_reason = None
+        self.history = deque(maxlen=20)  # recent (timestamp, from_state, to_state, reason)
+        self.stats = {'trips': 0, 'recoveries': 0, 'short_circuited': 0, 'failures': 0, 'successes': 0}
+
+    def _transition(self, state: str, reason: str):
+        self.history.append({'at': datetime.now().isoformat(), 'from': self._state, 'to': state, 'reason': reason})
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+            if self._state == self.CLOSED:
+                self.stats['trips'] += 1
+                logger.warning(f"🔌 {self.name} circuit opened after {self.consecutive_failures} failures ({reason})")
+        elif state == self.CLOSED:
+            self.stats['recoveries'] += 1
+            logger.info(f"🔌 {self.name} circuit closed, {self.name} recovered")
+        self._state = state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a Groq call may go out now (counts a short-circuit when not)"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._transition(self.HALF_OPEN, 'reset timeout elapsed')
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.stats['short_circuited'] += 1
+            return False
+
+    def cancel_probe(self):
+        """Free the half-open probe slot when the allowed call never reached Groq"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            if self._state != self.CLOSED:
+                self._transition(self.CLOSED, 'probe succeeded')
+
+    def record_failure(self, reason: str):
+        with self._lock:
+            self.stats['failures'] += 1
+            self.consecutive_failures += 1
+            self.last_failure_reason = reason
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                self._transition(self.OPEN, f'probe failed: {reason}')
+            elif self._state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._transition(self.OPEN, reason)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get state, thresholds and trip/recovery history"""
+        state = self.state
+        with self._lock:
+            return {
+                'enabled': True,
+                'state': state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_seconds': self.reset_seconds,
+                'open_for_seconds': round(time.monotonic() - self._opened_at, 1) if self._state != self.CLOSED else 0.0,
+                'last_failure_reason': self.last_failure_reason,
+                'transitions': list(self.history),
+                **self.stats
+            }
+
+
+# Shared breaker guarding every Groq call (sync and async paths)
+circuit_breaker = CircuitBreaker() if GROQ_BREAKER_ENABLED else None
+
+
+def circuit_state() -> str:
+    """Current breaker state for per-response reporting"""
+    return circuit_breaker.state if circuit_breaker is not None else 'disabled'
+
+
+def fallback_reason(groq_response: Dict[str, Any]) -> str:
+    """Why a Groq attempt ended on the knowledge base"""
+    if groq_response.get('budget_exceeded'):
+        return 'latency_budget'
+    if groq_response.get('hedge_pool_exhausted'):
+        return 'hedge_pool_exhausted'
+    if groq_response.get('circuit_open'):
+        return 'circuit_open'
+    if groq_response.get('rate_limited'):
+        return 'rate_limited'
+    return 'groq_error'
+
+
+class ChatPathStats:
+    """Counts which path answered each chat (groq, cache, knowledge_base) and why fallbacks happened"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.paths = Counter()
+        self.reasons = Counter()
+
+    def record(self, path: str, reason: str = None):
+        with self._lock:
+            self.paths[path] += 1
+            if reason:
+                self.reasons[reason] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'latency_budget_ms': GROQ_LATENCY_BUDGET_MS,
+                'paths': dict(self.paths),
+                'fallback_reasons': dict(self.reasons)
+            }
+
+
+chat_paths = ChatPathStats()
+
+# Runs budgeted sync Groq calls (and streams until their first text) so the request thread can stop
+# waiting at the budget. Calls never queue for a hedge thread: queued behind a burst they would spend
+# the whole budget waiting to start, so a full pool is reported as its own fallback reason instead.
+hedge_executor = ThreadPoolExecutor(max_workers=GROQ_HEDGE_WORKERS, thread_name_prefix='groq-hedge')
+_hedge_slots = threading.BoundedSemaphore(GROQ_HEDGE_WORKERS)
+
+BUDGET_EXCEEDED_EVENT = {'type': 'error', 'success': False, 'error': 'latency_budget_exceeded',
+                         'budget_exceeded': True, 'partial_advice': ''}
+HEDGE_POOL_EXHAUSTED_EVENT = {'type': 'error', 'success': False, 'error': 'hedge_pool_exhausted',
+                              'hedge_pool_exhausted': True, 'partial_advice': ''}
+FIRST_TEXT_EVENTS = ('delta', 'done', 'error')
+
+
+def _submit_hedged(fn) -> Optional[Future]:
+    """Start fn on a free hedge thread, or return None when all GROQ_HEDGE_WORKERS are busy"""
+    if not _hedge_slots.acquire(blocking=False):
+        logger.warning(f"⚠️ All {GROQ_HEDGE_WORKERS} hedge threads busy, answering from the fallback")
+        return None
+    future = hedge_executor.submit(fn)
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def call_within_budget(fn, budget_ms: float = GROQ_LATENCY_BUDGET_MS) -> Dict[str, Any]:
+    """Run fn on the hedge pool; past the budget return a budget_exceeded result and let fn finish on its own"""
+    future = _submit_hedged(fn)
+    if future is None:
+        return {'success': False, 'error': 'hedge_pool_exhausted', 'hedge_pool_exhausted': True}
+    try:
+        return future.result(timeout=budget_ms / 1000)
+    except FutureTimeoutError:
+        future.cancel()  # only succeeds if it never started
+        return {'success': False, 'error': 'latency_budget_exceeded', 'budget_exceeded': True}
+
+
+def iter_within_budget(events: Iterator[Dict[str, Any]], budget_ms: float = GROQ_LATENCY_BUDGET_MS) -> Iterator[Dict[str, Any]]:
+    """Relay a stream, ending it with a budget_exceeded error if no text arrives within the budget.
+
+    A hedge thread pumps the source only until its first text; the request thread then iterates the
+    rest itself, so a long answer does not hold a hedge thread. After a timeout the hedge thread keeps
+    draining, so a shared single-flight stream still reaches its followers and the answer the cache.
+    """
+    relay = queue.Queue()
+    handoff = threading.Lock()
+    state = {'abandoned': False, 'handed_off': False}
+
+    def pump():
+        try:
+            for event in events:
+                relay.put(event)
+                if event['type'] in FIRST_TEXT_EVENTS:
+                    with handoff:
+                        if not state['abandoned']:
+                            state['handed_off'] = True
+                            return
+        finally:
+            if not state['handed_off']:
+                relay.put(None)
+
+    future = _submit_hedged(pump)
+    if future is None:
+        yield dict(HEDGE_POOL_EXHAUSTED_EVENT, timestamp=datetime.now().isoformat())
+        return
+    deadline = time.monotonic() + budget_ms / 1000
+    while True:
+        try:
+            event = relay.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            with handoff:
+                state['abandoned'] = not state['handed_off']
+            if state['abandoned']:
+                future.cancel()
+                yield dict(BUDGET_EXCEEDED_EVENT, timestamp=datetime.now().isoformat())
+                return
+            continue  # the first text arrived just as the budget ran out
+        if event is None:
+            return
+        yield event
+        if event['type'] in FIRST_TEXT_EVENTS:
+            future.result()  # the hedge thread has let go of the source
+            yield from events
+            return
+
+
+async def acall_within_budget(coro, background: set, budget_ms: float = GROQ_LATENCY_BUDGET_MS) -> Dict[str, Any]:
+    """asyncio call_within_budget: the task keeps running (held in `background`) after the budget"""
+    task = asyncio.ensure_future(coro)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), budget_ms / 1000)
+    except asyncio.TimeoutError:
+        background.add(task)
+        task.add_done_callback(background.discard)
+        return {'success': False, 'error': 'latency_budget_exceeded', 'budget_exceeded': True}
+
+
+async def aiter_within_budget(events, background: set, budget_ms: float = GROQ_LATENCY_BUDGET_MS):
+    """asyncio iter_within_budget"""
+    relay = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event in events:
+                await relay.put(event)
+        finally:
+            await relay.put(None)
+
+    task = asyncio.ensure_future(pump())
+    background.add(task)
+    task.add_done_callback(background.discard)
+    deadline = time.monotonic() + budget_ms / 1000
+    first_text = False
+    while True:
+        try:
+            if first_text:
+                event = await relay.get()
+            else:
+                event = await asyncio.wait_for(relay.get(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            yield dict(BUDGET_EXCEEDED_EVENT, timestamp=datetime.now().isoformat())
+            return
+        if event is None:
+            return
+        first_text = first_text or event['type'] in FIRST_TEXT_EVENTS
+        yield event
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Llama token count: ~4 UTF-8 bytes per token (Indic scripts are 3 bytes per letter)"""
+    return max(1, len(text.encode('utf-8')) // 4)
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Rough prompt size of a chat request (content plus ~4 tokens of framing per message)"""
+    return sum(estimate_tokens(message['content']) + 4 for message in messages)
+
+
+class PromptMetrics:
+    """Rolling input-token and time-to-first-token figures for Groq requests (measurement mode)"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.input_tokens = deque(maxlen=window)
+        self.estimated_tokens = deque(maxlen=window)
+        self.first_token_ms = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, messages: List[Dict[str, str]], usage: Dict[str, Any], first_token_ms: float) -> Dict[str, Any]:
+        """Record one request; returns the per-request figures attached to the response"""
+        report = {
+            'input_tokens': (usage or {}).get('prompt_tokens'),
+            'estimated_input_tokens': estimate_message_tokens(messages),
+            'prompt_bytes': sum(len(message['content'].encode('utf-8')) for message in messages),
+            'messages': len(messages),
+            'first_token_ms': round(first_token_ms, 1)
+        }
+        with self._lock:
+            self.requests += 1
+            if report['input_tokens'] is not None:
+                self.input_tokens.append(report['input_tokens'])
+            self.estimated_tokens.append(report['estimated_input_tokens'])
+            self.first_token_ms.append(first_token_ms)
+        return report
+
+    @staticmethod
+    def _summary(values) -> Dict[str, float]:
+        ordered = sorted(values)
+        if not ordered:
+            return {'samples': 0, 'p50': 0.0, 'p95': 0.0, 'mean': 0.0}
+        return {
+            'samples': len(ordered),
+            'p50': round(ordered[len(ordered) // 2], 1),
+            'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+            'mean': round(sum(ordered) / len(ordered), 1)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': True,
+                'requests': self.requests,
+                'input_tokens': self._summary(self.input_tokens),
+                'estimated_input_tokens': self._summary(self.estimated_tokens),
+                'first_token_ms': self._summary(self.first_token_ms)
+            }
+
+
+prompt_metrics = PromptMetrics() if GROQ_PROMPT_METRICS else None
+
+
+# Cues AgriBotAI.analyze_query does not cover (multilingual and symptom words). English cues match word
+# prefixes ('wilt' -> 'wilting'); Indic cues match anywhere, since suffixes attach to the stem
+DIAGNOSIS_CUES = ('yellow', 'spot', 'wilt', 'dying', 'rotting', 'curl', 'fungus', 'blight', 'infest',
+                  'पीली', 'पीला', 'रोग', 'कीट', 'सूख', 'धब्बे', 'किडे', 'பூச்சி', 'மஞ்சள', 'పురుగు', 'ਕੀੜੇ', 'পোকা')
+QUICK_FACT_CUES = ('how much', 'how many', 'price', 'rate', 'what is the', 'which month', 'msp', 'dose',
+                   'कितना', 'कितनी', 'भाव', 'दाम', 'कीमत', 'किंमत')
+HOW_TO_CUES = ('steps', 'guide', 'cultivat', 'grow', 'कैसे', 'कसे', 'எப்படி', 'ఎలా', 'ਕਿਵੇਂ', 'কীভাবে')
+
+
+def _has_cue(text: str, cues: Tuple[str, ...]) -> bool:
+    return any((' ' + cue if cue.isascii() else cue) in text for cue in cues)
+
+
+def classify_response(analysis: Dict[str, Any], message: str) -> str:
+    """Output budget class of a question from AgriBotAI.analyze_query's intent plus multilingual cues"""
+    text = ' ' + normalize_query(message)
+    if analysis.get('query_type') == 'problem' or 'pest' in analysis.get('topics', ()) \
+            or _has_cue(text, DIAGNOSIS_CUES):
+        return 'diagnosis'
+    if _has_cue(text, QUICK_FACT_CUES):
+        return 'quick_fact'
+    if analysis.get('query_type') == 'how_to' or _has_cue(text, HOW_TO_CUES):
+        return 'how_to'
+    if len(text.split()) <= 5 and analysis.get('query_type') in ('economics', 'timing', 'general'):
+        return 'quick_fact'
+    return 'general'
+
+
+def max_tokens_for(response_class: str) -> int:
+    """Output cap for a query class (the flat default when adaptive budgets are off)"""
+    if not GROQ_ADAPTIVE_MAX_TOKENS:
+        return GROQ_MAX_TOKENS_DEFAULT
+    return RESPONSE_CLASSES.get(response_class, RESPONSE_CLASSES['general'])['max_tokens']
+
+
+class ResponseClassStats:
+    """Per query class latency, output tokens and cap hits, for tuning the max_tokens caps"""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self.window = window
+        self._classes = {}
+
+    def record(self, response_class: str, latency_ms: float, completion_tokens: int, finish_reason: str = None,
+               first_token_ms: float = None):
+        with self._lock:
+            entry = self._classes.get(response_class)
+            if entry is None:
+                entry = self._classes[response_class] = {
+                    'requests': 0, 'truncated': 0, 'latency_ms': deque(maxlen=self.window),
+                    'first_token_ms': deque(maxlen=self.window), 'completion_tokens': deque(maxlen=self.window)
+                }
+            entry['requests'] += 1
+            entry['truncated'] += finish_reason == 'length'
+            entry['latency_ms'].append(latency_ms)
+            entry['completion_tokens'].append(completion_tokens)
+            if first_token_ms is not None:
+                entry['first_token_ms'].append(first_token_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            classes = {}
+            for name, entry in self._classes.items():
+                classes[name] = {
+                    'max_tokens': max_tokens_for(name),
+                    'requests': entry['requests'],
+                    'truncated': entry['truncated'],
+                    'truncated_ratio': round(entry['truncated'] / entry['requests'], 3),
+                    'latency_ms': PromptMetrics._summary(entry['latency_ms']),
+                    'first_token_ms': PromptMetrics._summary(entry['first_token_ms']),
+                    'completion_tokens': PromptMetrics._summary(entry['completion_tokens'])
+                }
+            return {'adaptive': GROQ_ADAPTIVE_MAX_TOKENS, 'classes': classes}
+
+
+response_class_stats = ResponseClassStats()
+
+
+def chat_user_id(data: Dict[str, Any], header_value: str = None) -> Optional[str]:
+    """User a chat belongs to: body user_id, context.user_id or the X-User-Id header (None = anonymous, no memory)"""
+    context = data.get('context') if isinstance(data.get('context'), dict) else {}
+    user_id = str(data.get('user_id') or context.get('user_id') or header_value or '').strip()
+    return user_id[:128] or None
+
+
+class ConversationStore:
+    """Per-user conversation memory: a fixed-size ring buffer of turns per user, LRU over users, total byte cap"""
+
+    TURN_OVERHEAD_BYTES = 400  # dict, timestamps and metadata per stored turn
+
+    def __init__(self, turns_per_user: int = GROQ_MEMORY_TURNS, max_users: int = GROQ_MEMORY_MAX_USERS,
+                 max_bytes: int = GROQ_MEMORY_MAX_BYTES, max_turn_chars: int = GROQ_MEMORY_MAX_TURN_CHARS):
+        self.turns_per_user = max(1, turns_per_user)
+        self.max_users = max(1, max_users)
+        self.max_bytes = max(1, max_bytes)
+        self.max_turn_chars = max_turn_chars
+        self._users = OrderedDict()  # user_id -> deque of turns, least recently active first
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        self.evicted_users = 0
+
+    @classmethod
+    def _turn_bytes(cls, turn: Dict[str, Any]) -> int:
+        return len(turn['user_message'].encode('utf-8')) + len(turn['agribot_response'].encode('utf-8')) \
+            + cls.TURN_OVERHEAD_BYTES
+
+    def append(self, user_id: str, user_message: str, advice: str, **metadata):
+        """Store one exchange for a user, evicting their oldest turn and then least recent users as needed"""
+        turn = {
+            'user_message': user_message[:self.max_turn_chars],
+            'agribot_response': advice[:self.max_turn_chars],
+            'timestamp': datetime.now().isoformat(),
+            **metadata
+        }
+        size = self._turn_bytes(turn)
+        with self._lock:
+            turns = self._users.get(user_id)
+            if turns is None:
+                turns = self._users[user_id] = deque(maxlen=self.turns_per_user)
+            else:
+                self._users.move_to_end(user_id)
+            if len(turns) == turns.maxlen:
+                self.bytes_used -= self._turn_bytes(turns[0])
+            turns.append(turn)
+            self.bytes_used += size
+            while len(self._users) > 1 and (len(self._users) > self.max_users or self.bytes_used > self.max_bytes):
+                _, evicted = self._users.popitem(last=False)
+                self.bytes_used -= sum(self._turn_bytes(old) for old in evicted)
+                self.evicted_users += 1
+
+    def recent(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """A user's last `limit` turns, oldest first"""
+        with self._lock:
+            turns = list(self._users.get(user_id, ()))
+        return turns[-limit:] if limit > 0 else []
+
+    def context_messages(self, user_id: Optional[str], token_budget: int = GROQ_CONTEXT_TOKEN_BUDGET) -> List[Dict[str, str]]:
+        """Recent turns as chat messages, newest kept first, trimmed to fit the token budget"""
+        if not user_id or token_budget <= 0:
+            return []
+        messages = []
+        remaining = token_budget
+        for turn in reversed(self.recent(user_id, self.turns_per_user)):
+            question, answer = turn['user_message'], turn['agribot_response']
+            cost = estimate_tokens(question) + estimate_tokens(answer)
+            if cost > remaining:
+                # Keep the head of an oversized answer if a useful amount still fits, then stop
+                room = (remaining - estimate_tokens(question)) * 4
+                if room >= 256:
+                    messages[:0] = [{'role': 'user', 'content': question},
+                                    {'role': 'assistant', 'content': answer.encode('utf-8')[:room].decode('utf-8', 'ignore')}]
+                break
+            messages[:0] = [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+            remaining -= cost
+        return messages
+
+    def clear(self, user_id: str):
+        """Forget one user's conversation"""
+        with self._lock:
+            turns = self._users.pop(user_id, None)
+            if turns:
+                self.bytes_used -= sum(self._turn_bytes(turn) for turn in turns)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get user/turn counts and memory usage"""
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'turns': sum(len(turns) for turns in self._users.values()),
+                'turns_per_user': self.turns_per_user,
+                'max_users': self.max_users,
+                'bytes_used': self.bytes_used,
+                'max_bytes': self.max_bytes,
+                'evicted_users': self.evicted_users,
+                'context_token_budget': GROQ_CONTEXT_TOKEN_BUDGET
+            }
+
+
+# Conversation memory shared by the sync, async and knowledge base bots
+conversation_store = ConversationStore()
+
+
+def question_key(message: str, lang_info: Dict[str, Any]) -> str:
+    """Key identifying the same question: normalised message plus detected language/region"""
+    raw = f"{lang_info.get('language')}|{lang_info.get('region')}|{normalize_query(message)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _StreamFlight:
+    """Events of one in-flight streamed answer, replayed to every subscriber"""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.cond = threading.Condition()
+
+    def publish(self, event: Dict[str, Any]):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def subscribe(self, timeout: float) -> Iterator[Dict[str, Any]]:
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.events) and not self.finished:
+                    if not self.cond.wait(timeout):
+                        raise FutureTimeoutError('Timed out waiting for the shared Groq stream')
+                if index >= len(self.events):
+                    return
+                event = self.events[index]
+            index += 1
+            yield copy.deepcopy(event)
+
+
+class SingleFlight:
+    """Collapses identical concurrent Groq calls: followers wait for the leader's result or stream"""
+
+    def __init__(self, timeout: float = GROQ_COALESCE_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future
+        self._streams = {}  # key -> _StreamFlight
+        self.stats = {'leaders': 0, 'coalesced': 0, 'stream_leaders': 0, 'streams_coalesced': 0,
+                      'follower_timeouts': 0}
+
+    def do(self, key: str, fn) -> Tuple[Any, bool]:
+        """Run fn once per key at a time; returns (result, shared) where shared means another call produced it"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.stats['leaders'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            try:
+                return copy.deepcopy(future.result(timeout=self.timeout)), True
+            except FutureTimeoutError:
+                with self._lock:
+                    self.stats['follower_timeouts'] += 1
+                return fn(), False
+        try:
+            result = fn()
+            # Followers get a snapshot: the leader goes on to add its own context and fallback keys to `result`
+            future.set_result(copy.deepcopy(result))
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stream(self, key: str, factory) -> Tuple[Iterator[Dict[str, Any]], bool]:
+        """Share one event stream per key; returns (events, shared). The leader must iterate its events."""
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._streams[key] = _StreamFlight()
+                self.stats['stream_leaders'] += 1
+            else:
+                self.stats['streams_coalesced'] += 1
+        if not leader:
+            return flight.subscribe(self.timeout), True
+        return self._lead(key, flight, factory()), False
+
+    def _lead(self, key: str, flight: _StreamFlight, producer: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        try:
+            for event in producer:
+                # Publish a snapshot; the leader's caller adds its own context to the event it is given
+                flight.publish(copy.deepcopy(event))
+                yield event
+        finally:
+            try:
+                # The leader's client may have gone away; keep producing for the followers
+                for event in producer:
+                    flight.publish(event)
+            finally:
+                flight.finish()
+                with self._lock:
+                    self._streams.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get leader/follower counters and calls currently in flight"""
+        with self._lock:
+            return {
+                'enabled': True,
+                'in_flight': len(self._calls),
+                'streams_in_flight': len(self._streams),
+                'timeout_seconds': self.timeout,
+                **self.stats
+            }
+
+
+# Shared coalescer for identical concurrent chat questions
+single_flight = SingleFlight() if GROQ_COALESCE_ENABLED else None
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for coroutines running on one event loop"""
+
+    def __init__(self, timeout: float = GROQ_COALESCE_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}  # key -> asyncio.Future
+        self._streams = {}  # key -> {'events', 'cond', 'finished'}
+        self.stats = {'leaders': 0, 'coalesced': 0, 'stream_leaders': 0, 'streams_coalesced': 0,
+                      'follower_timeouts': 0}
+
+    async def do(self, key: str, coro_factory) -> Tuple[Any, bool]:
+        """Await coro_factory() once per key at a time; returns (result, shared)"""
+        future = self._calls.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            try:
+                return copy.deepcopy(await asyncio.wait_for(asyncio.shield(future), self.timeout)), True
+            except asyncio.TimeoutError:
+                self.stats['follower_timeouts'] += 1
+                return await coro_factory(), False
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.stats['leaders'] += 1
+        try:
+            result = await coro_factory()
+            future.set_result(copy.deepcopy(result))
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody was waiting
+            raise
+        finally:
+            self._calls.pop(key, None)
+
+    def stream(self, key: str, factory):
+        """Share one async event stream per key; returns (async events, shared)"""
+        flight = self._streams.get(key)
+        if flight is not None:
+            self.stats['streams_coalesced'] += 1
+            return self._subscribe(flight), True
+        flight = self._streams[key] = {'events': [], 'cond': asyncio.Condition(), 'finished': False}
+        self.stats['stream_leaders'] += 1
+        return self._lead(key, flight, factory()), False
+
+    async def _subscribe(self, flight):
+        index = 0
+        while True:
+            async with flight['cond']:
+                while index >= len(flight['events']) and not flight['finished']:
+                    await asyncio.wait_for(flight['cond'].wait(), self.timeout)
+                if index >= len(flight['events']):
+                    return
+                event = flight['events'][index]
+            index += 1
+            yield copy.deepcopy(event)
+
+    async def _publish(self, flight, event=None, finished=False):
+        async with flight['cond']:
+            if event is not None:
+                flight['events'].append(event)
+            flight['finished'] = flight['finished'] or finished
+            flight['cond'].notify_all()
+
+    async def _lead(self, key: str, flight, producer):
+        try:
+            async for event in producer:
+                await self._publish(flight, copy.deepcopy(event))
+                yield event
+        finally:
+            try:
+                # The leader's client may have gone away; keep producing for the followers
+                async for event in producer:
+                    await self._publish(flight, event)
+            finally:
+                await self._publish(flight, finished=True)
+                self._streams.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get leader/follower counters and calls currently in flight"""
+        return {
+            'enabled': True,
+            'in_flight': len(self._calls),
+            'streams_in_flight': len(self._streams),
+            'timeout_seconds': self.timeout,
+            **self.stats
+        }
+
+
+# Coalescer for the asyncio chat path (ASGI entry point)
+async_single_flight = AsyncSingleFlight() if GROQ_COALESCE_ENABLED else None
+
+
+class AnswerCache:
+    """Bounded LRU cache of Groq answers keyed by normalised question, language and region"""
+
+    def __init__(self, max_bytes: int = GROQ_CACHE_MAX_BYTES, ttl: float = GROQ_CACHE_TTL):
+        self.max_bytes = max(1, max_bytes)
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (response, size, stored_at)
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(message: str, lang_info: Dict[str, Any]) -> str:
+        """Cache key from the normalised message and the detected language/region"""
+        return question_key(message, lang_info)
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - stored_at > self.ttl
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.bytes_used -= size
+
+    def get(self, key: str):
+        """Get a copy of a cached answer, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[2], now):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[0])
+
+    def put(self, key: str, response: Dict[str, Any]):
+        """Store an answer, evicting least recently used entries past max_bytes"""
+        size = len(json.dumps(response, ensure_ascii=False, default=str).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (copy.deepcopy(response), size, time.monotonic())
+            self.bytes_used += size
+            while self.bytes_used > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached answers"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and size limits"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': True,
+                'entries': len(self._entries),
+                'bytes_used': self.bytes_used,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'groq_calls_saved': self.hits,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+# Shared answer cache for repeated questions
+answer_cache = AnswerCache()
+
+
+# Romanised and native farming words mapped to one canonical token, so "gehu ki kheti" and
+# "wheat farming" share n-grams
+SEMANTIC_SYNONYMS = {
+    'wheat': ['gehu', 'gehun', 'gehoon', 'गेहूं', 'गेहूँ', 'गहू', 'ਕਣਕ', 'kanak'],
+    'rice': ['paddy', 'dhan', 'dhaan', 'chawal', 'धान', 'चावल', 'ਚੌਲ', 'ਝੋਨਾ', 'நெல்', 'అరిసి', 'వరి', 'ধান', 'ভাত', 'ಭತ್ತ', 'നെൽ'],
+    'cotton': ['kapas', 'kapaas', 'कपास', 'कापूस', 'ਕਪਾਹ', 'పత్తి', 'કપાસ', 'ಹತ್ತಿ'],
+    'sugarcane': ['ganna', 'ganne', 'गन्ना', 'ऊस', 'கரும்பு', 'చెరకు'],
+    'maize': ['corn', 'makka', 'makki', 'मक्का', 'ਮੱਕੀ'],
+    'mustard': ['sarson', 'सरसों', 'সরিষা'],
+    'onion': ['pyaz', 'pyaaz', 'प्याज', 'कांदा'],
+    'potato': ['aloo', 'alu', 'आलू', 'আলু'],
+    'tomato': ['tamatar', 'टमाटर'],
+    'farming': ['kheti', 'kheti-badi', 'cultivation', 'खेती', 'शेती', 'ਖੇਤੀ', 'சாகுபடி', 'ব্যবসা'],
+    'fertilizer': ['khad', 'khaad', 'urvarak', 'खाद', 'उर्वरक', 'ਖਾਦ'],
+    'pest': ['keet', 'keeda', 'कीट', 'कीड़ा', 'ਕੀੜੇ'],
+    'disease': ['rog', 'bimari', 'रोग', 'बीमारी'],
+    'water': ['pani', 'paani', 'sinchai', 'पानी', 'सिंचाई', 'irrigation'],
+    'seed': ['beej', 'बीज', 'बियाणे', 'ਬੀਜ'],
+}
+_SYNONYM_LOOKUP = {variant: canonical for canonical, variants in SEMANTIC_SYNONYMS.items() for variant in variants}
+
+# Words that negate or reverse the advice asked for, per language. Two questions only share an answer when
+# they contain the same kinds ("irrigate now" vs "do not irrigate now", "spray before rain" vs "after rain").
+SEMANTIC_GUARD_WORDS = {
+    'english': {'not': ['not', 'no', 'never', 'dont', 'don', 'doesn', 'didn', 'shouldn', 'isn', 'aren', 'cannot',
+                        'without', 'avoid'],
+                'before': ['before', 'prior', 'pre'], 'after': ['after', 'post'],
+                'more': ['more', 'increase', 'higher', 'excess'], 'less': ['less', 'reduce', 'decrease', 'lower']},
+    'romanised': {'not': ['nahi', 'nahin', 'nai', 'mat', 'na', 'bina'], 'before': ['pehle', 'pahle'],
+                  'after': ['baad']},
+    'hindi': {'not': ['नहीं', 'नही', 'न', 'ना', 'मत', 'बिना'], 'before': ['पहले'], 'after': ['बाद'],
+              'more': ['ज्यादा', 'ज़्यादा', 'अधिक'], 'less': ['कम']},
+    'marathi': {'not': ['नाही', 'नको', 'नका'], 'before': ['आधी', 'पूर्वी'], 'after': ['नंतर'], 'more': ['जास्त'],
+                'less': ['कमी']},
+    'punjabi': {'not': ['ਨਹੀਂ', 'ਨਾ', 'ਮਤ'], 'before': ['ਪਹਿਲਾਂ'], 'after': ['ਬਾਅਦ']},
+    'tamil': {'not': ['இல்லை', 'வேண்டாம்'], 'before': ['முன்', 'முன்பு'], 'after': ['பின்', 'பிறகு']},
+    'telugu': {'not': ['కాదు', 'వద్దు', 'లేదు'], 'before': ['ముందు'], 'after': ['తర్వాత']},
+    'bengali': {'not': ['না', 'নয়', 'নেই'], 'before': ['আগে'], 'after': ['পরে']},
+    'gujarati': {'not': ['નહીં', 'ના', 'નથી'], 'before': ['પહેલાં'], 'after': ['પછી']},
+    'kannada': {'not': ['ಇಲ್ಲ', 'ಬೇಡ'], 'before': ['ಮೊದಲು'], 'after': ['ನಂತರ']},
+    'malayalam': {'not': ['ഇല്ല', 'വേണ്ട'], 'before': ['മുമ്പ്'], 'after': ['ശേഷം']},
+}
+_GUARD_LOOKUP = {unicodedata.normalize('NFKC', word).casefold(): kind
+                 for kinds in SEMANTIC_GUARD_WORDS.values() for kind, words in kinds.items() for word in words}
+
+
+def canonical_query(text: str) -> str:
+    """Normalised query with known crop/farming words replaced by their canonical token"""
+    return ' '.join(_SYNONYM_LOOKUP.get(word, word) for word in normalize_query(text).split())
+
+
+def query_ngrams(text: str, n: int = 3) -> Counter:
+    """Character n-gram counts (stable crc32 ids) of a canonical query, padded at word boundaries"""
+    grams = Counter()
+    for word in text.split():
+        padded = f' {word} '
+        if len(padded) <= n:
+            grams[zlib.crc32(padded.encode('utf-8'))] += 1
+            continue
+        for i in range(len(padded) - n + 1):
+            grams[zlib.crc32(padded[i:i + n].encode('utf-8'))] += 1
+    return grams
+
+
+class SemanticAnswerCache:
+    """Paraphrase-tolerant answer cache: hashed character n-gram TF-IDF vectors in a NumPy matrix.
+
+    Candidates come from an inverted index over each entry's rarest n-grams, so a lookup scores
+    a few hundred rows instead of the whole matrix and stays sub-millisecond at 100k entries.
+    Rows hold raw (sublinear) term frequencies; IDF is applied to query and candidates alike at
+    lookup time, so scores do not drift as the corpus grows. Questions whose numbers differ
+    ("2 acre" vs "5 acre") or that negate or reverse each other ("not", "before"/"after") never share
+    an answer.
+    """
+
+    INDEX_GRAMS = 8  # rarest n-grams indexed per entry and probed per query
+    MAX_POSTING = 4000  # n-grams shared by more entries than this are too common to probe
+    MAX_CANDIDATES = 256
+
+    def __init__(self, max_entries: int = GROQ_SEMANTIC_MAX_ENTRIES, threshold: float = GROQ_SEMANTIC_THRESHOLD,
+                 ttl: float = GROQ_SEMANTIC_TTL, dim: int = GROQ_SEMANTIC_DIM, path: str = GROQ_SEMANTIC_CACHE_PATH,
+                 snapshot_every: int = GROQ_SEMANTIC_SNAPSHOT_EVERY):
+        self.max_entries = max(1, max_entries)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.dim = dim
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self._lock = threading.Lock()
+        self._snapshot_due = threading.Event()
+        self._writer = None  # background snapshot thread, started on the first due snapshot
+        self._reset()
+
+    def _reset(self):
+        """Empty storage, index and counters"""
+        self.vectors = np.zeros((self.max_entries, self.dim), dtype=np.float32)  # sublinear tf per bucket
+        self.bucket_freq = np.zeros(self.dim, dtype=np.int32)  # live entries with a non-zero bucket
+        self.languages = np.full(self.max_entries, -1, dtype=np.int16)  # -1 = free slot
+        self.stored_at = np.zeros(self.max_entries, dtype=np.float64)  # wall clock, survives restarts
+        self.last_used = np.zeros(self.max_entries, dtype=np.float64)
+        self.texts = [None] * self.max_entries
+        self.numbers = [None] * self.max_entries
+        self.guards = [None] * self.max_entries
+        self.answers = [None] * self.max_entries
+        self.language_codes = {}
+        self.doc_freq = Counter()
+        self.postings = {}  # n-gram id -> array('i') of slots (may hold stale slots, re-checked on scoring)
+        self.posting_count = 0
+        self.size = 0
+        self._next_free = 0
+        self._inserts_since_snapshot = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lookup_ms_total = 0.0
+        self.snapshots_saved = 0
+
+    def _language_code(self, language: str) -> int:
+        if language not in self.language_codes:
+            self.language_codes[language] = len(self.language_codes)
+        return self.language_codes[language]
+
+    def _term_vector(self, grams: Counter):
+        """Sublinear term frequencies folded into dim buckets (weighted by IDF only when scoring)"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for gram, count in grams.items():
+            vector[gram % self.dim] += 1.0 + math.log(count)
+        return vector
+
+    def _idf(self):
+        """Current smoothed IDF per bucket"""
+        return (np.log((1.0 + self.size + 1) / (1.0 + self.bucket_freq)) + 1.0).astype(np.float32)
+
+    @staticmethod
+    def _numbers(text: str) -> Tuple[int, ...]:
+        """Numbers in the question (any script's digits), in order"""
+        return tuple(int(number) for number in re.findall(r'\d+', text))
+
+    @staticmethod
+    def _guards(text: str) -> frozenset:
+        """Kinds of negating/reversing words in the question (SEMANTIC_GUARD_WORDS)"""
+        return frozenset(_GUARD_LOOKUP[word] for word in text.split() if word in _GUARD_LOOKUP)
+
+    def _store(self, slot: int, text: str, grams: Counter, language: str, stored_at: float, answer):
+        self.doc_freq.update(grams.keys())
+        self.vectors[slot] = self._term_vector(grams)
+        self.bucket_freq += self.vectors[slot] > 0
+        self.languages[slot] = self._language_code(language)
+        self.stored_at[slot] = stored_at
+        self.last_used[slot] = stored_at
+        self.texts[slot] = text
+        self.numbers[slot] = self._numbers(text)
+        self.guards[slot] = self._guards(text)
+        self.answers[slot] = answer
+        self.size += 1
+        self._index(slot, grams)
+
+    def _rarest(self, grams: Counter) -> List[int]:
+        return sorted(grams, key=lambda gram: (self.doc_freq.get(gram, 0), gram))[:self.INDEX_GRAMS]
+
+    def _candidates(self, grams: Counter):
+        lists = []
+        for gram in self._rarest(grams):
+            posting = self.postings.get(gram)
+            if posting is not None and 0 < len(posting) <= self.MAX_POSTING:
+                lists.append(np.frombuffer(posting, dtype=np.int32))
+        if not lists:
+            return None
+        slots, shared = np.unique(np.concatenate(lists), return_counts=True)
+        if len(slots) > self.MAX_CANDIDATES:
+            slots = slots[np.argpartition(-shared, self.MAX_CANDIDATES)[:self.MAX_CANDIDATES]]
+        return slots
+
+    def lookup(self, message: str, language: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Get (copy of cached answer, similarity) for a paraphrase in the same language, or None"""
+        started = time.perf_counter()
+        text = canonical_query(message)
+        grams = query_ngrams(text)
+        result = None
+        with self._lock:
+            code = self.language_codes.get(language)
+            candidates = self._candidates(grams) if code is not None and grams else None
+            if candidates is not None:
+                numbers, guards = self._numbers(text), self._guards(text)
+                candidates = np.array([slot for slot in candidates[self.languages[candidates] == code]
+                                       if self.numbers[slot] == numbers and self.guards[slot] == guards],
+                                      dtype=np.int64)
+            if candidates is not None and len(candidates):
+                idf = self._idf()
+                query = self._term_vector(grams) * idf
+                rows = self.vectors[candidates] * idf
+                norms = np.linalg.norm(rows, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+                scores = (rows @ query) / np.maximum(norms, 1e-12)
+                best = int(scores.argmax())
+                slot, similarity = int(candidates[best]), float(scores[best])
+                now = time.time()
+                if similarity >= self.threshold:
+                    if self.ttl > 0 and now - self.stored_at[slot] > self.ttl:
+                        self._free(slot)
+                        self.expirations += 1
+                    else:
+                        self.last_used[slot] = now
+                        result = (copy.deepcopy(self.answers[slot]), round(similarity, 4))
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.lookup_ms_total += (time.perf_counter() - started) * 1000
+        return result
+
+    def _free(self, slot: int):
+        """Release a slot; its postings go stale and are filtered out when scored"""
+        for gram in query_ngrams(self.texts[slot]):
+            self.doc_freq[gram] -= 1
+            if self.doc_freq[gram] <= 0:
+                del self.doc_freq[gram]
+        self.bucket_freq -= self.vectors[slot] > 0
+        self.languages[slot] = -1
+        self.vectors[slot] = 0
+        self.texts[slot] = None
+        self.numbers[slot] = None
+        self.guards[slot] = None
+        self.answers[slot] = None
+        self.size -= 1
+
+    def _allocate(self) -> int:
+        if self._next_free < self.max_entries:
+            self._next_free += 1
+            return self._next_free - 1
+        free = np.flatnonzero(self.languages < 0)
+        if len(free):
+            return int(free[0])
+        # Evict the least recently used entry
+        slot = int(self.last_used.argmin())
+        self._free(slot)
+        self.evictions += 1
+        return slot
+
+    def _index(self, slot: int, grams: Counter):
+        for gram in self._rarest(grams):
+            self.postings.setdefault(gram, array('i')).append(slot)
+            self.posting_count += 1
+
+    def _rebuild_index(self):
+        """Drop stale postings once they outnumber live ones"""
+        self.postings = {}
+        self.posting_count = 0
+        for slot in np.flatnonzero(self.languages >= 0):
+            self._index(int(slot), query_ngrams(self.texts[slot]))
+
+    def put(self, message: str, language: str, response: Dict[str, Any], stored_at: float = None):
+        """Store an answer under the question's vector"""
+        text = canonical_query(message)
+        grams = query_ngrams(text)
+        if not grams:
+            return
+        with self._lock:
+            slot = self._allocate()
+            self._store(slot, text, grams, language, stored_at or time.time(), copy.deepcopy(response))
+            if self.posting_count > 2 * self.INDEX_GRAMS * max(self.size, 1000):
+                self._rebuild_index()
+            self._inserts_since_snapshot += 1
+            snapshot_due = self.snapshot_every > 0 and self._inserts_since_snapshot >= self.snapshot_every
+        if snapshot_due:
+            self._request_snapshot()
+
+    def _request_snapshot(self):
+        """Wake the background writer; inserts (and the async event loop) never wait for a snapshot"""
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_snapshots, name='semantic-cache-snapshot',
+                                                daemon=True)
+                self._writer.start()
+        self._snapshot_due.set()
+
+    def _write_snapshots(self):
+        while True:
+            self._snapshot_due.wait()
+            self._snapshot_due.clear()
+            self.save_snapshot()
+
+    def save_snapshot(self, path: str = None) -> Optional[str]:
+        """Persist live entries (vectors, languages, timestamps, texts, answers) atomically. Workers sharing
+        the path write to their own temp files and take turns under a file lock; the latest snapshot wins."""
+        path = path or self.path
+        if not path:
+            return None
+        with self._lock:
+            slots = np.flatnonzero(self.languages >= 0)
+            codes = {code: language for language, code in self.language_codes.items()}
+            meta = {
+                'dim': self.dim,
+                'languages': [codes[int(code)] for code in self.languages[slots]],
+                'texts': [self.texts[slot] for slot in slots],
+                'answers': [self.answers[slot] for slot in slots]
+            }
+            vectors = self.vectors[slots].copy()
+            stored_at = self.stored_at[slots].copy()
+            self._inserts_since_snapshot = 0
+        tmp_path = None
+        try:
+            directory = os.path.dirname(path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            payload = np.frombuffer(json.dumps(meta, ensure_ascii=False, default=str).encode('utf-8'), dtype=np.uint8)
+            with open(f"{path}.lock", 'a') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.semantic-', suffix='.npz')
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez_compressed(f, vectors=vectors, stored_at=stored_at, meta=payload)
+                os.replace(tmp_path, path)
+                tmp_path = None
+            self.snapshots_saved += 1
+            return path
+        except Exception as e:
+            logger.warning(f"⚠️ Could not save semantic cache snapshot: {e}")
+            return None
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def flush(self):
+        """Save a snapshot if anything was stored since the last one (registered at exit)"""
+        if self._inserts_since_snapshot:
+            self.save_snapshot()
+
+    def load_snapshot(self, path: str = None) -> int:
+        """Restore entries from a snapshot, skipping expired ones; returns the number loaded"""
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with np.load(path, allow_pickle=False) as snapshot:
+                stored_at = snapshot['stored_at']
+                meta = json.loads(snapshot['meta'].tobytes().decode('utf-8'))
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load semantic cache snapshot: {e}")
+            return 0
+        if meta.get('dim') != self.dim:
+            logger.warning("⚠️ Semantic cache snapshot dimension mismatch, ignoring it")
+            return 0
+        now = time.time()
+        loaded = 0
+        # Most recent entries last so they survive if the snapshot is larger than max_entries
+        for i in np.argsort(stored_at):
+            if self.ttl > 0 and now - stored_at[i] > self.ttl:
+                continue
+            text = meta['texts'][i]
+            grams = query_ngrams(text)
+            with self._lock:
+                # Vectors are rebuilt from the text, so snapshots written with older weighting load correctly
+                slot = self._allocate()
+                self._store(slot, text, grams, meta['languages'][i], float(stored_at[i]), meta['answers'][i])
+            loaded += 1
+        logger.info(f"♻️ Loaded {loaded} semantic cache entries from {path}")
+        return loaded
+
+    def clear(self):
+        """Drop all cached answers"""
+        with self._lock:
+            self._reset()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters, lookup latency and size limits"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': True,
+                'entries': self.size,
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'ttl_seconds': self.ttl,
+                'dim': self.dim,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'groq_calls_saved': self.hits,
+                'avg_lookup_ms': round(self.lookup_ms_total / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'snapshot_path': self.path,
+                'snapshots_saved': self.snapshots_saved
+            }
+
+
+semantic_cache = None
+if GROQ_SEMANTIC_CACHE_ENABLED and np is not None:
+    semantic_cache = SemanticAnswerCache()
+    semantic_cache.load_snapshot()
+    atexit.register(semantic_cache.flush)
+
+
+def benchmark_semantic_cache(entries: int = 100000, lookups: int = 2000) -> Dict[str, Any]:
+    """Fill a throwaway semantic cache with synthetic questions and time lookups"""
+    import random
+
+    rng = random.Random(7)
+    crops = ['wheat', 'rice', 'cotton', 'maize', 'mustard', 'onion', 'potato', 'tomato', 'sugarcane', 'soybean',
+             'groundnut', 'chickpea', 'banana', 'mango', 'chilli', 'turmeric', 'ginger', 'millet', 'barley', 'jute']
+    topics = ['fertilizer dose', 'pest control', 'irrigation schedule', 'sowing time', 'best variety',
+              'disease treatment', 'market price', 'seed rate', 'weed control', 'harvest time', 'yield per acre']
+    places = ['punjab', 'bihar', 'nashik', 'guntur', 'kerala', 'haryana', 'vidarbha', 'odisha', 'indore', 'assam']
+    cache = SemanticAnswerCache(max_entries=entries, path=None, snapshot_every=0)
+
+    questions = [f"{rng.choice(topics)} for {rng.choice(crops)} in {rng.choice(places)} field {i}"
+                 for i in range(entries)]
+    started = time.perf_counter()
+    for i, question in enumerate(questions):
+        cache.put(question, 'english', {'advice': f'answer {i}'})
+    fill_s = time.perf_counter() - started
+
+    # Half repeats of cached questions, half unseen phrasings
+    timings = []
+    for i in range(lookups):
+        query = questions[rng.randrange(entries)] if i % 2 else f"how to do {rng.choice(topics)} {rng.choice(crops)}"
+        started = time.perf_counter()
+        cache.lookup(query, 'english')
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'entries': cache.size,
+        'fill_seconds': round(fill_s, 1),
+        'matrix_mb': round(cache.vectors.nbytes / 1e6, 1),
+        'lookup_ms_p50': round(timings[len(timings) // 2], 4),
+        'lookup_ms_p95': round(timings[int(len(timings) * 0.95)], 4),
+        'lookup_ms_max': round(timings[-1], 4),
+        'hit_ratio': cache.get_stats()['hit_ratio']
+    }
+
+
+def create_stub_app(delay: float = 0.5, chunk_delay: float = 0.01, error_rate: float = 0.0,
+                    retry_after: float = 1.0):
+    """aiohttp app answering OpenAI-compatible /chat/completions after `delay` seconds (streamed or not).
+
+    With `error_rate`, that share of calls is answered 429 with Retry-After / x-ratelimit headers.
+    """
+    calls = {'count': 0, 'rate_limited': 0}
+
+    async def chat_completions(request):
+        body = await request.json()
+        calls['count'] += 1
+        if random.random() < error_rate:
+            calls['rate_limited'] += 1
+            return web.json_response(
+                {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                status=429, headers={'Retry-After': str(retry_after), 'x-ratelimit-remaining-requests': '0',
+                                     'x-ratelimit-reset-requests': f'{retry_after}s'})
+        await asyncio.sleep(delay)
+        question = body['messages'][-1]['content'].strip().splitlines()[-1][:80]
+        text = f"Stub answer from {body.get('model', 'stub')}: {question}"
+        usage = {'prompt_tokens': sum(len(m['content']) // 4 for m in body['messages']),
+                 'completion_tokens': len(text) // 4}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        if not body.get('stream'):
+            return web.json_response({'choices': [{'message': {'role': 'assistant', 'content': text}}],
+                                      'usage': usage})
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for word in text.split(' '):
+            chunk = {'choices': [{'delta': {'content': word + ' '}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            await asyncio.sleep(chunk_delay)
+        if (body.get('stream_options') or {}).get('include_usage'):
+            await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode('utf-8'))
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def stats(request):
+        return web.json_response(calls)
+
+    app = web.Application()
+    app.router.add_post('/chat/completions', chat_completions)
+    app.router.add_get('/stats', stats)
+    return app
+
+
+def _legacy_detect_language(text: str) -> str:
+    """Previous detector (per-language list scans), kept only as the benchmark reference"""
+    language_patterns = {
+        'hindi': 'अआइईउऊएऐओऔकखगघचछजझटठडढतथदधनपफबभमयरलवशषसह',
+        'tamil': 'அஆஇஈஉஊஎஏஐஒஓஔகஙசஞடணதநபமயரலவழளறன',
+        'telugu': 'అఆఇఈఉఊఎఏఐఒఓఔకఖగఘఙచఛజఝఞటఠడఢణతథదధనపఫబభమయరలవశషసహ',
+        'punjabi': 'ਅਆਇਈਉਊਏਐਓਔਕਖਗਘਙਚਛਜਝਞਟਠਡਢਣਤਥਦਧਨਪਫਬਭਮਯਰਲਵਸਹ',
+        'bengali': 'অআইঈউঊঋএঐওঔকখগঘঙচছজঝঞটঠডঢণতথদধনপফবভমযরলশষসহ',
+        'marathi': 'अआइईउऊऋएऐओऔकखगघङचछजझञटठडढणतथदधनपफबभमयरलवशषसह',
+        'gujarati': 'અઆઇઈઉઊઋએઐઓઔકખગઘઙચછજઝઞટઠડઢણતથદધનપફબભમયરલવશષસહ',
+        'kannada': 'ಅಆಇಈಉಊಋಎಏಐಒಓಔಕಖಗಘಙಚಛಜಝಞಟಠಡಢಣತಥದಧನಪಫಬಭಮಯರಲವಶಷಸಹ',
+        'malayalam': 'അആഇഈഉഊഋഎഏഐഒഓഔകഖഗഘങചഛജഝഞടഠഡഢണതഥദധനപഫബഭമയരലവശഷസഹ'
+    }
+    detected_language, confidence = 'english', 0
+    for lang, chars in language_patterns.items():
+        char_count = sum(1 for char in text if char in chars)
+        if char_count > confidence:
+            confidence, detected_language = char_count, lang
+    return detected_language
+
+
+def benchmark_language_detection(repeat: int = 200) -> Dict[str, Any]:
+    """Compare the script-block detector with the previous scan for agreement and speed"""
+    samples = {
+        'hindi': 'मेरी फसल में कीट लग गए हैं, क्या करूं? गेहूं की खेती कैसे करें',
+        'marathi': 'माझ्या पिकावर किडे लागले आहेत, काय करावे? कापूस शेती कशी करावी',
+        'tamil': 'என் பயிரில் பூச்சி தாக்குதல் உள்ளது, என்ன செய்வது?',
+        'telugu': 'నా పంటలో పురుగులు వచ్చాయి, ఏమి చేయాలి?',
+        'punjabi': 'ਮੇਰੀ ਫਸਲ ਵਿੱਚ ਕੀੜੇ ਲੱਗ ਗਏ ਹਨ, ਕੀ ਕਰਨਾ ਚਾਹੀਦਾ ਹੈ?',
+        'bengali': 'আমার ফসলে পোকার আক্রমণ হয়েছে, কী করব?',
+        'gujarati': 'મારા પાકમાં જંતુઓ લાગ્યા છે, શું કરવું?',
+        'kannada': 'ನನ್ನ ಬೆಳೆಯಲ್ಲಿ ಕೀಟಗಳು ಬಂದಿವೆ, ಏನು ಮಾಡಬೇಕು?',
+        'malayalam': 'എന്റെ വിളയിൽ പുഴുക്കൾ വന്നിട്ടുണ്ട്, എന്ത് ചെയ്യണം?',
+        'english': 'My crop has pest infestation, what should I do?',
+        'mixed': 'wheat crop में yellow rust आ गया है, which fungicide?',
+    }
+    cases = list(samples.items()) + [('long_' + name, text * 200) for name, text in samples.items()]
+
+    script_of = {'marathi': 'hindi'}  # Hindi and Marathi share Devanagari
+    results, same_script, same_language = [], 0, 0
+    timings = {'legacy_ms': 0.0, 'script_block_ms': 0.0}
+    for name, text in cases:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            legacy = _legacy_detect_language(text)
+        timings['legacy_ms'] += (time.perf_counter() - started) * 1000 / repeat
+        started = time.perf_counter()
+        for _ in range(repeat):
+            current = detect_script_language(text)['language']
+        timings['script_block_ms'] += (time.perf_counter() - started) * 1000 / repeat
+        same_script += script_of.get(legacy, legacy) == script_of.get(current, current)
+        same_language += legacy == current
+        results.append({'case': name, 'chars': len(text), 'legacy': legacy, 'script_block': current})
+    return {
+        'cases': len(cases),
+        'script_agreement': round(same_script / len(cases), 4),
+        'language_agreement': round(same_language / len(cases), 4),
+        'legacy_ms_total': round(timings['legacy_ms'], 3),
+        'script_block_ms_total': round(timings['script_block_ms'], 3),
+        'speedup': round(timings['legacy_ms'] / timings['script_block_ms'], 1) if timings['script_block_ms'] else None,
+        'disagreements': [r for r in results if r['legacy'] != r['script_block']]
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Groq service utilities')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark-semantic', help='Time semantic cache lookups')
+    bench_parser.add_argument('--entries', type=int, default=100000)
+    bench_parser.add_argument('--lookups', type=int, default=2000)
+    language_parser = subparsers.add_parser('benchmark-language', help='Compare language detectors')
+    language_parser.add_argument('--repeat', type=int, default=200)
+    stub_parser = subparsers.add_parser('stub-server', help='Serve a local stand-in for the Groq API')
+    stub_parser.add_argument('--port', type=int, default=8799)
+    stub_parser.add_argument('--delay', type=float, default=0.5)
+    stub_parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered 429')
+    stub_parser.add_argument('--retry-after', type=float, default=1.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'stub-server':
+        if web is None:
+            print("❌ aiohttp not installed")
+            sys.exit(1)
+        print(f"🧪 Groq stand-in on http://127.0.0.1:{args.port} (delay {args.delay}s, 429 rate {args.error_rate})")
+        web.run_app(create_stub_app(args.delay, error_rate=args.error_rate, retry_after=args.retry_after),
+                    host='127.0.0.1', port=args.port, print=None,
+                    access_log=None, backlog=4096)
+        sys.exit(0)
+    if args.command == 'benchmark-language':
+        print(json.dumps(benchmark_language_detection(args.repeat), indent=2, ensure_ascii=False))
+        sys.exit(0)
+    if np is None:
+        print("❌ NumPy not installed")
+        sys.exit(1)
+    print(json.dumps(benchmark_semantic_cache(args.entries, args.lookups), indent=2))
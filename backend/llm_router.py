@@ -0,0 +1,493 @@
+"""
+LLM Router - chat completion providers and latency-based routing between them
+
+Providers are OpenAI-compatible HTTP endpoints (Groq, OpenAI, a vLLM or Ollama server, or the stand-in
+from `groq_service.py stub-server`), the in-process local model (local_llm_service) and an in-process
+mock. Each provider keeps a rolling window of latencies and outcomes. The router sends each request to
+the healthy provider within its request quota that has the lowest expected latency divided by its weight.
+
+Without LLM_PROVIDERS the router holds a single Groq provider, so behaviour matches a direct Groq call.
+Configure several with a JSON list, e.g.:
+    LLM_PROVIDERS='[{"name": "groq", "weight": 2},
+                    {"name": "openai", "kind": "openai", "base_url": "https://api.openai.com/v1",
+                     "api_key_env": "OPENAI_API_KEY", "model": "gpt-4o-mini", "rpm": 500},
+                    {"name": "local", "kind": "local", "weight": 0.2}]'
+
+Watch routing across local stand-in servers (one fast, one slow, one failing):
+    python llm_router.py benchmark --requests 300
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import logging
+import threading
+import subprocess
+from collections import Counter, deque
+from typing import Dict, Any, Iterator, List, Optional
+
+import groq_service
+import local_llm_service
+
+logger = logging.getLogger(__name__)
+
+# Provider list (JSON); unset = Groq only
+LLM_PROVIDERS = os.getenv('LLM_PROVIDERS', '')
+LLM_PROVIDER_KINDS = ('openai', 'local', 'mock')
+GROQ_MODEL = os.getenv('GROQ_MODEL', 'llama-3.1-8b-instant')
+
+# Routing
+LLM_ROUTER_WINDOW_SECONDS = float(os.getenv('LLM_ROUTER_WINDOW_SECONDS', 300))  # rolling latency/error window
+LLM_ROUTER_MIN_SAMPLES = int(os.getenv('LLM_ROUTER_MIN_SAMPLES', 5))  # below this, latency is the lower of p50 and the estimate
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv('LLM_ROUTER_MAX_ERROR_RATE', 0.5))  # above this a provider is unhealthy
+LLM_ROUTER_EXPLORE = float(os.getenv('LLM_ROUTER_EXPLORE', 0.05))  # share of requests sent to a random healthy provider
+LLM_ROUTER_DEFAULT_LATENCY_MS = float(os.getenv('LLM_ROUTER_DEFAULT_LATENCY_MS', 1000))
+
+
+def _completion(text: str, usage: Dict[str, Any]) -> Dict[str, Any]:
+    """OpenAI-shaped chat completion body for an in-process provider's answer"""
+    return {
+        'choices': [{'message': {'role': 'assistant', 'content': text},
+                     'finish_reason': usage.get('finish_reason', 'stop')}],
+        'usage': {key: usage[key] for key in ('prompt_tokens', 'completion_tokens') if key in usage}
+    }
+
+
+class ProviderStats:
+    """Rolling window of (time, success, latency) for one provider"""
+
+    def __init__(self, window_seconds: float = LLM_ROUTER_WINDOW_SECONDS, max_samples: int = 1000):
+        self.window_seconds = window_seconds
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def _prune(self, now: float):
+        while self._samples and now - self._samples[0][0] > self.window_seconds:
+            self._samples.popleft()
+
+    def record(self, success: bool, latency_ms: float):
+        with self._lock:
+            self.requests += 1
+            if not success:
+                self.failures += 1
+            self._samples.append((time.monotonic(), success, latency_ms))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Samples, error rate and p50/p95 latency of successful calls within the window"""
+        with self._lock:
+            self._prune(time.monotonic())
+            outcomes = [success for _, success, _ in self._samples]
+            latencies = sorted(latency for _, success, latency in self._samples if success)
+        return {
+            'samples': len(outcomes),
+            'error_rate': round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0,
+            'p50_ms': round(latencies[len(latencies) // 2], 1) if latencies else None,
+            'p95_ms': round(latencies[int(len(latencies) * 0.95)], 1) if latencies else None
+        }
+
+
+class LLMProvider:
+    """One chat completion backend: model, routing weight, request quota, circuit breaker and rolling stats"""
+
+    kind = None
+    http = False  # OpenAI-compatible HTTP endpoint called by the bot's pooled sessions
+    shared_rate_limit = False  # queues on groq_service.rate_limiter instead of its own rpm quota
+
+    def __init__(self, name: str, model: str, weight: float = 1.0, rpm: int = 0,
+                 latency_ms: float = LLM_ROUTER_DEFAULT_LATENCY_MS, slow_ms: float = groq_service.GROQ_BREAKER_SLOW_MS,
+                 breaker: groq_service.CircuitBreaker = None):
+        self.name = name
+        self.model = model
+        self.weight = max(weight, 1e-6)
+        self.rpm = rpm  # 0 = no quota of its own
+        self.latency_ms = latency_ms  # estimate used until the window has LLM_ROUTER_MIN_SAMPLES
+        self.slow_ms = slow_ms  # successes slower than this count as breaker failures (0 = never)
+        if breaker is None and groq_service.GROQ_BREAKER_ENABLED:
+            breaker = groq_service.CircuitBreaker(name=name)
+        self.breaker = breaker
+        self.stats = ProviderStats()
+        self._calls = deque()  # monotonic times of calls within the last minute
+        self._quota_lock = threading.Lock()
+
+    def within_quota(self) -> bool:
+        """Whether another call fits in the provider's requests-per-minute quota"""
+        if not self.rpm:
+            return True
+        with self._quota_lock:
+            now = time.monotonic()
+            while self._calls and now - self._calls[0] > 60:
+                self._calls.popleft()
+            return len(self._calls) < self.rpm
+
+    def take_quota(self):
+        if self.rpm:
+            with self._quota_lock:
+                self._calls.append(time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether the circuit breaker lets a call through (may reserve the half-open probe)"""
+        return self.breaker is None or self.breaker.allow()
+
+    def cancel_probe(self):
+        if self.breaker is not None:
+            self.breaker.cancel_probe()
+
+    def breaker_open(self) -> bool:
+        return self.breaker is not None and self.breaker.state == groq_service.CircuitBreaker.OPEN
+
+    def healthy(self, snapshot: Dict[str, Any]) -> bool:
+        """Breaker not open and rolling error rate acceptable"""
+        if self.breaker_open():
+            return False
+        return snapshot['samples'] < LLM_ROUTER_MIN_SAMPLES or snapshot['error_rate'] <= LLM_ROUTER_MAX_ERROR_RATE
+
+    def expected_latency_ms(self, snapshot: Dict[str, Any]) -> float:
+        """Rolling p50; until the window is full enough, the lower of that and the configured estimate, so a
+        provider that looked fast when explored keeps getting traffic until it has been measured properly"""
+        if snapshot['p50_ms'] is None:
+            return self.latency_ms
+        if snapshot['samples'] >= LLM_ROUTER_MIN_SAMPLES:
+            return snapshot['p50_ms']
+        return min(self.latency_ms, snapshot['p50_ms'])
+
+    def get_stats(self) -> Dict[str, Any]:
+        snapshot = self.stats.snapshot()
+        return {
+            'kind': self.kind,
+            'model': self.model,
+            'weight': self.weight,
+            'rpm': self.rpm,
+            'shared_rate_limit': self.shared_rate_limit,
+            'healthy': self.healthy(snapshot),
+            'within_quota': self.within_quota(),
+            'expected_latency_ms': self.expected_latency_ms(snapshot),
+            'requests': self.stats.requests,
+            'failures': self.stats.failures,
+            'window': snapshot,
+            'circuit_breaker': self.breaker.state if self.breaker is not None else 'disabled'
+        }
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Any /chat/completions endpoint speaking the OpenAI protocol (Groq, OpenAI, vLLM, Ollama, the stub server)"""
+
+    kind = 'openai'
+    http = True
+
+    def __init__(self, name: str, base_url: str, api_key: str, model: str, shared_rate_limit: bool = False, **kwargs):
+        super().__init__(name, model, **kwargs)
+        self.base_url = base_url.rstrip('/')
+        self.url = f"{self.base_url}/chat/completions"
+        self.shared_rate_limit = shared_rate_limit
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+
+    def within_quota(self) -> bool:
+        """The Groq provider is out of quota while Groq has asked every caller to back off (429)"""
+        if self.shared_rate_limit:
+            if groq_service.rate_limiter is not None and groq_service.rate_limiter.paused_for() > 0:
+                return False
+            if groq_service.retry_policy is not None and groq_service.retry_policy.paused_for() > 0:
+                return False
+        return super().within_quota()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**super().get_stats(), 'base_url': self.base_url}
+
+
+class LocalProvider(LLMProvider):
+    """The in-process local model (local_llm_service) as a routable provider"""
+
+    kind = 'local'
+
+    def __init__(self, name: str = 'local', llm: local_llm_service.LocalLLM = None, **kwargs):
+        self.llm = llm or local_llm_service.local_llm or local_llm_service.LocalLLM()
+        kwargs.setdefault('slow_ms', 0)  # CPU generation is slow by nature; only errors count
+        kwargs.setdefault('latency_ms', 10000)
+        super().__init__(name, self.llm.model_label, **kwargs)
+        if self.llm.status == 'not_loaded':
+            self.llm.warm_up()  # routable once loaded; until then the router skips it
+
+    def healthy(self, snapshot: Dict[str, Any]) -> bool:
+        return self.llm.is_ready() and super().healthy(snapshot)
+
+    def stream(self, payload: Dict[str, Any], usage: Dict[str, Any]) -> Iterator[str]:
+        max_new_tokens = min(payload.get('max_tokens') or local_llm_service.LOCAL_LLM_MAX_NEW_TOKENS,
+                             local_llm_service.LOCAL_LLM_MAX_NEW_TOKENS)
+        return self.llm.stream(payload['messages'], max_new_tokens, usage)
+
+    def complete(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        usage = {}
+        return _completion(''.join(self.stream(payload, usage)), usage)
+
+    async def acomplete(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.complete, payload)
+
+    async def astream(self, payload: Dict[str, Any], usage: Dict[str, Any]):
+        # Generation blocks the CPU: drive it from the executor, one delta per hop
+        loop = asyncio.get_running_loop()
+        deltas = self.stream(payload, usage)
+        finished = object()
+        while True:
+            delta = await loop.run_in_executor(None, next, deltas, finished)
+            if delta is finished:
+                return
+            yield delta
+
+
+class MockProvider(LLMProvider):
+    """In-process stand-in with configurable latency and error rate (tests and routing experiments)"""
+
+    kind = 'mock'
+
+    def __init__(self, name: str = 'mock', model: str = 'mock', delay_ms: float = 50, error_rate: float = 0.0, **kwargs):
+        kwargs.setdefault('latency_ms', delay_ms)
+        super().__init__(name, model, **kwargs)
+        self.delay_ms = delay_ms
+        self.error_rate = error_rate
+
+    def _answer(self, payload: Dict[str, Any], usage: Dict[str, Any]) -> str:
+        if random.random() < self.error_rate:
+            raise Exception(f"Mock provider {self.name} failed")
+        question = payload['messages'][-1]['content'].strip()[:80]
+        text = f"Mock answer from {self.name}: {question}"
+        usage.update({'prompt_tokens': groq_service.estimate_message_tokens(payload['messages']),
+                      'completion_tokens': groq_service.estimate_tokens(text), 'finish_reason': 'stop'})
+        return text
+
+    def complete(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        time.sleep(self.delay_ms / 1000)
+        usage = {}
+        return _completion(self._answer(payload, usage), usage)
+
+    def stream(self, payload: Dict[str, Any], usage: Dict[str, Any]) -> Iterator[str]:
+        time.sleep(self.delay_ms / 1000)
+        for word in self._answer(payload, usage).split(' '):
+            yield word + ' '
+
+    async def acomplete(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        await asyncio.sleep(self.delay_ms / 1000)
+        usage = {}
+        return _completion(self._answer(payload, usage), usage)
+
+    async def astream(self, payload: Dict[str, Any], usage: Dict[str, Any]):
+        await asyncio.sleep(self.delay_ms / 1000)
+        for word in self._answer(payload, usage).split(' '):
+            yield word + ' '
+
+
+class LLMRouter:
+    """Sends each chat completion to the fastest healthy provider within quota.
+
+    Score = expected latency (rolling p50, or the configured estimate until the window has enough
+    samples) divided by weight. Providers with an open breaker, a rolling error rate above
+    LLM_ROUTER_MAX_ERROR_RATE or a spent quota are skipped while any other provider is usable; a
+    small share of requests goes to a random healthy provider (by weight) so rankings keep updating.
+    """
+
+    def __init__(self, providers: List[LLMProvider], explore: float = LLM_ROUTER_EXPLORE):
+        if not providers:
+            raise ValueError("LLM router needs at least one provider")
+        self.providers = providers
+        self.explore = explore
+        self.routed = Counter()
+        self.explored = 0
+        self.no_provider = 0
+
+    def _score(self, provider: LLMProvider, snapshot: Dict[str, Any]) -> float:
+        return provider.expected_latency_ms(snapshot) / provider.weight
+
+    def _ranked(self) -> List[LLMProvider]:
+        """Usable providers, best score first"""
+        snapshots = {provider.name: provider.stats.snapshot() for provider in self.providers}
+        candidates = [p for p in self.providers if p.healthy(snapshots[p.name]) and p.within_quota()]
+        if not candidates:
+            # Nothing healthy: still try whatever the breakers allow (the Groq bucket queues rather than refuses)
+            candidates = [p for p in self.providers if p.shared_rate_limit or p.within_quota()]
+        return sorted(candidates, key=lambda p: self._score(p, snapshots[p.name]))
+
+    def preferred(self) -> LLMProvider:
+        """Provider the next call most likely goes to, without exploring or reserving anything (for labels)"""
+        ordered = self._ranked()
+        return ordered[0] if ordered else self.providers[0]
+
+    def circuit_state(self, name: str = None) -> str:
+        """Breaker state of the named provider, or of the preferred one when no routed provider has that name"""
+        provider = next((p for p in self.providers if p.name == name), None) or self.preferred()
+        return provider.breaker.state if provider.breaker is not None else 'disabled'
+
+    def choose(self) -> Optional[LLMProvider]:
+        """Provider for the next call, or None when every breaker is open (callers fall back)"""
+        ordered = self._ranked()
+        if len(ordered) > 1 and random.random() < self.explore:
+            pick = random.choices(ordered, weights=[p.weight for p in ordered])[0]
+            ordered.remove(pick)
+            ordered.insert(0, pick)
+            self.explored += 1
+        for provider in ordered:
+            if provider.allow():
+                provider.take_quota()
+                self.routed[provider.name] += 1
+                return provider
+        self.no_provider += 1
+        return None
+
+    def record(self, provider: LLMProvider, success: bool, latency_ms: float = 0.0, reason: str = None):
+        """Feed one call into the provider's window and breaker; answers slower than its slow_ms count as breaker failures"""
+        provider.stats.record(success, latency_ms)
+        if provider.breaker is None:
+            return
+        if success and 0 < provider.slow_ms < latency_ms:
+            provider.breaker.record_failure('slow')
+        elif success:
+            provider.breaker.record_success()
+        else:
+            provider.breaker.record_failure(reason or 'error')
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get per-provider health, quota, rolling p50/p95 and error rate, and routing counts"""
+        return {
+            'enabled': True,
+            'providers': {provider.name: provider.get_stats() for provider in self.providers},
+            'routed': dict(self.routed),
+            'explored': self.explored,
+            'no_provider': self.no_provider,
+            'explore': self.explore,
+            'window_seconds': LLM_ROUTER_WINDOW_SECONDS,
+            'min_samples': LLM_ROUTER_MIN_SAMPLES,
+            'max_error_rate': LLM_ROUTER_MAX_ERROR_RATE
+        }
+
+
+def build_provider(spec: Dict[str, Any], groq_api_key: str = None) -> LLMProvider:
+    """Provider from one LLM_PROVIDERS entry; an entry named groq defaults to the Groq endpoint, key,
+    model, shared rate limiter and circuit breaker"""
+    spec = dict(spec)
+    name = spec.pop('name')
+    kind = spec.pop('kind', 'openai').lower()
+    if kind not in LLM_PROVIDER_KINDS:
+        raise ValueError(f"Unknown provider kind '{kind}'. Options: {', '.join(LLM_PROVIDER_KINDS)}")
+    options = {key: spec.pop(key) for key in ('weight', 'rpm', 'latency_ms', 'slow_ms') if key in spec}
+    if kind == 'local':
+        return LocalProvider(name, **options)
+    if kind == 'mock':
+        return MockProvider(name, spec.pop('model', 'mock'), spec.pop('delay_ms', 50), spec.pop('error_rate', 0.0),
+                            **options)
+    if name == 'groq':
+        spec.setdefault('base_url', groq_service.GROQ_BASE_URL)
+        spec.setdefault('model', GROQ_MODEL)
+        spec.setdefault('shared_rate_limit', True)
+        options.setdefault('breaker', groq_service.circuit_breaker)
+    api_key = os.getenv(spec['api_key_env'], '') if 'api_key_env' in spec else spec.get('api_key', '')
+    if name == 'groq' and not api_key:
+        api_key = groq_api_key or os.getenv('GROQ_API_KEY', '')
+    return OpenAICompatibleProvider(name, spec['base_url'], api_key, spec['model'],
+                                    shared_rate_limit=spec.get('shared_rate_limit', False), **options)
+
+
+def build_router(groq_api_key: str = None, config: str = LLM_PROVIDERS) -> LLMRouter:
+    """Router over the configured providers (Groq alone when LLM_PROVIDERS is unset)"""
+    specs = json.loads(config) if config else [{'name': 'groq'}]
+    return LLMRouter([build_provider(spec, groq_api_key) for spec in specs])
+
+
+# Process-wide router shared by the sync and async bots; built on first use
+router = None
+_router_lock = threading.Lock()
+
+
+def get_router(groq_api_key: str = None) -> LLMRouter:
+    global router
+    with _router_lock:
+        if router is None:
+            router = build_router(groq_api_key)
+            logger.info(f"🧭 LLM router providers: {', '.join(p.name for p in router.providers)}")
+        return router
+
+
+def benchmark_routing(requests_count: int = 300, concurrency: int = 8) -> Dict[str, Any]:
+    """Route chats across three stand-in servers (fast, slow, one answering 429 half the time) and an
+    in-process mock; reports where traffic went and each provider's rolling p50/p95 and error rate"""
+    ports = {'fast': 8871, 'slow': 8872, 'flaky': 8873}
+    servers = [
+        subprocess.Popen([sys.executable, groq_service.__file__, 'stub-server', '--port', str(ports['fast']),
+                          '--delay', '0.05'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+        subprocess.Popen([sys.executable, groq_service.__file__, 'stub-server', '--port', str(ports['slow']),
+                          '--delay', '0.3'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+        subprocess.Popen([sys.executable, groq_service.__file__, 'stub-server', '--port', str(ports['flaky']),
+                          '--delay', '0.02', '--error-rate', '0.5', '--retry-after', '0'],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    ]
+    try:
+        for port in ports.values():
+            # The stand-ins import the whole service module; wait until each one accepts connections
+            for _ in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        providers = [OpenAICompatibleProvider(name, f'http://127.0.0.1:{port}', 'stub', f'stub-{name}', latency_ms=100)
+                     for name, port in ports.items()]
+        providers.append(MockProvider('mock', delay_ms=150, weight=0.5))
+        bench_router = LLMRouter(providers)
+        session = groq_service.PooledSession()
+        payload = {'model': '', 'messages': [{'role': 'user', 'content': 'How to grow rice?'}], 'max_tokens': 50}
+
+        def call(_):
+            provider = bench_router.choose()
+            if provider is None:
+                return
+            started = time.monotonic()
+            try:
+                if provider.http:
+                    response = session.post(provider.url, headers=provider.headers,
+                                            json=dict(payload, model=provider.model))
+                    success = response.status_code == 200
+                else:
+                    provider.complete(payload)
+                    success = True
+            except Exception:
+                success = False
+            bench_router.record(provider, success, (time.monotonic() - started) * 1000)
+
+        from concurrent.futures import ThreadPoolExecutor
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(call, range(requests_count)))
+        stats = bench_router.get_stats()
+        return {
+            'requests': requests_count,
+            'wall_seconds': round(time.perf_counter() - started, 2),
+            'routed': stats['routed'],
+            'explored': stats['explored'],
+            'providers': {name: {'window': p['window'], 'healthy': p['healthy'], 'circuit_breaker': p['circuit_breaker']}
+                          for name, p in stats['providers'].items()}
+        }
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='LLM router utilities')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark', help='Route requests across local stand-in providers')
+    bench_parser.add_argument('--requests', type=int, default=300)
+    bench_parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if groq_service.web is None:
+        print("❌ aiohttp not installed (needed for the stand-in servers)")
+        sys.exit(1)
+    print(json.dumps(benchmark_routing(args.requests, args.concurrency), indent=2))
@@ -0,0 +1,457 @@
+"""
+Local LLM Service - offline answer generator used when Groq is down or over quota
+
+A small instruction-tuned model runs on the server CPU, quantized so it fits next to the crop image
+model: int8 dynamic quantization through transformers/torch (default), or a 4-bit GGUF file through
+llama.cpp. The model loads lazily (or warms in the background at startup) and stays resident. The
+constant system prompt of each language is prefilled once and its KV cache reused, so a fallback
+answer only pays for the user's turns and the generated tokens.
+
+Install (upgrades transformers to a release that knows the default Qwen2.5 model):
+    pip install -r requirements.txt && pip install -r requirements-local-llm.txt
+
+Measure generation speed to size nodes for offline operation:
+    python local_llm_service.py benchmark --requests 8 --concurrency 1 --max-new-tokens 128
+
+Ask the local model one question:
+    python local_llm_service.py generate "How do I control aphids on mustard?"
+"""
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import logging
+import resource
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Iterator, List
+
+import groq_service
+
+logger = logging.getLogger(__name__)
+
+try:
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+except ImportError:
+    torch = None
+    AutoModelForCausalLM = None
+    AutoTokenizer = None
+
+# llama.cpp is only needed for 4-bit GGUF models (pip install -r requirements-local-llm.txt)
+try:
+    from llama_cpp import Llama, LlamaRAMCache
+except ImportError:
+    Llama = None
+    LlamaRAMCache = None
+
+# Local generator configuration (off unless LOCAL_LLM_ENABLED=true)
+LOCAL_LLM_ENABLED = os.getenv('LOCAL_LLM_ENABLED', 'false').lower() == 'true'
+LOCAL_LLM_PRELOAD = os.getenv('LOCAL_LLM_PRELOAD', 'true').lower() == 'true'
+
+# Runtime: transformers (int8 dynamic quantization or fp32) | llama_cpp (4-bit GGUF)
+LOCAL_LLM_RUNTIMES = ('transformers', 'llama_cpp')
+LOCAL_LLM_RUNTIME = os.getenv('LOCAL_LLM_RUNTIME', 'transformers').lower()
+LOCAL_LLM_QUANTIZATIONS = ('int8', 'none')
+LOCAL_LLM_QUANTIZATION = os.getenv('LOCAL_LLM_QUANTIZATION', 'int8').lower()  # transformers runtime only
+LOCAL_LLM_MODEL = os.getenv('LOCAL_LLM_MODEL', 'Qwen/Qwen2.5-0.5B-Instruct')  # Hugging Face id or local directory
+LOCAL_LLM_GGUF_PATH = os.getenv('LOCAL_LLM_GGUF_PATH',
+                                os.path.join(os.path.dirname(__file__), 'models', 'qwen2.5-0.5b-instruct-q4_k_m.gguf'))
+LOCAL_LLM_THREADS = int(os.getenv('LOCAL_LLM_THREADS', 0))  # 0 = library default
+LOCAL_LLM_CONTEXT_TOKENS = int(os.getenv('LOCAL_LLM_CONTEXT_TOKENS', 4096))  # llama.cpp context window
+
+# Generation
+LOCAL_LLM_MAX_NEW_TOKENS = int(os.getenv('LOCAL_LLM_MAX_NEW_TOKENS', 256))  # also capped by the query class budget
+LOCAL_LLM_TEMPERATURE = float(os.getenv('LOCAL_LLM_TEMPERATURE', 0.7))  # 0 = greedy
+LOCAL_LLM_TOP_P = float(os.getenv('LOCAL_LLM_TOP_P', 0.9))
+
+# Generation is CPU-bound: a few at a time, and callers that cannot get a slot quickly get the knowledge base
+LOCAL_LLM_CONCURRENCY = int(os.getenv('LOCAL_LLM_CONCURRENCY', 1))
+LOCAL_LLM_QUEUE_TIMEOUT = float(os.getenv('LOCAL_LLM_QUEUE_TIMEOUT', 1.0))  # seconds to wait for a free slot
+LOCAL_LLM_PROMPT_CACHE_MB = int(os.getenv('LOCAL_LLM_PROMPT_CACHE_MB', 256))  # prefilled prompt prefixes kept
+
+# Groq fallback reasons the local model answers; past the latency budget the knowledge base is faster
+LOCAL_LLM_FALLBACK_REASONS = ('circuit_open', 'rate_limited', 'groq_error', 'groq_unavailable')
+
+BENCHMARK_SYSTEM_PROMPT = (
+    "You are Annapurna, an agricultural expert for Indian farmers. Answer in the language of the question "
+    "with practical, region-specific advice: crop varieties, sowing windows, fertilizer doses per acre, "
+    "integrated pest management and relevant government schemes."
+)
+BENCHMARK_QUESTIONS = [
+    'How do I control aphids on mustard?',
+    'मेरी गेहूं की फसल पीली हो रही है, क्या करूं?',
+    'What fertilizer dose should I use for paddy per acre?',
+    'என் நெல் பயிரில் இலைகள் மஞ்சளாக மாறுகிறது',
+    'When should I sow chickpea in Madhya Pradesh?',
+    'Tomato leaves have brown spots and are curling. What is the treatment?',
+    'Which government schemes help with drip irrigation?',
+    'How much water does sugarcane need in summer?'
+]
+
+
+class LocalLLMUnavailable(Exception):
+    """Raised when the local model cannot take a request now (disabled, loading, failed or busy)"""
+
+
+def is_available(runtime: str = LOCAL_LLM_RUNTIME) -> bool:
+    """Check whether the libraries for a local runtime are installed"""
+    if runtime == 'llama_cpp':
+        return Llama is not None
+    return torch is not None and AutoModelForCausalLM is not None
+
+
+def _kv_bytes(past_key_values) -> int:
+    """Approximate memory held by a transformers KV cache (legacy tuples or a Cache object)"""
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        past_key_values = past_key_values.to_legacy_cache()
+    return sum(tensor.numel() * tensor.element_size() for layer in past_key_values for tensor in layer)
+
+
+class LocalLLM:
+    """Loads the local model once, keeps it resident and runs a bounded number of generations at a time"""
+
+    def __init__(self, runtime: str = LOCAL_LLM_RUNTIME, model_name: str = LOCAL_LLM_MODEL,
+                 quantization: str = LOCAL_LLM_QUANTIZATION, concurrency: int = LOCAL_LLM_CONCURRENCY,
+                 queue_timeout: float = LOCAL_LLM_QUEUE_TIMEOUT, prompt_cache_mb: int = LOCAL_LLM_PROMPT_CACHE_MB):
+        self.runtime = runtime
+        self.model_name = LOCAL_LLM_GGUF_PATH if runtime == 'llama_cpp' else model_name
+        self.quantization = 'gguf' if runtime == 'llama_cpp' else quantization
+        # One llama.cpp context decodes one sequence at a time
+        self.concurrency = 1 if runtime == 'llama_cpp' else max(1, concurrency)
+        self.queue_timeout = queue_timeout
+        self.model = None
+        self.tokenizer = None
+        self.eos_ids = set()
+        self.status = 'not_loaded'
+        self.error = None
+        self.load_time_ms = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        # Prefilled KV caches of system prompts (transformers runtime; llama.cpp keeps its own RAM cache)
+        self._prefixes = OrderedDict()  # prompt text -> (past_key_values, token count, bytes)
+        self._prefix_bytes = 0
+        self.prompt_cache_bytes = prompt_cache_mb * 1024 * 1024
+        self._prefix_lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {'requests': 0, 'completed': 0, 'busy': 0, 'not_ready': 0, 'errors': 0,
+                      'prefix_hits': 0, 'prefix_misses': 0, 'generated_tokens': 0}
+        self._tokens_per_second = deque(maxlen=500)
+        self._first_token_ms = deque(maxlen=500)
+
+    @property
+    def model_label(self) -> str:
+        """Short model name reported as model_type in chat responses"""
+        return f"local:{os.path.basename(self.model_name.rstrip('/'))}"
+
+    def _load_transformers(self):
+        """Load the Hugging Face model on CPU, int8 dynamically quantized unless configured otherwise"""
+        if self.quantization not in LOCAL_LLM_QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{self.quantization}'. Options: {', '.join(LOCAL_LLM_QUANTIZATIONS)}")
+        if LOCAL_LLM_THREADS:
+            torch.set_num_threads(LOCAL_LLM_THREADS)
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+        model.eval()
+        if self.quantization == 'int8':
+            logger.info("🔧 Quantizing local model Linear layers to int8")
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        eos = getattr(model.generation_config, 'eos_token_id', None)
+        self.eos_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) | {tokenizer.eos_token_id}
+        self.eos_ids.discard(None)
+        return tokenizer, model
+
+    def _load_llama_cpp(self):
+        """Open the 4-bit GGUF model with a RAM prompt cache"""
+        if not os.path.exists(self.model_name):
+            raise FileNotFoundError(f"GGUF model not found at {self.model_name}")
+        model = Llama(model_path=self.model_name, n_ctx=LOCAL_LLM_CONTEXT_TOKENS,
+                      n_threads=LOCAL_LLM_THREADS or None, verbose=False)
+        model.set_cache(LlamaRAMCache(capacity_bytes=self.prompt_cache_bytes))
+        return None, model
+
+    def load(self) -> bool:
+        """Load the model once; safe to call from any thread"""
+        if self.status == 'ready':
+            return True
+        if self.runtime not in LOCAL_LLM_RUNTIMES:
+            self.status = 'error'
+            self.error = f"Unknown local LLM runtime '{self.runtime}'. Options: {', '.join(LOCAL_LLM_RUNTIMES)}"
+            return False
+        if not is_available(self.runtime):
+            self.status = 'unavailable'
+            self.error = f'{self.runtime} not installed on server.'
+            return False
+
+        with self._lock:
+            if self.status == 'ready':
+                return True
+            self.status = 'loading'
+            started = time.perf_counter()
+            try:
+                logger.info(f"🔄 Loading local LLM: {self.model_name} ({self.runtime}, {self.quantization})")
+                if self.runtime == 'llama_cpp':
+                    self.tokenizer, self.model = self._load_llama_cpp()
+                else:
+                    self.tokenizer, self.model = self._load_transformers()
+                # Warm-up generation so the first fallback does not pay for lazy allocations
+                for _ in self._generate([{'role': 'user', 'content': 'Hello'}], 4, {}):
+                    pass
+                self.load_time_ms = round((time.perf_counter() - started) * 1000, 1)
+                self.loaded_at = datetime.now().isoformat()
+                self.error = None
+                self.status = 'ready'
+                logger.info(f"✅ Local LLM ready in {self.load_time_ms} ms")
+                return True
+            except Exception as e:
+                self.status = 'error'
+                self.error = str(e)
+                logger.error(f"❌ Local LLM load error: {e}")
+                return False
+
+    def warm_up(self) -> threading.Thread:
+        """Load the model in a background thread so server startup is not blocked"""
+        thread = threading.Thread(target=self.load, name='local-llm-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self) -> bool:
+        """Check whether the model is loaded and serving"""
+        return self.status == 'ready'
+
+    def _prefix_state(self, prefix_text: str):
+        """Prefilled KV cache for a system prompt, computed once and shared by later requests"""
+        with self._prefix_lock:
+            entry = self._prefixes.get(prefix_text)
+            if entry is not None:
+                self._prefixes.move_to_end(prefix_text)
+                self.stats['prefix_hits'] += 1
+                return entry
+        self.stats['prefix_misses'] += 1
+        ids = self.tokenizer(prefix_text, return_tensors='pt', add_special_tokens=False).input_ids
+        with torch.no_grad():
+            past = self.model(input_ids=ids, use_cache=True).past_key_values
+        entry = (past, ids.shape[1], _kv_bytes(past))
+        with self._prefix_lock:
+            if prefix_text not in self._prefixes and entry[2] <= self.prompt_cache_bytes:
+                self._prefixes[prefix_text] = entry
+                self._prefix_bytes += entry[2]
+                while self._prefix_bytes > self.prompt_cache_bytes:
+                    _, evicted = self._prefixes.popitem(last=False)
+                    self._prefix_bytes -= evicted[2]
+        return entry
+
+    def _sample(self, logits) -> int:
+        """Next token id: greedy at temperature 0, else nucleus sampling"""
+        if LOCAL_LLM_TEMPERATURE <= 0:
+            return int(torch.argmax(logits))
+        probs = torch.softmax(logits.float() / LOCAL_LLM_TEMPERATURE, dim=-1)
+        sorted_probs, sorted_ids = torch.sort(probs, descending=True)
+        keep = torch.cumsum(sorted_probs, dim=-1) - sorted_probs < LOCAL_LLM_TOP_P
+        sorted_probs, sorted_ids = sorted_probs[keep], sorted_ids[keep]
+        return int(sorted_ids[torch.multinomial(sorted_probs / sorted_probs.sum(), 1)])
+
+    def _generate_transformers(self, messages: List[Dict[str, str]], max_new_tokens: int,
+                               usage: Dict[str, Any]) -> Iterator[str]:
+        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        past, prefix_tokens = None, 0
+        if messages[0]['role'] == 'system':
+            # The chat template renders the leading system message as a fixed prefix of the prompt
+            prefix_text = self.tokenizer.apply_chat_template(messages[:1], tokenize=False)
+            if prompt.startswith(prefix_text):
+                cached, prefix_tokens, _ = self._prefix_state(prefix_text)
+                past = copy.deepcopy(cached)  # newer transformers extend Cache objects in place
+                prompt = prompt[len(prefix_text):]
+        input_ids = self.tokenizer(prompt, return_tensors='pt', add_special_tokens=False).input_ids
+        usage.update({'prompt_tokens': prefix_tokens + input_ids.shape[1], 'cached_prompt_tokens': prefix_tokens})
+
+        generated = []
+        emitted = ''
+        with torch.no_grad():
+            for _ in range(max_new_tokens):
+                output = self.model(input_ids=input_ids, past_key_values=past, use_cache=True)
+                past = output.past_key_values
+                token = self._sample(output.logits[0, -1])
+                if token in self.eos_ids:
+                    usage['finish_reason'] = 'stop'
+                    break
+                generated.append(token)
+                usage['completion_tokens'] = len(generated)
+                input_ids = torch.tensor([[token]])
+                text = self.tokenizer.decode(generated, skip_special_tokens=True)
+                if text.endswith('\ufffd'):
+                    continue  # multi-byte character split across tokens
+                if len(text) > len(emitted):
+                    yield text[len(emitted):]
+                    emitted = text
+            else:
+                usage['finish_reason'] = 'length'
+
+    def _generate_llama_cpp(self, messages: List[Dict[str, str]], max_new_tokens: int,
+                            usage: Dict[str, Any]) -> Iterator[str]:
+        chunks = self.model.create_chat_completion(messages=messages, max_tokens=max_new_tokens, stream=True,
+                                                   temperature=LOCAL_LLM_TEMPERATURE, top_p=LOCAL_LLM_TOP_P)
+        for chunk in chunks:
+            choice = chunk['choices'][0]
+            if choice.get('finish_reason'):
+                usage['finish_reason'] = choice['finish_reason']
+            delta = choice.get('delta', {}).get('content')
+            if delta:
+                usage['completion_tokens'] = usage.get('completion_tokens', 0) + 1  # one chunk per token
+                yield delta
+
+    def _generate(self, messages: List[Dict[str, str]], max_new_tokens: int, usage: Dict[str, Any]) -> Iterator[str]:
+        if self.runtime == 'llama_cpp':
+            return self._generate_llama_cpp(messages, max_new_tokens, usage)
+        return self._generate_transformers(messages, max_new_tokens, usage)
+
+    def stream(self, messages: List[Dict[str, str]], max_new_tokens: int = LOCAL_LLM_MAX_NEW_TOKENS,
+               usage: Dict[str, Any] = None) -> Iterator[str]:
+        """Yield answer text as it is generated, filling `usage` with token counts and speed.
+
+        Raises LocalLLMUnavailable before any text when the model is not loaded yet (a lazy load is
+        started in the background) or every slot stays busy for queue_timeout seconds.
+        """
+        usage = usage if usage is not None else {}
+        self.stats['requests'] += 1
+        if self.status != 'ready':
+            self.stats['not_ready'] += 1
+            if self.status == 'not_loaded':
+                self.warm_up()
+            raise LocalLLMUnavailable(f'local model {self.status}' + (f': {self.error}' if self.error else ''))
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.stats['busy'] += 1
+            raise LocalLLMUnavailable(f'all {self.concurrency} local model slots busy')
+        self.in_flight += 1
+        started = time.perf_counter()
+        first_token = None
+        try:
+            for delta in self._generate(messages, max_new_tokens, usage):
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    usage['first_token_ms'] = round((first_token - started) * 1000, 1)
+                yield delta
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+        elapsed = time.perf_counter() - started
+        tokens = usage.get('completion_tokens', 0)
+        usage['elapsed_ms'] = round(elapsed * 1000, 1)
+        # Decode speed excludes the prompt prefill that precedes the first token
+        if first_token is not None and tokens > 1:
+            usage['tokens_per_second'] = round((tokens - 1) / max(time.perf_counter() - first_token, 1e-6), 2)
+            self._tokens_per_second.append(usage['tokens_per_second'])
+            self._first_token_ms.append(usage['first_token_ms'])
+        self.stats['completed'] += 1
+        self.stats['generated_tokens'] += tokens
+
+    def generate(self, messages: List[Dict[str, str]], max_new_tokens: int = LOCAL_LLM_MAX_NEW_TOKENS) -> Dict[str, Any]:
+        """Generate a whole answer; returns the text and its usage"""
+        usage = {}
+        text = ''.join(self.stream(messages, max_new_tokens, usage))
+        return {'text': text, **usage}
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get readiness, load statistics, slot usage and generation speed"""
+        return {
+            'enabled': True,
+            'model': self.model_name,
+            'runtime': self.runtime,
+            'quantization': self.quantization,
+            'status': self.status,
+            'ready': self.is_ready(),
+            'load_time_ms': self.load_time_ms,
+            'loaded_at': self.loaded_at,
+            'error': self.error,
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'queue_timeout_seconds': self.queue_timeout,
+            **self.stats,
+            'prompt_cache': {'entries': len(self._prefixes), 'bytes': self._prefix_bytes,
+                             'max_bytes': self.prompt_cache_bytes},
+            'tokens_per_second': groq_service.PromptMetrics._summary(self._tokens_per_second),
+            'first_token_ms': groq_service.PromptMetrics._summary(self._first_token_ms)
+        }
+
+
+# Shared generator used by the chat fallback (None unless LOCAL_LLM_ENABLED)
+local_llm = LocalLLM() if LOCAL_LLM_ENABLED else None
+
+
+def benchmark_generation(requests_count: int = 8, concurrency: int = 1,
+                         max_new_tokens: int = 128) -> Dict[str, Any]:
+    """Generation speed at a given concurrency: per-request decode tokens/s, time to first token and
+    aggregate tokens/s, for sizing nodes that must answer without Groq"""
+    llm = LocalLLM(concurrency=concurrency, queue_timeout=3600)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if not llm.load():
+        return {'error': llm.error, 'status': llm.status}
+    rss_loaded = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def ask(index: int) -> Dict[str, Any]:
+        question = BENCHMARK_QUESTIONS[index % len(BENCHMARK_QUESTIONS)]
+        messages = [{'role': 'system', 'content': BENCHMARK_SYSTEM_PROMPT}, {'role': 'user', 'content': question}]
+        return llm.generate(messages, max_new_tokens)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=llm.concurrency) as pool:
+        results = list(pool.map(ask, range(requests_count)))
+    wall = time.perf_counter() - started
+    total_tokens = sum(result.get('completion_tokens', 0) for result in results)
+    status = llm.get_status()
+    return {
+        'model': llm.model_name,
+        'runtime': llm.runtime,
+        'quantization': llm.quantization,
+        'load_time_ms': llm.load_time_ms,
+        'model_rss_mb': round(rss_loaded - rss_before, 1),
+        'concurrency': llm.concurrency,
+        'requests': requests_count,
+        'max_new_tokens': max_new_tokens,
+        'wall_seconds': round(wall, 2),
+        'generated_tokens': total_tokens,
+        'aggregate_tokens_per_second': round(total_tokens / wall, 2) if wall else 0.0,
+        'per_request_tokens_per_second': status['tokens_per_second'],
+        'first_token_ms': status['first_token_ms'],
+        'prefix_hits': status['prefix_hits'],
+        'prefix_misses': status['prefix_misses'],
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local LLM fallback utilities')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark', help='Measure local generation tokens/second')
+    bench_parser.add_argument('--requests', type=int, default=8)
+    bench_parser.add_argument('--concurrency', type=int, default=1)
+    bench_parser.add_argument('--max-new-tokens', type=int, default=128)
+    generate_parser = subparsers.add_parser('generate', help='Ask the local model one question')
+    generate_parser.add_argument('question')
+    generate_parser.add_argument('--max-new-tokens', type=int, default=LOCAL_LLM_MAX_NEW_TOKENS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not is_available():
+        print(f"❌ {LOCAL_LLM_RUNTIME} runtime not installed")
+        sys.exit(1)
+    if args.command == 'benchmark':
+        print(json.dumps(benchmark_generation(args.requests, args.concurrency, args.max_new_tokens), indent=2))
+        sys.exit(0)
+    llm = LocalLLM(queue_timeout=3600)
+    if not llm.load():
+        print(f"❌ {llm.error}")
+        sys.exit(1)
+    usage = {}
+    for delta in llm.stream([{'role': 'system', 'content': BENCHMARK_SYSTEM_PROMPT},
+                             {'role': 'user', 'content': args.question}], args.max_new_tokens, usage):
+        print(delta, end='', flush=True)
+    print(f"\n\n{json.dumps(usage)}")
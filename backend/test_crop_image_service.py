@@ -0,0 +1,296 @@
+"""
+Unit tests for crop_image_service (no model weights needed: inference is replaced by a fake)
+Run: python -m pytest -q test_crop_image_service.py
+"""
+import io
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import crop_image_service
+
+
+@pytest.fixture
+def fake_predict_batch(monkeypatch):
+    """Replace the model with a fake that answers each input's own value and records batch sizes"""
+    batches = []
+    release = threading.Event()
+    release.set()
+
+    def predict_batch(pixels):
+        release.wait(5)
+        batches.append(len(pixels))
+        return [(1.0, int(pixel[0])) for pixel in pixels]
+
+    monkeypatch.setattr(crop_image_service, 'predict_batch', predict_batch)
+    predict_batch.batches = batches
+    predict_batch.release = release
+    return predict_batch
+
+
+def test_batch_queue_groups_concurrent_requests(fake_predict_batch):
+    batch_queue = crop_image_service.BatchInferenceQueue(max_batch_size=4, max_wait_ms=200)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda i: batch_queue.predict(np.array([i]), timeout=5), range(4)))
+
+    assert results == [(1.0, i) for i in range(4)]
+    assert fake_predict_batch.batches == [4]
+    assert batch_queue.get_stats()['max_batch_seen'] == 4
+
+
+def test_batch_queue_splits_at_max_batch_size(fake_predict_batch):
+    batch_queue = crop_image_service.BatchInferenceQueue(max_batch_size=2, max_wait_ms=200)
+    futures = [batch_queue.submit(np.array([i])) for i in range(5)]
+
+    assert [future.result(timeout=5) for future in futures] == [(1.0, i) for i in range(5)]
+    assert sum(fake_predict_batch.batches) == 5
+    assert max(fake_predict_batch.batches) <= 2
+
+
+def test_batch_queue_skips_requests_that_timed_out(fake_predict_batch):
+    batch_queue = crop_image_service.BatchInferenceQueue(max_batch_size=1, max_wait_ms=0)
+    fake_predict_batch.release.clear()
+    busy = batch_queue.submit(np.array([1]))  # holds the worker until released
+    time.sleep(0.05)
+
+    with pytest.raises(FutureTimeoutError):
+        batch_queue.predict(np.array([2]), timeout=0.05)
+    fake_predict_batch.release.set()
+
+    assert busy.result(timeout=5) == (1.0, 1)
+    assert batch_queue.predict(np.array([3]), timeout=5) == (1.0, 3)
+    assert fake_predict_batch.batches == [1, 1]  # the abandoned request never reached the model
+    assert batch_queue.get_stats()['total_requests'] == 2
+
+
+def test_batch_queue_rejects_when_full(fake_predict_batch):
+    batch_queue = crop_image_service.BatchInferenceQueue(max_batch_size=1, max_wait_ms=0, queue_depth=1)
+    fake_predict_batch.release.clear()
+    batch_queue.submit(np.array([1]))
+    time.sleep(0.05)  # the worker has taken the first request and is blocked on it
+    batch_queue.submit(np.array([2]))
+
+    with pytest.raises(crop_image_service.InferenceQueueFull):
+        batch_queue.submit(np.array([3]))
+    assert batch_queue.get_stats()['rejected_requests'] == 1
+    fake_predict_batch.release.set()
+
+
+def test_batch_errors_reach_every_caller(monkeypatch):
+    def predict_batch(pixels):
+        raise RuntimeError('model failed')
+
+    monkeypatch.setattr(crop_image_service, 'predict_batch', predict_batch)
+    batch_queue = crop_image_service.BatchInferenceQueue(max_batch_size=2, max_wait_ms=100)
+    futures = [batch_queue.submit(np.array([i])) for i in range(2)]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match='model failed'):
+            future.result(timeout=5)
+
+
+
+class StalledWorkerPool:
+    """Worker pool whose chunks are never picked up"""
+
+    enabled = True
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, inputs):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+def test_predict_inputs_cancels_pending_chunks_on_timeout(monkeypatch):
+    pool = StalledWorkerPool()
+    monkeypatch.setattr(crop_image_service, 'crop_worker_pool', pool)
+    monkeypatch.setattr(crop_image_service, 'CROP_BATCH_RESULT_TIMEOUT', 0.05)
+
+    with pytest.raises(FutureTimeoutError):
+        crop_image_service.predict_inputs([np.array([i]) for i in range(5)], chunk_size=2)
+    assert len(pool.futures) == 3
+    assert all(future.cancelled() for future in pool.futures)
+
+
+GREEN = (60, 140, 50)
+
+
+def test_image_cache_exact_and_near_duplicate_hits():
+    cache = crop_image_service.ImageResultCache(max_entries=8, max_distance=2, max_colour_distance=12)
+    cache.put('leaf', (0b1011, GREEN), (0.9, 1))
+
+    assert cache.get_exact('leaf') == (0.9, 1)
+    assert cache.get_exact('other') is None
+    assert cache.get_similar((0b1011 ^ 0b11, GREEN)) == (0.9, 1)  # 2 bits apart
+    assert cache.get_similar((0b1011 ^ 0b111, GREEN)) is None  # 3 bits apart
+    assert cache.get_similar((0b1011, (60, 140, 70))) is None  # same shape, different colour
+    stats = cache.get_stats()
+    assert (stats['exact_hits'], stats['near_duplicate_hits'], stats['misses']) == (1, 1, 2)
+
+
+def test_image_cache_prefers_the_closest_match():
+    cache = crop_image_service.ImageResultCache(max_entries=8, max_distance=2)
+    cache.put('far', (1 << 40 | 1 << 41, GREEN), (0.5, 2))
+    cache.put('near', (1 << 40, GREEN), (0.8, 3))
+
+    assert cache.get_similar((0, GREEN)) == (0.8, 3)
+
+
+def test_image_cache_evicts_least_recently_used():
+    cache = crop_image_service.ImageResultCache(max_entries=2, max_distance=2)
+    low, high = (1 << 32) - 1, ((1 << 32) - 1) << 32  # 32 bits away from each other and from 0
+    cache.put('a', (0, GREEN), (0.1, 1))
+    cache.put('b', (low, GREEN), (0.2, 2))
+    cache.get_exact('a')
+    cache.put('c', (high, GREEN), (0.3, 3))
+
+    assert cache.get_exact('b') is None
+    assert cache.get_exact('a') == (0.1, 1)
+    assert cache.get_similar((low, GREEN)) is None  # the band index forgot the evicted entry
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_image_cache_drops_expired_entries():
+    cache = crop_image_service.ImageResultCache(max_entries=8, ttl=0.05, max_distance=2)
+    cache.put('a', (7, GREEN), (0.1, 1))
+    cache.put('b', (1 << 60, GREEN), (0.2, 2))
+    time.sleep(0.1)
+
+    assert cache.get_similar((7, GREEN)) is None
+    assert cache.get_exact('b') is None
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_perceptual_key_survives_jpeg_reencoding():
+    gradient = np.linspace(0, 255, 64 * 64, dtype=np.uint8).reshape(64, 64)
+    img = Image.fromarray(np.stack([gradient, gradient.T, np.full_like(gradient, 80)], axis=2))
+    buffer = io.BytesIO()
+    img.resize((48, 48)).save(buffer, format='JPEG', quality=60)
+    reencoded = crop_image_service.decode_image(buffer.getvalue())
+
+    dhash, colour = crop_image_service.perceptual_key(img)
+    other, other_colour = crop_image_service.perceptual_key(reencoded)
+    assert bin(dhash ^ other).count('1') <= 2
+    assert max(abs(a - b) for a, b in zip(colour, other_colour)) <= 12
+
+
+class FakeOrt:
+    """Records the session options create_onnx_session builds"""
+
+    class GraphOptimizationLevel:
+        ORT_ENABLE_ALL = 99
+
+    class SessionOptions:
+        intra_op_num_threads = 0
+        graph_optimization_level = None
+
+    def InferenceSession(self, path, sess_options=None, providers=None):
+        return {'path': path, 'options': sess_options, 'providers': providers}
+
+
+def test_onnx_session_reads_thread_count_at_call_time(monkeypatch):
+    monkeypatch.setattr(crop_image_service, 'ort', FakeOrt())
+    monkeypatch.setattr(crop_image_service, 'CROP_ORT_THREADS', 3)  # as an inference worker pins it
+
+    session = crop_image_service.create_onnx_session('model.onnx')
+
+    assert session['options'].intra_op_num_threads == 3
+    assert session['options'].graph_optimization_level == FakeOrt.GraphOptimizationLevel.ORT_ENABLE_ALL
+    assert session['providers'] == ['CPUExecutionProvider']
+    assert crop_image_service.create_onnx_session('model.onnx', threads=1)['options'].intra_op_num_threads == 1
+
+
+def test_onnx_session_leaves_threads_to_ort_by_default(monkeypatch):
+    monkeypatch.setattr(crop_image_service, 'ort', FakeOrt())
+    monkeypatch.setattr(crop_image_service, 'CROP_ORT_THREADS', 0)
+
+    assert crop_image_service.create_onnx_session('model.onnx')['options'].intra_op_num_threads == 0
+
+
+needs_torch = pytest.mark.skipif(crop_image_service.torch is None, reason='needs PyTorch')
+
+
+@needs_torch
+def test_static_int8_without_calibration_images_serves_eager(monkeypatch, tmp_path):
+    model = crop_image_service.torch.nn.Linear(4, 2).eval()
+    monkeypatch.setattr(crop_image_service, 'CROP_CALIBRATION_DIR', str(tmp_path))  # empty directory
+    registry = crop_image_service.CropModelRegistry(backend='static_int8', runtime='torch')
+    monkeypatch.setattr(registry, '_build_model', lambda: model)
+
+    assert crop_image_service.load_calibration_batch(str(tmp_path)) is None
+    assert registry._build_torch_model() is model
+    assert registry.backend == 'eager'
+    with pytest.raises(ValueError, match='calibration'):
+        crop_image_service.build_inference_backend(model, 'static_int8')
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1/hook',  # loopback
+    'http://[::1]:8080/hook',
+    'https://10.1.2.3/hook',  # private
+    'http://192.168.0.7/hook',
+    'http://169.254.169.254/latest/meta-data',  # link-local (cloud metadata)
+    'http://[fe80::1]/hook',
+    'ftp://example.com/hook',
+])
+def test_validate_callback_url_rejects_non_public_targets(monkeypatch, url):
+    monkeypatch.setattr(crop_image_service, 'CROP_JOB_CALLBACK_ALLOW_PRIVATE', False)
+
+    with pytest.raises(ValueError):
+        crop_image_service.CropJobManager.validate_callback_url(url)
+
+
+def fake_resolver(*addresses):
+    return lambda host, port, **kwargs: [(None, None, None, '', (address, port or 0)) for address in addresses]
+
+
+def test_validate_callback_url_checks_every_resolved_address(monkeypatch):
+    monkeypatch.setattr(crop_image_service, 'CROP_JOB_CALLBACK_ALLOW_PRIVATE', False)
+    validate = crop_image_service.CropJobManager.validate_callback_url
+
+    monkeypatch.setattr(crop_image_service.socket, 'getaddrinfo', fake_resolver('93.184.216.34', '10.0.0.1'))
+    with pytest.raises(ValueError):
+        validate('https://callback.example/hook')
+    monkeypatch.setattr(crop_image_service.socket, 'getaddrinfo', fake_resolver('93.184.216.34'))
+    assert validate('https://callback.example/hook') == '93.184.216.34'
+
+
+def test_callback_goes_to_the_validated_address_with_the_original_host():
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    seen = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            seen['host'] = self.headers['Host']
+            seen['body'] = self.rfile.read(int(self.headers['Content-Length']))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.handle_request, daemon=True).start()
+    port = server.server_address[1]
+
+    # callback.invalid never resolves: the request can only have gone to the pinned address
+    response = crop_image_service.post_to_address(f'http://callback.invalid:{port}/hook', '127.0.0.1',
+                                                  json={'ok': True}, timeout=5)
+    server.server_close()
+    assert response.status_code == 204
+    assert seen == {'host': f'callback.invalid:{port}', 'body': b'{"ok": true}'}
+
+
+def test_pinned_https_keeps_the_hostname_for_sni_and_certificates():
+    adapter = crop_image_service.PinnedHostAdapter('callback.example')
+
+    assert adapter.poolmanager.connection_pool_kw['server_hostname'] == 'callback.example'
+    assert adapter.poolmanager.connection_pool_kw['assert_hostname'] == 'callback.example'
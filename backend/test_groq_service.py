@@ -0,0 +1,570 @@
+"""
+Unit tests for groq_service (no network: Groq answers are plain dicts)
+Run: python -m pytest -q test_groq_service.py
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from email.utils import formatdate
+
+import pytest
+
+import groq_service
+
+HINDI = {'language': 'hindi', 'region': 'north_india'}
+ENGLISH = {'language': 'english', 'region': 'global'}
+
+
+def answer(text: str) -> dict:
+    return {'success': True, 'advice': text, 'model_type': 'llama-3.1-8b-instant'}
+
+
+def test_answer_cache_key_ignores_case_punctuation_and_spacing():
+    key = groq_service.AnswerCache.make_key('How to grow   wheat?', ENGLISH)
+
+    assert groq_service.AnswerCache.make_key('how to grow wheat', ENGLISH) == key
+    assert groq_service.AnswerCache.make_key('how to grow wheat', HINDI) != key
+    assert groq_service.AnswerCache.make_key('how to grow rice', ENGLISH) != key
+
+
+def test_answer_cache_returns_copies():
+    cache = groq_service.AnswerCache(max_bytes=10000, ttl=60)
+    cache.put('k', answer('Sow in November'))
+
+    first = cache.get('k')
+    first['advice'] = 'changed by a caller'
+    assert cache.get('k')['advice'] == 'Sow in November'
+    assert cache.get('missing') is None
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+
+
+def test_answer_cache_expires_entries():
+    cache = groq_service.AnswerCache(max_bytes=10000, ttl=0.05)
+    cache.put('k', answer('Sow in November'))
+    time.sleep(0.1)
+
+    assert cache.get('k') is None
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_answer_cache_evicts_least_recently_used_past_max_bytes():
+    size = len(json.dumps(answer('a' * 100)))
+    cache = groq_service.AnswerCache(max_bytes=size * 2, ttl=60)
+    cache.put('a', answer('a' * 100))
+    cache.put('b', answer('b' * 100))
+    cache.get('a')
+    cache.put('c', answer('c' * 100))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.get_stats()['bytes_used'] <= size * 2
+    cache.put('huge', answer('x' * size * 3))  # larger than the whole cache: not stored
+    assert cache.get('huge') is None
+
+
+def semantic_cache(**kwargs) -> groq_service.SemanticAnswerCache:
+    kwargs.setdefault('max_entries', 100)
+    return groq_service.SemanticAnswerCache(path=None, snapshot_every=0, **kwargs)
+
+
+def test_semantic_cache_matches_paraphrases_in_the_same_language():
+    cache = semantic_cache(threshold=0.85)
+    cache.put('How to control aphids on mustard crop?', 'english', answer('Spray neem oil'))
+
+    match = cache.lookup('how to control aphids on mustard crops', 'english')
+    assert match is not None and match[0]['advice'] == 'Spray neem oil'
+    assert 0.85 <= match[1] < 1.0
+    assert cache.lookup('how to control aphids on wheat crop', 'english') is None
+    assert cache.lookup('How to control aphids on mustard crop?', 'hindi') is None
+
+
+def test_semantic_cache_never_shares_answers_across_numbers():
+    cache = semantic_cache(threshold=0.5)
+    cache.put('how much urea for 2 acre wheat', 'english', answer('100 kg'))
+
+    assert cache.lookup('how much urea for 5 acre wheat', 'english') is None
+    assert cache.lookup('how much urea for 2 acres of wheat', 'english') is not None
+
+
+def test_semantic_cache_never_shares_answers_across_negation_or_opposites():
+    cache = semantic_cache(threshold=0.5)
+    cache.put('should i irrigate paddy now', 'english', answer('Yes, irrigate'))
+    cache.put('spray pesticide before rain', 'english', answer('Spray a day before'))
+    cache.put('धान में अभी पानी दें क्या', 'hindi', answer('हाँ'))
+
+    assert cache.lookup('should i not irrigate paddy now', 'english') is None
+    assert cache.lookup("shouldn't i irrigate paddy now", 'english') is None
+    assert cache.lookup('spray pesticide after rain', 'english') is None
+    assert cache.lookup('धान में अभी पानी न दें क्या', 'hindi') is None
+    assert cache.lookup('should i irrigate the paddy now', 'english')[0]['advice'] == 'Yes, irrigate'
+    assert cache.lookup('spray pesticides before rain', 'english')[0]['advice'] == 'Spray a day before'
+
+
+def test_semantic_cache_scores_do_not_drift_as_entries_are_added():
+    cache = semantic_cache(threshold=0.85, max_entries=500)
+    cache.put('how to control aphids on mustard crop', 'english', answer('Spray neem oil'))
+    before = cache.lookup('how to control aphids on mustard crops', 'english')[1]
+    for i, crop in enumerate(['rice', 'cotton', 'sugarcane', 'maize', 'onion', 'potato', 'tomato', 'chilli'] * 20):
+        cache.put(f'best sowing time for {crop} variety {chr(97 + i % 26)}', 'english', answer(crop))
+
+    assert cache.lookup('how to control aphids on mustard crop', 'english')[1] == 1.0
+    assert abs(cache.lookup('how to control aphids on mustard crops', 'english')[1] - before) < 0.1
+
+
+def test_semantic_cache_evicts_and_expires():
+    cache = semantic_cache(threshold=0.85, max_entries=2, ttl=0.2)
+    cache.put('how to grow wheat', 'english', answer('wheat'))
+    cache.put('how to grow cotton', 'english', answer('cotton'))
+    cache.lookup('how to grow wheat', 'english')
+    cache.put('how to grow onion', 'english', answer('onion'))
+
+    assert cache.get_stats()['evictions'] == 1
+    assert cache.lookup('how to grow cotton', 'english') is None
+    assert cache.lookup('how to grow wheat', 'english') is not None
+    time.sleep(0.3)
+    assert cache.lookup('how to grow onion', 'english') is None
+    assert cache.get_stats()['expirations'] == 1
+
+
+def test_semantic_cache_clear_and_snapshot_round_trip(tmp_path):
+    cache = semantic_cache(threshold=0.85)
+    cache.put('how to control aphids on mustard crop', 'english', answer('Spray neem oil'))
+    path = cache.save_snapshot(str(tmp_path / 'semantic.npz'))
+
+    cache.clear()
+    assert cache.get_stats()['entries'] == 0
+    assert cache.lookup('how to control aphids on mustard crop', 'english') is None
+
+    restored = semantic_cache(threshold=0.85)
+    assert restored.load_snapshot(path) == 1
+    assert restored.lookup('how to control aphids on mustard crop', 'english')[0]['advice'] == 'Spray neem oil'
+
+
+
+def test_semantic_cache_snapshots_in_the_background(tmp_path, monkeypatch):
+    path = str(tmp_path / 'semantic.npz')
+    cache = groq_service.SemanticAnswerCache(max_entries=100, path=path, snapshot_every=2)
+    writing = threading.Event()
+    release = threading.Event()
+    save_snapshot = cache.save_snapshot
+
+    def slow_save_snapshot(path=None):
+        writing.set()
+        release.wait(5)
+        return save_snapshot(path)
+
+    monkeypatch.setattr(cache, 'save_snapshot', slow_save_snapshot)
+    cache.put('how to grow wheat', 'english', answer('wheat'))
+    cache.put('how to grow cotton', 'english', answer('cotton'))  # snapshot due: put must not wait for it
+
+    assert writing.wait(2)
+    release.set()
+    wait_for(lambda: cache.get_stats()['snapshots_saved'] == 1)
+    assert groq_service.SemanticAnswerCache(max_entries=100, path=path).load_snapshot() == 2
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.npz')] == ['semantic.npz']
+
+
+needs_flock = pytest.mark.skipif(groq_service.fcntl is None, reason='shared bucket needs fcntl.flock')
+
+
+def test_rate_limiter_grants_the_burst_then_queues():
+    limiter = groq_service.TokenBucketRateLimiter(rate_per_minute=60, burst=2, state_file=None)
+
+    assert limiter.acquire(max_wait=0)[0]
+    assert limiter.acquire(max_wait=0)[0]
+    granted, waited_ms = limiter.acquire(max_wait=0.05)
+    assert not granted and waited_ms >= 50
+    assert limiter.get_stats()['timeouts'] == 1
+
+
+def test_rate_limiter_serves_interactive_before_batch():
+    limiter = groq_service.TokenBucketRateLimiter(rate_per_minute=600, burst=1, state_file=None)
+    limiter.acquire(max_wait=0)
+    served = []
+
+    def wait(priority, name):
+        if limiter.acquire(priority, max_wait=2)[0]:
+            served.append(name)
+
+    batch = threading.Thread(target=wait, args=(groq_service.PRIORITY_BATCH, 'batch'))
+    batch.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=wait, args=(groq_service.PRIORITY_INTERACTIVE, 'interactive'))
+    interactive.start()
+    batch.join()
+    interactive.join()
+
+    assert served == ['interactive', 'batch']
+
+
+@needs_flock
+def test_rate_limiter_pause_is_shared_through_the_state_file(tmp_path):
+    state_file = str(tmp_path / 'rate.json')
+    worker_a = groq_service.TokenBucketRateLimiter(rate_per_minute=600, burst=5, state_file=state_file)
+    worker_b = groq_service.TokenBucketRateLimiter(rate_per_minute=600, burst=5, state_file=state_file)
+
+    worker_a.pause(0.3)
+    granted, _ = worker_b.acquire(max_wait=0.05)
+    assert not granted
+    granted, waited_ms = worker_b.acquire(max_wait=1)
+    assert granted and waited_ms >= 150
+
+
+@needs_flock
+def test_rate_limiter_state_file_holds_one_budget(tmp_path):
+    state_file = str(tmp_path / 'rate.json')
+    worker_a = groq_service.TokenBucketRateLimiter(rate_per_minute=6, burst=2, state_file=state_file)
+    worker_b = groq_service.TokenBucketRateLimiter(rate_per_minute=6, burst=2, state_file=state_file)
+
+    assert worker_a.acquire(max_wait=0)[0]
+    assert worker_b.acquire(max_wait=0)[0]
+    assert not worker_a.acquire(max_wait=0)[0]
+    assert not worker_b.acquire(max_wait=0)[0]
+
+
+def test_rate_limiter_async_acquire(tmp_path):
+    limiter = groq_service.TokenBucketRateLimiter(rate_per_minute=600, burst=1,
+                                                  state_file=str(tmp_path / 'rate.json'))
+
+    async def acquire_twice():
+        return [await limiter.acquire_async(max_wait=1) for _ in range(2)]
+
+    (first, _), (second, waited_ms) = asyncio.run(acquire_twice())
+    assert first and second and waited_ms >= 50
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.005)
+
+
+def test_single_flight_shares_one_call_and_isolates_the_leader():
+    flight = groq_service.SingleFlight(timeout=5)
+    gate = threading.Event()
+    calls = []
+    results = {}
+
+    def ask():
+        calls.append(1)
+        gate.wait(5)
+        return answer('Sow in November')
+
+    def leader():
+        result, shared = flight.do('wheat', ask)
+        result['context'] = {'user': 'leader'}  # what the bot adds to its own answer
+        results['leader'] = (result, shared)
+
+    def follower():
+        results['follower'] = flight.do('wheat', ask)
+
+    threads = [threading.Thread(target=leader)]
+    threads[0].start()
+    wait_for(lambda: calls)
+    threads.append(threading.Thread(target=follower))
+    threads[1].start()
+    wait_for(lambda: flight.get_stats()['coalesced'] == 1)
+    gate.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results['leader'][1] is False and results['follower'][1] is True
+    assert 'context' not in results['follower'][0]
+    assert flight.get_stats()['in_flight'] == 0
+
+
+def test_single_flight_stream_replays_unmodified_events():
+    flight = groq_service.SingleFlight(timeout=5)
+    gate = threading.Event()
+
+    def produce():
+        yield {'type': 'delta', 'content': 'Sow '}
+        gate.wait(5)
+        yield {'type': 'done', 'success': True, 'advice': 'Sow early'}
+
+    events, shared = flight.stream('wheat', produce)
+    first = next(events)
+    first['context'] = 'leader only'
+    follower_events, follower_shared = flight.stream('wheat', produce)
+    followed = []
+    follower = threading.Thread(target=lambda: followed.extend(follower_events))
+    follower.start()
+    gate.set()
+    for event in events:
+        event['context'] = 'leader only'
+    follower.join()
+
+    assert not shared and follower_shared
+    assert [event['type'] for event in followed] == ['delta', 'done']
+    assert all('context' not in event for event in followed)
+
+
+def test_single_flight_leader_errors_reach_followers():
+    flight = groq_service.SingleFlight(timeout=5)
+    gate = threading.Event()
+    errors = []
+
+    def ask():
+        gate.wait(5)
+        raise RuntimeError('groq down')
+
+    def call():
+        try:
+            flight.do('wheat', ask)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: flight.get_stats()['coalesced'] == 2)
+    gate.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ['groq down'] * 3
+
+
+def test_parse_duration_formats():
+    assert groq_service.parse_duration('2') == 2.0
+    assert groq_service.parse_duration('0.5') == 0.5
+    assert groq_service.parse_duration('2m59.56s') == pytest.approx(179.56)
+    assert groq_service.parse_duration('150ms') == pytest.approx(0.15)
+    assert groq_service.parse_duration('1h') == 3600.0
+    assert 8 <= groq_service.parse_duration(formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert groq_service.parse_duration('') is None
+    assert groq_service.parse_duration(None) is None
+    assert groq_service.parse_duration('soon') is None
+
+
+def test_server_retry_hint_prefers_retry_after():
+    assert groq_service.server_retry_hint(429, {'retry-after': '3', 'x-ratelimit-reset-requests': '20s'}) == 3.0
+    spent = {'x-ratelimit-remaining-tokens': '0', 'x-ratelimit-reset-tokens': '7.5s',
+             'x-ratelimit-remaining-requests': '12', 'x-ratelimit-reset-requests': '1m'}
+    assert groq_service.server_retry_hint(200, spent) == 7.5
+    assert groq_service.server_retry_hint(429, {'x-ratelimit-reset-requests': '2s'}) == 2.0
+    assert groq_service.server_retry_hint(503, {'x-ratelimit-reset-requests': '2s'}) is None
+
+
+@pytest.fixture
+def shared_limiter(monkeypatch):
+    limiter = groq_service.TokenBucketRateLimiter(rate_per_minute=600, burst=5, state_file=None)
+    monkeypatch.setattr(groq_service, 'rate_limiter', limiter)
+    return limiter
+
+
+def test_retry_policy_backs_off_within_bounds(shared_limiter):
+    policy = groq_service.RetryPolicy(max_retries=3, base_delay=0.25, max_delay=8.0)
+    deadline = time.monotonic() + 60
+
+    assert policy.next_delay(0, 200, {}, deadline) is None
+    for attempt in range(3):
+        delay = policy.next_delay(attempt, 503, {}, deadline)
+        assert 0 <= delay <= 0.25 * 2 ** attempt
+    assert policy.next_delay(3, 503, {}, deadline) is None  # retries exhausted
+    assert policy.next_delay(0, 400, {}, deadline) is None  # not retryable
+    assert policy.get_stats()['exhausted'] == 1
+
+
+def test_retry_policy_honours_retry_after_and_pauses_everyone(shared_limiter):
+    policy = groq_service.RetryPolicy(max_retries=3, base_delay=0.25)
+
+    delay = policy.next_delay(0, 429, {'retry-after': '2'}, time.monotonic() + 60)
+    assert 2.0 <= delay <= 2.25
+    assert 1.5 < shared_limiter.paused_for() <= 2.0
+    assert not shared_limiter.acquire(max_wait=0)[0]
+
+
+def test_retry_policy_other_providers_pause_nobody(shared_limiter):
+    policy = groq_service.RetryPolicy(max_retries=3, base_delay=0.25)
+
+    assert policy.next_delay(0, 429, {'retry-after': '2'}, time.monotonic() + 60, shared=False) >= 2.0
+    assert shared_limiter.paused_for() == 0.0 and policy.paused_for() == 0.0
+
+
+def test_retry_policy_gives_up_past_the_deadline(shared_limiter):
+    policy = groq_service.RetryPolicy(max_retries=3, base_delay=0.25)
+
+    assert policy.next_delay(0, 429, {'retry-after': '5'}, time.monotonic() + 1) is None
+    assert policy.get_stats()['over_budget'] == 1
+
+
+def slow_stream(delay: float, log: list):
+    """Stream that waits `delay` before its first text and records what it produced"""
+    yield {'type': 'start'}
+    time.sleep(delay)
+    for index in range(3):
+        log.append(threading.current_thread().name)
+        yield {'type': 'delta', 'content': str(index)}
+    log.append('done')
+    yield {'type': 'done'}
+
+
+def test_iter_within_budget_hands_the_stream_to_the_request_thread():
+    log = []
+    events = list(groq_service.iter_within_budget(slow_stream(0, log), budget_ms=1000))
+
+    assert [event['type'] for event in events] == ['start', 'delta', 'delta', 'delta', 'done']
+    assert log[0].startswith('groq-hedge')  # pumped until the first text
+    assert log[1] == threading.current_thread().name
+
+
+def test_iter_within_budget_reports_a_full_hedge_pool(monkeypatch):
+    busy = threading.BoundedSemaphore(1)
+    busy.acquire()
+    monkeypatch.setattr(groq_service, '_hedge_slots', busy)
+    source = slow_stream(0, [])
+
+    events = list(groq_service.iter_within_budget(source, budget_ms=1000))
+    assert [event['error'] for event in events] == ['hedge_pool_exhausted']
+    assert groq_service.fallback_reason(events[0]) == 'hedge_pool_exhausted'
+    assert groq_service.call_within_budget(lambda: {'success': True}, budget_ms=1000)['hedge_pool_exhausted']
+
+
+def test_circuit_breaker_trips_probes_and_recovers():
+    breaker = groq_service.CircuitBreaker(failure_threshold=2, reset_seconds=0.05, name='test')
+    breaker.record_failure('api_error')
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+    breaker.record_failure('api_error')
+
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # a single probe at a time
+
+    breaker.record_failure('timeout')  # failed probe re-opens at once
+    assert breaker.state == breaker.OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+    stats = breaker.get_stats()
+    assert (stats['trips'], stats['recoveries'], stats['short_circuited']) == (1, 1, 2)
+    assert [t['to'] for t in stats['transitions']] == ['open', 'half_open', 'open', 'half_open', 'closed']
+
+
+def test_call_within_budget_returns_early_and_lets_the_call_finish():
+    finished = threading.Event()
+
+    def slow_call():
+        time.sleep(0.2)
+        finished.set()
+        return {'success': True}
+
+    started = time.monotonic()
+    result = groq_service.call_within_budget(slow_call, budget_ms=50)
+    assert result['budget_exceeded'] and groq_service.fallback_reason(result) == 'latency_budget'
+    assert time.monotonic() - started < 0.15
+    assert finished.wait(2)
+
+
+def test_iter_within_budget_ends_early_and_keeps_draining_the_source():
+    log = []
+    events = list(groq_service.iter_within_budget(slow_stream(0.2, log), budget_ms=50))
+
+    assert [event['type'] for event in events] == ['start', 'error']
+    assert events[-1]['error'] == groq_service.BUDGET_EXCEEDED_EVENT['error']
+    wait_for(lambda: log[-1:] == ['done'])  # drained to the end on the hedge thread
+    assert all(name.startswith('groq-hedge') for name in log[:-1])
+
+
+def test_conversation_store_keeps_a_ring_buffer_per_user():
+    store = groq_service.ConversationStore(turns_per_user=3, max_users=10, max_bytes=10 ** 6)
+    for index in range(5):
+        store.append('farmer', f'question {index}', f'answer {index}')
+
+    assert [turn['user_message'] for turn in store.recent('farmer')] == ['question 2', 'question 3', 'question 4']
+    assert store.bytes_used == sum(store._turn_bytes(turn) for turn in store.recent('farmer'))
+    store.clear('farmer')
+    assert store.recent('farmer') == [] and store.bytes_used == 0
+
+
+def test_conversation_store_evicts_least_recently_active_users():
+    store = groq_service.ConversationStore(turns_per_user=3, max_users=2, max_bytes=10 ** 6)
+    store.append('a', 'q', 'answer')
+    store.append('b', 'q', 'answer')
+    store.append('a', 'q2', 'answer')  # a is now the most recent
+    store.append('c', 'q', 'answer')
+
+    assert store.recent('b') == []
+    assert len(store.recent('a')) == 2 and len(store.recent('c')) == 1
+    assert store.get_stats()['evicted_users'] == 1
+
+
+def test_conversation_store_enforces_the_byte_cap():
+    turn_bytes = len('q') + len('x' * 100) + groq_service.ConversationStore.TURN_OVERHEAD_BYTES
+    store = groq_service.ConversationStore(turns_per_user=5, max_users=100, max_bytes=2 * turn_bytes)
+    for user in ('a', 'b', 'c'):
+        store.append(user, 'q', 'x' * 100)
+
+    assert store.get_stats()['users'] == 2 and store.recent('a') == []
+    assert store.bytes_used == 2 * turn_bytes
+    store.append('c', 'q', 'x' * 100)  # the active user is never evicted for its own turns
+    store.append('c', 'q', 'x' * 100)
+    assert store.get_stats()['users'] == 1 and len(store.recent('c')) == 3
+
+
+def test_context_messages_keep_the_newest_turns_within_the_token_budget():
+    store = groq_service.ConversationStore(turns_per_user=5, max_users=10, max_bytes=10 ** 6)
+    for index in range(3):
+        store.append('farmer', f'q{index}', f'{index}' * 400)  # 1 + 100 tokens per turn
+
+    messages = store.context_messages('farmer', token_budget=250)
+    assert [m['content'] for m in messages if m['role'] == 'user'] == ['q1', 'q2']
+    assert [m['role'] for m in messages] == ['user', 'assistant', 'user', 'assistant']
+    assert store.context_messages(None) == [] and store.context_messages('farmer', token_budget=0) == []
+
+    store.append('farmer', 'q3', 'y' * 2000)  # 500 tokens: only its head fits
+    messages = store.context_messages('farmer', token_budget=120)
+    assert [m['content'] for m in messages] == ['q3', 'y' * 476]
+
+
+@pytest.mark.parametrize('language, text', [
+    ('hindi', 'मेरी गेहूं की फसल पीली हो रही है, क्या करूं?'),
+    ('marathi', 'माझ्या कापूस पिकावर कीड आली आहे, काय करावे?'),
+    ('tamil', 'என் நெல் பயிரில் இலைகள் மஞ்சளாக மாறுகிறது'),
+    ('telugu', 'నా వరి పంటకు ఏ ఎరువు వేయాలి?'),
+    ('punjabi', 'ਮੇਰੀ ਕਣਕ ਦੀ ਫ਼ਸਲ ਪੀਲੀ ਹੋ ਰਹੀ ਹੈ'),
+    ('bengali', 'আমার ধান গাছে পোকা লেগেছে'),
+    ('gujarati', 'મારા કપાસમાં જીવાત છે'),
+    ('kannada', 'ನನ್ನ ರಾಗಿ ಬೆಳೆಗೆ ಯಾವ ಗೊಬ್ಬರ ಬೇಕು?'),
+    ('malayalam', 'എന്റെ നെൽ കൃഷിക്ക് ഏത് വളം വേണം?'),
+    ('english', 'Which fertilizer should I use for paddy?'),
+])
+def test_detect_script_language_per_script(language, text):
+    info = groq_service.detect_script_language(text)
+
+    assert info['language'] == language
+    assert info['region'] == groq_service.LANGUAGE_REGIONS[language]
+    assert info['is_indian_language'] == (language != 'english')
+    assert info['script_detected'] == (language != 'english')
+
+
+def test_detect_script_language_mixed_scripts_follow_the_majority():
+    assert groq_service.detect_script_language('urea dose for नेल? என் நெல் பயிரில் இலைகள்')['language'] == 'tamil'
+    info = groq_service.detect_script_language('Best time to sow गेहूं in Punjab')
+    assert info['language'] == 'hindi' and info['confidence'] == 2  # ग and ह: vowel signs are not letters
+
+
+def test_detect_script_language_long_text_matches_the_short_path():
+    text = 'ధాన్యం నిల్వ ' * 30 + 'rice storage ' * 40 + 'धान ' * 5
+    assert len(text) > groq_service.LONG_TEXT_CHARS
+    counts = groq_service._script_letter_counts(text)
+
+    assert counts == [text.translate(groq_service._SCRIPT_TRANSLATION).count(tag)
+                      for tag in groq_service._SCRIPT_TAGS.values()]
+    assert groq_service.detect_script_language(text)['language'] == 'telugu'
+
+
+def test_devanagari_splits_marathi_from_hindi():
+    assert groq_service._split_devanagari('मला शेती साठी पाणी किती लागेल?') == 'marathi'
+    assert groq_service._split_devanagari('मुझे खेती के लिए कितना पानी चाहिए?') == 'hindi'
+    assert groq_service._split_devanagari('पाणी उपलब्ध') == 'hindi'  # no markers, no ळ
+    assert groq_service._split_devanagari('पिवळी पाने') == 'marathi'  # ळ breaks the tie
@@ -0,0 +1,147 @@
+"""
+Unit tests for llm_router provider selection (in-process mock providers, no network)
+Run: python -m pytest -q test_llm_router.py
+"""
+import groq_service
+import llm_router
+from llm_router import LLMRouter, MockProvider
+
+
+def mock(name: str, latency_ms: float, **kwargs) -> MockProvider:
+    kwargs.setdefault('breaker', groq_service.CircuitBreaker(failure_threshold=3, reset_seconds=60, name=name))
+    return MockProvider(name, f'{name}-model', delay_ms=0, latency_ms=latency_ms, **kwargs)
+
+
+def test_router_prefers_lowest_latency_per_weight():
+    fast, slow = mock('fast', 200), mock('slow', 800)
+    router = LLMRouter([slow, fast], explore=0)
+    assert router.choose() is fast
+
+    heavy = mock('heavy', 800, weight=8)  # 100 ms per unit of weight
+    router = LLMRouter([fast, heavy], explore=0)
+    assert router.choose() is heavy
+    assert router.get_stats()['routed'] == {'heavy': 1}
+
+
+def test_router_follows_measured_latency():
+    first, second = mock('first', 100), mock('second', 500)
+    router = LLMRouter([first, second], explore=0)
+    for _ in range(llm_router.LLM_ROUTER_MIN_SAMPLES):
+        router.record(first, True, 900)
+        router.record(second, True, 300)
+
+    assert router.choose() is second
+
+
+def test_router_skips_providers_with_a_high_error_rate():
+    flaky, steady = mock('flaky', 100), mock('steady', 500)
+    flaky.breaker = None  # only the rolling error rate can rule it out
+    router = LLMRouter([flaky, steady], explore=0)
+    for _ in range(llm_router.LLM_ROUTER_MIN_SAMPLES):
+        router.record(flaky, False, reason='api_error')
+
+    assert router.choose() is steady
+
+
+def test_router_skips_open_breakers_and_returns_none_when_all_open():
+    first, second = mock('first', 100), mock('second', 500)
+    router = LLMRouter([first, second], explore=0)
+    for _ in range(3):
+        router.record(first, False, reason='api_error')
+    assert first.breaker_open()
+    assert router.choose() is second
+
+    for _ in range(3):
+        router.record(second, False, reason='api_error')
+    assert router.choose() is None
+    assert router.get_stats()['no_provider'] == 1
+
+
+def test_slow_answers_count_as_breaker_failures():
+    slow_limited, unlimited = mock('limited', 100, slow_ms=1000), mock('unlimited', 100, slow_ms=0)
+    router = LLMRouter([slow_limited, unlimited], explore=0)
+    for _ in range(3):
+        router.record(slow_limited, True, 5000)
+        router.record(unlimited, True, 5000)
+
+    assert slow_limited.breaker_open()
+    assert unlimited.breaker.state == groq_service.CircuitBreaker.CLOSED
+    assert slow_limited.stats.snapshot()['error_rate'] == 0.0  # slow but successful
+
+
+def test_router_respects_provider_quota():
+    quota, backup = mock('quota', 100, rpm=2), mock('backup', 500)
+    router = LLMRouter([quota, backup], explore=0)
+
+    assert [router.choose().name for _ in range(3)] == ['quota', 'quota', 'backup']
+
+
+def test_preferred_reserves_nothing():
+    quota, backup = mock('quota', 100, rpm=1), mock('backup', 500)
+    router = LLMRouter([quota, backup], explore=0)
+
+    assert router.preferred() is quota
+    assert router.preferred() is quota
+    assert router.get_stats()['routed'] == {}
+    assert router.choose() is quota
+    assert router.preferred() is backup
+
+
+def test_exploration_still_routes_to_healthy_providers():
+    fast, slow = mock('fast', 100), mock('slow', 900)
+    router = LLMRouter([fast, slow], explore=1.0)
+    picks = {router.choose().name for _ in range(200)}
+
+    assert picks == {'fast', 'slow'}
+    assert router.explored == 200
+
+
+class FakeLocalLLM:
+    """Local model stand-in that counts warm-up requests"""
+
+    model_label = 'fake-local'
+
+    def __init__(self):
+        self.status = 'not_loaded'
+        self.warm_ups = 0
+
+    def warm_up(self):
+        self.warm_ups += 1  # status stays not_loaded, as while a background load has not started yet
+
+    def is_ready(self) -> bool:
+        return self.status == 'ready'
+
+
+def test_local_provider_warms_up_once_and_health_checks_are_read_only():
+    llm = FakeLocalLLM()
+    local = llm_router.LocalProvider('local', llm=llm)
+    router = LLMRouter([local, mock('remote', 20000)], explore=0)
+
+    assert llm.warm_ups == 1
+    assert router.choose().name == 'remote'  # still loading
+    local.get_stats()
+    assert llm.warm_ups == 1
+    llm.status = 'ready'
+    assert router.choose() is local
+
+
+def test_build_router_from_config():
+    router = llm_router.build_router(config='[{"name": "a", "kind": "mock", "delay_ms": 10, "weight": 2},'
+                                            ' {"name": "b", "kind": "mock", "model": "m-b", "rpm": 5}]')
+
+    assert [p.name for p in router.providers] == ['a', 'b']
+    assert router.providers[0].weight == 2 and router.providers[1].rpm == 5
+    assert router.providers[1].model == 'm-b'
+
+
+def test_circuit_state_reports_the_named_provider():
+    first, second = mock('first', 100), mock('second', 500)
+    router = LLMRouter([first, second], explore=0)
+    for _ in range(3):
+        router.record(second, False, reason='api_error')
+
+    assert router.circuit_state('second') == 'open'
+    assert router.circuit_state('first') == 'closed'
+    assert router.circuit_state('knowledge_base') == 'closed'  # not routed: the preferred provider's state
+    first.breaker = None
+    assert router.circuit_state('first') == 'disabled'